@@ -7,14 +7,31 @@ Classes are to be organized by general purpose - see block comments for guidance
 """
 
 import bz2
+from array import array
+import bisect
+from collections.abc import Mapping, MutableMapping, Sequence
+from concurrent.futures import ThreadPoolExecutor
+import ctypes
+import ctypes.util
+import errno
 import ftplib
 import hashlib
+import io
 import json
+import mmap
 import multiprocessing as mp
 import os
 import pickle
+import queue
+import select
 import shutil
+import sqlite3
+import struct
+import sys
 import tarfile
+import threading
+import time
+import traceback
 from platform import system
 from textwrap import wrap
 
@@ -32,13 +49,98 @@ class RecoveryIndexError(Exception):
         return self.message
 
 
+class WorkerPoolError(Exception):
+    """Raised when the worker pool can't run the tasks given to it, such as
+    when a worker process has died."""
+
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+# Define Digest Algorithms
+
+# Every algorithm a run's digests may be taken with, by the name recorded as
+# "digestAlgorithm" in the RIFF's metaRun. BLAKE2b is cut to 32 bytes, so its
+# digests fit wherever a SHA-256 digest did. RIFFs without the key are SHA-256.
+DIGEST_ALGORITHMS = {"sha256": hashlib.sha256, "blake2b": lambda: hashlib.blake2b(digest_size=32)}
+
+
+def new_hasher(algorithm="sha256"):
+    """Returns a new hashlib object for the named digest algorithm.
+
+    :param algorithm: a key of DIGEST_ALGORITHMS.
+    """
+    if algorithm not in DIGEST_ALGORITHMS:
+        raise ValueError("%s is not a digest algorithm Tapestry knows." % algorithm)
+    return DIGEST_ALGORITHMS[algorithm]()
+
+
+# Define Storage Detection
+
+# Filesystem types, as named in /proc/self/mountinfo, which are served over a
+# network. Each is read once per process, as is the kind of each device.
+NETWORK_FILESYSTEMS = ("nfs", "nfs4", "cifs", "smb3", "smbfs", "9p", "ceph", "glusterfs", "fuse.sshfs",
+                       "afs", "davfs", "fuse.rclone")
+_mounted_filesystems = None
+_storage_types = {}  # st_dev: storage type
+
+
+def mounted_filesystem(device):
+    """Returns the filesystem type mounted from the given device number, as
+    listed in /proc/self/mountinfo, or None if it can't be found."""
+    global _mounted_filesystems
+    if _mounted_filesystems is None:
+        filesystems = {}
+        try:
+            with open("/proc/self/mountinfo", "r") as mountinfo:
+                for line in mountinfo:
+                    fields = line.split()
+                    separator = fields.index("-")
+                    filesystems[fields[2]] = fields[separator + 1]
+        except (OSError, ValueError, IndexError):
+            pass
+        _mounted_filesystems = filesystems
+    return _mounted_filesystems.get("%s:%s" % (os.major(device), os.minor(device)))
+
+
+def storage_type(device):
+    """Works out what kind of storage a device number belongs to. Only Linux
+    exposes enough to tell; anywhere else this is "unknown".
+
+    :param device: st_dev of a file on the device.
+    :return: one of "ssd", "rotational", "network" or "unknown".
+    """
+    if device in _storage_types:
+        return _storage_types[device]
+    kind = "unknown"
+    if system() == "Linux":
+        if mounted_filesystem(device) in NETWORK_FILESYSTEMS:
+            kind = "network"
+        else:
+            block = os.path.realpath("/sys/dev/block/%s:%s" % (os.major(device), os.minor(device)))
+            for queue_dir in (block, os.path.dirname(block)):  # Partitions keep their queue on the disk.
+                try:
+                    with open(os.path.join(queue_dir, "queue", "rotational"), "r") as flag:
+                        kind = "rotational" if flag.read().strip() == "1" else "ssd"
+                    break
+                except OSError:
+                    continue
+    _storage_types[device] = kind
+    return kind
+
+
 # Define Process and Task Classes
 
 
 class ChildProcess(mp.Process):
     """A simple, logicless worker process which iterates against a queue. This
     expects to find either a callable "task" class in the queue or the value
-    None, which indicates the process should exit.
+    None, which indicates the process should exit. Tasks may also be queued
+    as a (task_id, task) tuple, as the WorkerPool does, so that each result
+    can be matched to the task that produced it.
     """
 
     def __init__(self, queue_tasking, queue_complete, working_directory, locks, debug=False):
@@ -56,15 +158,16 @@ class ChildProcess(mp.Process):
         self.queue = queue_tasking
         self.debug = debug
         self.ret = queue_complete
+        self.working_directory = working_directory
         if not os.path.isdir(working_directory):
             os.mkdir(working_directory)
-        os.chdir(working_directory)
 
         global dict_locks
         dict_locks = locks
 
     def run(self):
         proc_name = self.name
+        os.chdir(self.working_directory)
         while True:
             next_task = self.queue.get()
             if next_task is None:
@@ -72,49 +175,455 @@ class ChildProcess(mp.Process):
                     self.ret.put('%s: Exiting' % proc_name)
                 self.queue.task_done()
                 break
-            try:
-                debug_message = next_task()
-                self.ret.put(debug_message)
-            except TypeError:
-                self.ret.put("Something has gone wrong - unexpected item in queue.")
+            if isinstance(next_task, tuple):
+                task_id, next_task = next_task
+            else:
+                task_id = None
+            self.ret.put(TaskResult.of(task_id, next_task))
             self.queue.task_done()
         return
 
 
-class TaskTarBuild(object):
-    """A simple task object which instructs the process to add a particular
-    file to a particular tarfile, all fully enumerated.
+class TaskResult(object):
+    """The outcome of a single task run by a ChildProcess. Whatever the task
+    returned is kept as the value; if the task raised instead, ok is False
+    and the traceback is kept as the error, so one bad task can't take its
+    worker down with it.
+    """
+
+    def __init__(self, task_id, task_name, ok, value=None, error=None, elapsed=0.0):
+        """
+        :param task_id: the id the task was submitted under, or None.
+        :param task_name: the class name of the task.
+        :param ok: False if the task raised an exception.
+        :param value: whatever the task returned.
+        :param error: the formatted traceback, if the task raised.
+        :param elapsed: seconds spent running the task.
+        """
+        self.task_id = task_id
+        self.task_name = task_name
+        self.ok = ok
+        self.value = value
+        self.error = error
+        self.elapsed = elapsed
+
+    @classmethod
+    def of(cls, task_id, task):
+        """Runs the task and captures its outcome.
+
+        :param task_id: the id the task was submitted under, or None.
+        :param task: any callable task object.
+        :return: a TaskResult.
+        """
+        started = time.monotonic()
+        try:
+            value = task()
+        except Exception:
+            return cls(task_id, type(task).__name__, False, error=traceback.format_exc(),
+                       elapsed=time.monotonic() - started)
+        return cls(task_id, type(task).__name__, True, value, elapsed=time.monotonic() - started)
+
+    def __str__(self):
+        if self.ok:
+            return str(self.value)
+        return "%s failed: %s" % (self.task_name, self.error.strip().splitlines()[-1])
+
+
+class WorkerPool(object):
+    """A long-lived set of ChildProcess workers sharing one pair of queues.
+    The pool is started once per run and every stage submits its tasks to
+    it, so workers are not created and poisoned again for each stage.
+    """
+
+    def __init__(self, working_directory, size=None, debug=False):
+        """
+        :param working_directory: absolute path the workers will run in.
+        :param size: number of workers; defaults to os.cpu_count().
+        :param debug: Boolean, passed through to the workers.
+        """
+        self.working_directory = working_directory
+        self.size = size or os.cpu_count()
+        self.debug = debug
+        self.jobs = mp.JoinableQueue()
+        self.done = mp.JoinableQueue()
+        self.workers = []
+        self.outstanding = set()
+        self.next_id = 0
+
+    def start(self):
+        """Starts the workers. Workers are daemonic, so a parent that dies
+        without calling shutdown() does not leave them behind."""
+        for i in range(self.size):
+            worker = ChildProcess(self.jobs, self.done, self.working_directory, {}, self.debug)
+            worker.daemon = True
+            self.workers.append(worker)
+        for worker in self.workers:
+            worker.start()
+        return self
+
+    def submit(self, task):
+        """Queues a task for the next free worker.
+
+        :param task: any callable (and picklable) task object.
+        :return: the id the task's TaskResult will carry.
+        """
+        if not self.workers:
+            raise WorkerPoolError("Tasks were submitted to a worker pool that was not started.")
+        task_id = self.next_id
+        self.next_id += 1
+        self.outstanding.add(task_id)
+        self.jobs.put((task_id, task))
+        return task_id
+
+    def get(self):
+        """Waits for the next task to finish, in whatever order they finish.
+        Raises WorkerPoolError if a worker dies while tasks are still
+        outstanding, rather than waiting forever for a result that will never
+        come.
+
+        :return: a TaskResult.
+        """
+        while True:
+            try:
+                result = self.done.get(timeout=1)
+            except queue.Empty:
+                for worker in self.workers:
+                    if not worker.is_alive():
+                        raise WorkerPoolError("Worker %s exited unexpectedly with code %s."
+                                              % (worker.name, worker.exitcode))
+                continue
+            self.done.task_done()
+            if isinstance(result, TaskResult) and result.task_id in self.outstanding:
+                self.outstanding.discard(result.task_id)
+                return result
+
+    def run(self, tasks):
+        """Submits every task, then yields their results as they finish.
+
+        :param tasks: an iterable of task objects.
+        :return: a generator of TaskResult objects.
+        """
+        submitted = [self.submit(task) for task in tasks]
+        for i in range(len(submitted)):
+            yield self.get()
+
+    def shutdown(self, timeout=10):
+        """Poisons every worker and waits for it to exit. Any worker still
+        running after the timeout is terminated.
+
+        :param timeout: seconds to wait for each worker.
+        :return:
+        """
+        for worker in self.workers:
+            if worker.is_alive():
+                self.jobs.put(None)
+        for worker in self.workers:
+            worker.join(timeout)
+            if worker.is_alive():
+                worker.terminate()
+                worker.join()
+        self.workers = []
+        self.outstanding = set()
+
+
+class TaskBlockBuild(object):
+    """A task object which instructs the process to build one complete block
+    tarfile. The block is owned entirely by the process that receives this
+    task, so every member is streamed into a single open handle and no lock
+    is needed to protect the tarfile.
     """
 
-    def __init__(self, tarf, fid, path, bname):
+    def __init__(self, tarf, members, riff=None, hash_files=False, algorithm="sha256"):
         """
-        Create the tarfile or, otherwise, add a file to it.
-        :param tarf: which tarfile to use, relative to the working directory
-        :param fid: GUID FID as a string.
-        :param path: absolute path to the file in need of backup
-        :param bname: block name, used as a key to the locks dictionary.
+        Create the tarfile and add every member of the block to it, in order.
+        :param tarf: which tarfile to create, relative to the working directory
+        :param members: a list of (fid, path) tuples, where fid is the GUID FID
+        as a string and path is the absolute path to the file in need of backup
+        :param riff: absolute path to the block's RIFF file (optional), which
+        is added last as "recovery-riff", once the offset and length of each
+        member have been written into it.
+        :param hash_files: if True, each member is hashed as it is streamed
+        into the tarfile, and the digests are returned along with each
+        member's position so that the index can be finalized after packing.
+        :param algorithm: the digest algorithm to hash with, if hash_files.
+
+        A member which has gone, or can't be read, since the crawl found it is
+        left out of the block and its RIFF, and reported with the error, so
+        that one such file doesn't cost the rest of the block.
         """
         self.tarf = tarf
-        self.a = fid
-        self.b = path
-        self.block = bname
+        self.members = members
+        self.riff = riff
+        self.hash_files = hash_files
+        self.algorithm = algorithm
 
     def __call__(self):
-        global dict_locks
+        layout = {}
+        skipped = {}
+        with tarfile.open(name=self.tarf, mode="w:") as tar:
+            for fid, path in self.members:
+                start = tar.offset
+                try:
+                    if self.hash_files:
+                        member = self.add_hashed(tar, fid, path, self.algorithm)
+                    else:
+                        tar.add(path, arcname=fid, recursive=False)
+                        member = {}
+                except OSError as e:
+                    if e.filename != path:  # Not the source file's fault, such as a full disk.
+                        raise
+                    tar.fileobj.seek(start)  # Takes back anything already written for it.
+                    tar.fileobj.truncate()
+                    tar.offset = start
+                    skipped.update({fid: str(e)})
+                    continue
+                member.update({"offset": start, "length": tar.offset - start})
+                layout.update({fid: member})
+            if self.riff is not None:
+                self.record_layout(self.riff, layout, skipped)
+                tar.add(self.riff, arcname="recovery-riff", recursive=False)
+
+        return ["Added %s files to tarfile %s" % (len(layout), self.tarf), layout, skipped]
+
+    @staticmethod
+    def record_layout(riff, layout, skipped=None):
+        """Writes the position of each member into a block's RIFF, just before
+        the RIFF is added to the end of the block, and removes any files which
+        were left out of the block.
+
+        :param riff: path to the block's RIFF file.
+        :param layout: dict of FID: {"offset": int, "length": int}.
+        :param skipped: optional dict of FID: error for files left out.
+        """
+        with open(riff, "r") as f:
+            dict_riff = json.load(f)
+        for fid in skipped or {}:
+            dict_riff["index"].pop(fid, None)
+        for fid, entry in dict_riff["index"].items():
+            if fid in layout:
+                entry.update({"offset": layout[fid]["offset"], "length": layout[fid]["length"]})
+        with open(riff, "w") as f:
+            json.dump(dict_riff, f)
+
+    @staticmethod
+    def add_hashed(tar, fid, path, algorithm="sha256"):
+        """Adds one file to the open tarfile, hashing its contents on the way
+        in, and reports whether it changed between being stat'd and read.
+
+        :param tar: an open tarfile.TarFile in a write mode.
+        :param fid: the FID to use as the member name.
+        :param path: absolute path to the file.
+        :param algorithm: the digest algorithm to hash with.
+        :return: dict of the digest (under "sha256", as in the index) and
+        fsize of the member as stored, and a boolean "changed" flag.
+        """
+        if os.path.islink(path):  # Links are stored as links, but indexed by their target's contents.
+            tar.add(path, arcname=fid, recursive=False)
+            hasher = new_hasher(algorithm)
+            with open(path, "rb") as source:
+                for chunk in iter(lambda: source.read(io.DEFAULT_BUFFER_SIZE), b""):
+                    hasher.update(chunk)
+            return {"sha256": hasher.hexdigest(), "fsize": os.path.getsize(path), "changed": False}
+
+        with open(path, "rb") as source:
+            before = os.fstat(source.fileno())
+            tarinfo = tar.gettarinfo(arcname=fid, fileobj=source)
+            reader = HashingReader(source, tarinfo.size, algorithm)
+            tar.addfile(tarinfo, reader)
+            changed = reader.short or source.read(1) != b""
+            after = os.fstat(source.fileno())
+        if after.st_size != before.st_size or after.st_mtime_ns != before.st_mtime_ns:
+            changed = True
+
+        return {"sha256": reader.hexdigest(), "fsize": tarinfo.size, "changed": changed}
+
+
+class TaskBlockStream(object):
+    """A task object which produces one finished block in a single pass. The
+    tarfile is written into a pipe by a helper thread, compressed on the way
+    in, and read out of the pipe by gpg, which writes the armored .tap
+    straight into the output directory. No intermediate file is written, so
+    the scratch space used is bounded by the pipe buffers rather than by the
+    size of the block. Members are hashed as they are streamed in, so that
+    the block can be validated without reading it back. The position of each
+    member in the tarball is returned with its digest.
+    """
+
+    def __init__(self, tap, members, riff, fp, gpg, compression_level=None, index=None, algorithm="sha256"):
+        """
+        :param tap: absolute path of the .tap file to create.
+        :param members: a list of (fid, path) tuples, as for TaskBlockBuild.
+        :param riff: absolute path to the block's RIFF file, which is added
+        last as "recovery-riff" (optional; may be None).
+        :param fp: the fingerprint of the PGP key to encrypt to.
+        :param gpg: a gnupg.GPG object used to perform the encryption.
+        :param compression_level: integer between 1 and 9 to compress the
+        tarfile with bz2 on its way to gpg, or None for no compression.
+        :param index: absolute path to a binary index (see BinaryIndex), which
+        is added after the RIFF as "recovery-index" (optional; may be None).
+        :param algorithm: the digest algorithm to hash members with.
+        """
+        self.tap = tap
+        self.members = members
+        self.riff = riff
+        self.fp = fp
+        self.gpg = gpg
+        self.level = compression_level
+        self.index = index
+        self.algorithm = algorithm
+
+    def produce(self, write_end, digests, skipped, errors):
+        """Writes the block's tarfile into the write end of the pipe. Runs in
+        its own thread while gpg consumes the read end. A member which can't
+        be opened is left out, as in TaskBlockBuild."""
+        try:
+            with open(write_end, "wb") as pipe:
+                if self.level:
+                    sink = bz2.BZ2File(pipe, "wb", compresslevel=self.level)
+                else:
+                    sink = pipe
+                try:
+                    with tarfile.open(fileobj=sink, mode="w|") as tar:
+                        for fid, path in self.members:
+                            start = tar.offset
+                            try:
+                                member = TaskBlockBuild.add_hashed(tar, fid, path, self.algorithm)
+                            except OSError as e:
+                                if e.filename != path or tar.offset != start:  # A stream can't be taken back.
+                                    raise
+                                skipped.update({fid: str(e)})
+                                continue
+                            member.update({"offset": start, "length": tar.offset - start})
+                            digests.update({fid: member})
+                        if self.riff is not None:
+                            TaskBlockBuild.record_layout(self.riff, digests, skipped)
+                            tar.add(self.riff, arcname="recovery-riff", recursive=False)
+                        if self.index is not None:
+                            tar.add(self.index, arcname="recovery-index", recursive=False)
+                finally:
+                    if sink is not pipe:
+                        sink.close()
+        except (OSError, tarfile.TarError) as e:  # Includes a broken pipe if gpg gives up early.
+            errors.append(str(e))
+        except Exception as e:  # Raised in this thread, it would otherwise be lost.
+            errors.append("%s: %s" % (type(e).__name__, e))
+
+    def __call__(self):
+        digests = {}
+        skipped = {}
+        errors = []
+        read_end, write_end = os.pipe()
+        producer = threading.Thread(target=self.produce, args=(write_end, digests, skipped, errors))
+        producer.start()
+        with open(read_end, "rb") as stream:
+            try:
+                k = self.gpg.encrypt_file(stream, self.fp, output=self.tap, armor=True, always_trust=True)
+                encrypted, status = k.ok, k.status
+            except OSError as e:  # gpg stops reading if it rejects the recipient, which breaks the pipe.
+                encrypted, status = False, "gpg stopped reading the block (%s)" % e
+        producer.join()  # Closing the read end lets the producer fail rather than wait on gpg.
+
+        if encrypted and not errors:
+            return [True, "Streamed %s files into %s" % (len(digests), self.tap), digests, skipped]
+        return [False, "Streaming Failed for %s, status: %s %s" % (self.tap, status, " ".join(errors)), digests,
+                skipped]
+
+
+class TaskBlockRestore(object):
+    """A task object which restores files from one block in a single pass,
+    the reverse of TaskBlockStream. gpg's decrypted output is written into a
+    pipe as it is produced, and a helper thread reads the other end with a
+    TaskTarExtractBlock, which decompresses it if need be and writes each
+    wanted file to its final location. No decrypted or decompressed copy of
+    the block is ever written.
+    """
+
+    def __init__(self, tap, entries, gpg):
+        """
+        :param tap: absolute path of the .tap file to restore from.
+        :param entries: list of (fid, category_dir, path_end) tuples, as for
+        TaskTarExtractBlock.
+        :param gpg: a gnupg.GPG object used to perform the decryption.
+        """
+        self.tap = tap
+        self.entries = entries
+        self.gpg = gpg
+        self.sink = None
+
+    def extract(self, read_end, outcome):
+        """Restores the files from the read end of the pipe. Runs in its own
+        thread while gpg feeds the write end."""
+        with open(read_end, "rb") as stream:
+            outcome.extend(TaskTarExtractBlock(stream, self.entries)())
+
+    def feed(self, chunk):
+        """Called by gnupg with each chunk of decrypted output, and with an
+        empty chunk at the end. Returns False so gnupg doesn't keep a copy."""
+        if self.sink is not None:
+            try:
+                if chunk:
+                    self.sink.write(chunk)
+                else:
+                    self.sink.close()
+                    self.sink = None
+            except OSError:  # The extractor has stopped reading, so the rest is thrown away.
+                try:
+                    self.sink.close()
+                except OSError:
+                    pass
+                self.sink = None
+        return False
+
+    def __call__(self):
+        outcome = []
+        read_end, write_end = os.pipe()
+        extractor = threading.Thread(target=self.extract, args=(read_end, outcome))
+        extractor.start()
+        self.sink = open(write_end, "wb")
+        self.gpg.on_data = self.feed
+        try:
+            with open(self.tap, "rb") as tap:
+                k = self.gpg.decrypt_file(tap, always_trust=True)
+        finally:
+            self.gpg.on_data = None
+            self.feed(b"")
+        extractor.join()
+
+        if not outcome:
+            outcome = [False, "", {fid: "not restored" for fid, category_dir, path_end in self.entries}]
+        block_ok, message, failures = outcome
+        if not k.ok:
+            return [False, "Decryption Failed for %s, status: %s" % (self.tap, k.status), failures]
+        return [block_ok, "Restored %s of %s files from %s" % (len(self.entries) - len(failures),
+                                                                 len(self.entries), self.tap), failures]
+
+
+class TaskStage(object):
+    """Wraps another task so that a scheduler can tell which block and stage
+    each result belongs to, and how long the work took.
+    """
 
-        f_lock = dict_locks[self.block]  # Aquires the lock indicated in the index value from the master
-        f_lock.acquire()
-        tar = tarfile.open(name=self.tarf, mode="a:")
-        tar.add(self.b, arcname=self.a, recursive=False)
-        tar.close()
-        f_lock.release()
+    def __init__(self, stage, block, task):
+        """
+        :param stage: string naming the stage, such as "compress".
+        :param block: the name of the block the task is working on.
+        :param task: any callable task object.
+        """
+        self.stage = stage
+        self.block = block
+        self.task = task
 
-        return "Added %s to tarfile %s" % (self.b, self.tarf)
+    def __call__(self):
+        started = time.monotonic()
+        result = self.task()
+        return [self.stage, self.block, result, time.monotonic() - started]
 
 
 class TaskTarUnpack(object):
     """A simple object that describes a file to pull from a particular tarfile
-    and puts it back where it belongs. Absolute paths required.
+    and puts it back where it belongs. Absolute paths required. Restoring a
+    whole block this way reads the block once per file; unpack_blocks uses a
+    TaskTarExtractBlock per block instead.
     """
     def __init__(self, tar, fid, category_dir, path_end):
         """Initializing this object gives it all the information it needs to
@@ -132,26 +641,65 @@ class TaskTarUnpack(object):
         self.pathend = path_end
 
     def __call__(self):
-        path_end = self.pathend.strip('~/')
-        abs_path_out = os.path.join(self.catdir, path_end)
-        placement, name_proper = os.path.split(abs_path_out)
-        # split the pathend component into the subpath from the category dir, and the original filename
-        # print("Attempting to pull %s" % self.fid)
-        unpacking = True
-        while unpacking:
-            try:  # Issue 13: need to catch the raise from tf.extract() when workers collide
-                with tarfile.open(self.tar, "r:*") as tf:
-                    # print("Now opened: %s" % self.tar)  # Debugging statement, uncomment to use.
-                    tf.extract(self.fid, path=placement)  # the file is now located where it needs to be.
-                    # print("Extracted %s" % self.fid)  # Debugging statement, uncomment to use.
-                    placed = os.path.join(placement, self.fid)
-                    os.rename(placed, abs_path_out)  # and now it's named correctly.
-                    unpacking = False
-            except FileExistsError:
-                unpacking = True
+        abs_path_out = os.path.join(self.catdir, self.pathend.strip('~/'))
+        restored, message, failures = TaskTarExtractBlock(self.tar, [(self.fid, self.catdir, self.pathend)])()
+        if not restored:
+            return "Failed to restore %s: %s" % (self.fid, failures[self.fid])
         return "Restored %s to %s" % (self.fid, abs_path_out)
 
 
+class TaskTarExtractBlock(object):
+    """Restores files from one block in a single sequential pass. Members are
+    read in the order they were packed, and each one wanted is written to its
+    final location as it goes by, so no member is looked up and the block is
+    never re-read. Reading stops as soon as every wanted file is restored.
+    Blocks are extracted in parallel by giving each its own task.
+    """
+    def __init__(self, tar, entries):
+        """
+        :param tar: string describing the absolute path of the relevant
+        tarball, or a readable binary stream carrying it.
+        :param entries: list of (fid, category_dir, path_end) tuples, with the
+        same meanings as the arguments to TaskTarUnpack.
+        """
+        self.tar = tar
+        self.entries = entries
+
+    def __call__(self):
+        wanted = {fid: (category_dir, path_end) for fid, category_dir, path_end in self.entries}
+        failures = {}
+        restored = 0
+        if hasattr(self.tar, "read"):
+            source = {"fileobj": self.tar}
+        else:
+            source = {"name": self.tar}
+        try:
+            with tarfile.open(mode="r|*", **source) as tf:
+                for member in tf:
+                    if member.name not in wanted:
+                        continue
+                    category_dir, path_end = wanted.pop(member.name)
+                    abs_path_out = os.path.join(category_dir, path_end.strip('~/'))
+                    placement = os.path.split(abs_path_out)[0]
+                    try:
+                        os.makedirs(placement, exist_ok=True)  # Other blocks may be making it too.
+                        tf.extract(member, path=placement)
+                        os.rename(os.path.join(placement, member.name), abs_path_out)
+                        restored += 1
+                    except (OSError, tarfile.TarError) as e:
+                        failures.update({member.name: str(e)})
+                    if not wanted:
+                        break
+        except (OSError, tarfile.TarError) as e:
+            for fid in wanted:
+                failures.update({fid: str(e)})
+            wanted = {}
+        for fid in wanted:
+            failures.update({fid: "not found in block"})
+        message = "Restored %s of %s files from %s" % (restored, len(self.entries), self.tar)
+        return [len(failures) == 0, message, failures]
+
+
 class TaskCompress(object):
     """A simple task that points exactly to a tarfile to compress, and then
     compresses it to a specified level
@@ -309,35 +857,79 @@ class TaskCheckIntegrity(object):
     against it's known-good composition, based on the MD5 hash.
     """
 
-    def __init__(self, tar_file, fid, kg_hash):
+    def __init__(self, tar_file, fid, kg_hash, algorithm="sha256", chunk_size=1048576):
         """Provided with a tarfile, an FID found within it, and a known good
         hash, returns True or False if the file matches, as well as a string
         used in debugging.
 
         :param tar_file: string denoting absolute path to the tarball
         :param fid: GUID file identifier of the file in question.
-        :param hash: the output of md5.hexdigest(), as found (e.g) in the RIFF
+        :param kg_hash: the hexdigest of the file, as found (e.g) in the RIFF
+        :param algorithm: the digest algorithm of the run the RIFF describes.
+        :param chunk_size: the number of bytes to hash at a time.
         """
         self.tarf = tar_file
         self.fid = fid
         self.hash_good = kg_hash
+        self.algorithm = algorithm
+        self.chunk_size = chunk_size
 
     def __call__(self):
-        hasher = hashlib.sha256()  # Had to change this because switched to sha256 from md5 in functions.py.
+        hasher = new_hasher(self.algorithm)
         with tarfile.open(self.tarf, "r:*") as tarball:
             file_under_test = tarball.extractfile(self.fid)
             if file_under_test is None:
                 return [False, "File %s not found in block\n" % self.fid]
-            else:
-                hasher.update(file_under_test.read())
+            chunk = file_under_test.read(self.chunk_size)
+            while chunk != b"":
+                hasher.update(chunk)
+                chunk = file_under_test.read(self.chunk_size)
         if hasher.hexdigest() == self.hash_good:
             return [True, "File %s has a valid hash." % self.fid]
         else:
-            print(hasher.hexdigest())
-            print(self.hash_good)
             return [False, "File %s has an invalid hash.\n" % self.fid]
 
 
+class TaskVerifyBlock(object):
+    """A task, to be completed by ChildProcess, which reads a whole block in a
+    single sequential pass and hashes every member as it goes by, so that a
+    compressed block is only decompressed once no matter how many members it
+    holds. The digests are returned for comparison against the index.
+    """
+
+    def __init__(self, tar_file, chunk_size=1048576, algorithm="sha256"):
+        """Provided with a tarfile, prepares to hash its members.
+
+        :param tar_file: string denoting absolute path to the tarball, which
+        may be compressed with any method tarfile can detect.
+        :param chunk_size: the number of bytes to hash at a time.
+        :param algorithm: the digest algorithm of the index the digests will
+        be compared with.
+        """
+        self.tarf = tar_file
+        self.chunk_size = chunk_size
+        self.algorithm = algorithm
+
+    def __call__(self):
+        digests = {}
+        try:
+            with tarfile.open(self.tarf, "r|*") as tarball:
+                for member in tarball:
+                    if member.name in ["recovery-riff", "recovery-index"] or not member.isfile():
+                        continue
+                    hasher = new_hasher(self.algorithm)
+                    contents = tarball.extractfile(member)
+                    chunk = contents.read(self.chunk_size)
+                    while chunk != b"":
+                        hasher.update(chunk)
+                        chunk = contents.read(self.chunk_size)
+                    digests.update({member.name: hasher.hexdigest()})
+        except (tarfile.TarError, EOFError, OSError) as e:
+            return [False, "Block %s could not be read completely: %s\n" % (self.tarf, e), digests]
+
+        return [True, "Hashed %s files in block %s" % (len(digests), self.tarf), digests]
+
+
 # Define Package Overrides
 
 
@@ -394,9 +986,23 @@ class Block(object):
         else:  # This file won't fit and has to be placed somewhere else.
             return False
 
-    def meta(self, sum_blocks, sum_size, sum_files, datestamp, comment_string, full_index, drop_dir):
+    def efficiency(self):
+        """Returns the fill efficiency of the block, as the fraction of
+        max_size which is taken up by the files placed in it."""
+        if self.max_size <= 0:
+            return 0.0
+        return self.size / self.max_size
+
+    def meta(self, sum_blocks, sum_size, sum_files, datestamp, comment_string, full_index, drop_dir,
+             base_run=None, referenced_runs=None, scope="block", digest_algorithm="sha256"):
         """Provided these arguments, populate the runMetadata portion of a RIFF,
-        then create the corresponding RIFF file.
+        then create the corresponding RIFF file. An incremental run also
+        provides the run it was compared against and the list of earlier runs
+        whose blocks hold its unchanged files.
+
+        A block's RIFF only indexes the files in that block; the whole of
+        full_index is written once per run, by the index block (block 0),
+        which passes scope="run".
         """
         meta_value = {}
         meta_value.update({"sumBlock": sum_blocks})
@@ -406,27 +1012,1398 @@ class Block(object):
         if comment_string is None:
             comment_string = "No Comment"
         meta_value.update({"comment": comment_string})
+        meta_value.update({"digestAlgorithm": digest_algorithm})
+        if base_run is not None:
+            meta_value.update({"baseRun": base_run})
+            meta_value.update({"referencedRuns": referenced_runs})
         self.run_metadata = meta_value
 
         self.block_metadata = {
             "numBlock": self.num_block, "sizeLarge": self.size, "countFiles": self.files
         }
 
-        self.global_index = full_index
+        if scope == "run":
+            self.global_index = full_index
+        elif isinstance(self.file_index, FileTable):  # Read from the ops list itself, so already final.
+            self.global_index = self.file_index
+        else:  # The ops list holds the final form of each entry, such as fused digests.
+            self.global_index = {fid: full_index.get(fid, entry) for fid, entry in self.file_index.items()}
 
         dict_riff = {"metaBlock": self.block_metadata, "metaRun": self.run_metadata,
-                     "index": self.global_index}
+                     "indexScope": scope, "index": self.global_index}
 
         with open(os.path.join(drop_dir, self.name+".riff"), "w") as riff:
-            json.dump(dict_riff, riff)
+            if isinstance(self.global_index, FileTable):  # Written an entry at a time, never all in memory.
+                dict_riff.update({"index": {}})
+                head = json.dumps(dict_riff)
+                riff.write(head[:-2])
+                separator = ""
+                for fid, entry in self.global_index.items():
+                    riff.write(separator + json.dumps(fid) + ": " + json.dumps(dict(entry)))
+                    separator = ", "
+                riff.write("}}")
+            else:
+                json.dump(dict_riff, riff, default=dict)  # FileEntry objects are written as the dicts they stand for.
 
         return os.path.join(drop_dir, (self.name+".riff"))
 
 
+class BlockPacker(object):
+    """First-fit-decreasing bin packer used to perform the blocksort. Files are
+    expected to be offered largest-first; each is placed in the earliest block
+    with room for it, opening a new block only when none has room.
+
+    The remaining capacity of every block is kept in a max segment tree, so
+    finding the first block that fits is O(log blocks) rather than a scan of
+    every block (or every file) for each placement.
+
+    When given a FileTable, each block's file_index is a view of that table,
+    so the blocks only hold their running totals.
+    """
+
+    def __init__(self, name_base, max_size, smallest, table=None):
+        """Initialize an empty packer.
+
+        :param name_base: string, the common prefix of the output block names
+        :param max_size: int in bytes, the capacity of each block
+        :param smallest: int in bytes, the size of the smallest file to pack
+        :param table: the FileTable being packed, if the ops list is one.
+        """
+        self.name_base = name_base
+        self.max_size = max_size
+        self.smallest = smallest
+        self.table = table
+        self.blocks = []
+        self.leaves = 1
+        self.tree = [-1, -1]  # Index 1 is the root; -1 marks a block that does not exist yet.
+
+    def _grow(self):
+        """Doubles the number of leaves available in the tree."""
+        self.leaves *= 2
+        tree = [-1] * (2 * self.leaves)
+        for i, block in enumerate(self.blocks):
+            tree[self.leaves + i] = block.remaining
+        for node in range(self.leaves - 1, 0, -1):
+            tree[node] = max(tree[2 * node], tree[2 * node + 1])
+        self.tree = tree
+
+    def _update(self, position):
+        """Refreshes the remaining capacity of one block up to the root."""
+        node = self.leaves + position
+        self.tree[node] = self.blocks[position].remaining
+        node //= 2
+        while node >= 1:
+            self.tree[node] = max(self.tree[2 * node], self.tree[2 * node + 1])
+            node //= 2
+
+    def _first_fit(self, size):
+        """Returns the position of the first block with at least size bytes
+        remaining, or None if there is no such block."""
+        if self.tree[1] < size:
+            return None
+        node = 1
+        while node < self.leaves:
+            if self.tree[2 * node] >= size:
+                node = 2 * node
+            else:
+                node = 2 * node + 1
+        return node - self.leaves
+
+    def _open_block(self):
+        """Adds a new, empty block to the end of the list of blocks."""
+        if len(self.blocks) == self.leaves:
+            self._grow()
+        count = len(self.blocks) + 1
+        self.blocks.append(Block(self.name_base + "-" + str(count), self.max_size, count, self.smallest))
+        if self.table is not None:
+            self.blocks[-1].file_index = self.table.in_block(count)
+        self._update(count - 1)
+        return count - 1
+
+    def place(self, file_identifier, file_index_object):
+        """Places a file in the first block which can hold it, and returns
+        that block. Raises ValueError if the file is larger than a block."""
+        size = file_index_object['fsize']
+        if size > self.max_size:
+            raise ValueError("%s is larger than the maximum block size." % file_identifier)
+        position = self._first_fit(size)
+        if position is None:
+            position = self._open_block()
+        block = self.blocks[position]
+        block.put(file_identifier, file_index_object)
+        self._update(position)
+        return block
+
+
+class FileEntry(MutableMapping):
+    """A compact entry in the ops list, standing in for the dict of "fname",
+    "fpath", "category", "sha256" and "fsize" (and, later, "run", "block",
+    "offset", "length" and "changedDuringRead") that build_ops_list used to
+    make for every file. It behaves like that dict, so the rest of Tapestry
+    reads and updates it the same way, but holds its values in slots: the
+    category and directory are interned, so every file in a directory shares
+    one copy of its path, the name is only kept once, and the digest is kept
+    as 32 bytes rather than 64 hex characters.
+    """
+    __slots__ = ("category", "directory", "fname", "digest", "fsize", "run", "block", "offset", "length", "extra")
+    optional = ("run", "block", "offset", "length")
+
+    def __init__(self, category, fpath, fsize, sha256=None):
+        """
+        :param category: the category label the file was found in.
+        :param fpath: the file's path relative to its category.
+        :param fsize: the size of the file in bytes.
+        :param sha256: the hex digest of the file, or None if not yet known.
+        """
+        self.category = sys.intern(category)
+        directory, self.fname = os.path.split(fpath)
+        self.directory = sys.intern(directory)
+        self.fsize = fsize
+        self.digest = None
+        if sha256 is not None:
+            self.digest = bytes.fromhex(sha256)
+        self.run = self.block = self.offset = self.length = self.extra = None
+
+    def __getitem__(self, key):
+        if key == "fname":
+            return self.fname
+        elif key == "fpath":
+            return os.path.join(self.directory, self.fname)
+        elif key == "category":
+            return self.category
+        elif key == "sha256":
+            if self.digest is None:
+                return None
+            return self.digest.hex()
+        elif key == "fsize":
+            return self.fsize
+        elif key in self.optional and getattr(self, key) is not None:
+            return getattr(self, key)
+        elif self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key == "fname":
+            self.fname = value
+        elif key == "fpath":
+            directory, self.fname = os.path.split(value)
+            self.directory = sys.intern(directory)
+        elif key == "category":
+            self.category = sys.intern(value)
+        elif key == "sha256":
+            self.digest = None
+            if value is not None:
+                self.digest = bytes.fromhex(value)
+        elif key == "fsize":
+            self.fsize = value
+        elif key == "run" and value is not None:
+            self.run = sys.intern(value)
+        elif key in self.optional and value is not None:
+            setattr(self, key, value)
+        else:  # Anything else, such as changedDuringRead, is rare enough to keep in a dict of its own.
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self.optional and getattr(self, key) is not None:
+            setattr(self, key, None)
+        elif self.extra is not None and key in self.extra:
+            del self.extra[key]
+        else:
+            raise KeyError(key)
+
+    def __iter__(self):
+        yield from ["fname", "sha256", "category", "fpath", "fsize"]
+        for key in self.optional:
+            if getattr(self, key) is not None:
+                yield key
+        if self.extra is not None:
+            yield from self.extra
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+    def __repr__(self):
+        return "FileEntry(%s)" % dict(self)
+
+    def copy(self):
+        """Returns a new FileEntry with the same values."""
+        clone = FileEntry.__new__(FileEntry)
+        for slot in FileEntry.__slots__:
+            setattr(clone, slot, getattr(self, slot))
+        if self.extra is not None:
+            clone.extra = dict(self.extra)
+        return clone
+
+
+class FileTableEntry(FileEntry):
+    """A FileEntry read from a FileTable. Any change made to it is written
+    back to the table it came from."""
+    __slots__ = ("table", "fid")
+
+    def __setitem__(self, key, value):
+        FileEntry.__setitem__(self, key, value)
+        self.table.touch(self)
+
+    def __delitem__(self, key):
+        FileEntry.__delitem__(self, key)
+        self.table.touch(self)
+
+
+class FileTable(MutableMapping):
+    """An ops list kept in a SQLite database rather than in memory, used in
+    place of the dict made by build_ops_list when "Spill To Disk" is set, so
+    the memory a run needs doesn't grow with the number of files in it. It
+    behaves like that dict; its values are FileTableEntry objects, and any
+    changes made to them are written back to the table in batches.
+
+    by_size() lists the FIDs largest-first for the blocksort, reading them
+    from an index which SQLite sorts on disk with an external merge sort,
+    and in_block() gives a view of the files placed in one block, so the
+    Block objects don't need to hold their entries in memory either.
+    """
+    columns = ("category", "directory", "fname", "digest", "fsize", "run", "block", "offset", "length")
+
+    def __init__(self, path, batch_size=10000, cache_kib=16384):
+        """Create an empty table, replacing any left in the file by an
+        earlier run.
+
+        :param path: absolute path to the database file, which is scratch.
+        :param batch_size: how many changed entries to hold before writing.
+        :param cache_kib: the most memory SQLite may use for its page cache.
+        """
+        self.path = path
+        self.batch_size = batch_size
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=OFF")  # Scratch data; nothing is lost if a run dies.
+        self.conn.execute("PRAGMA synchronous=OFF")
+        self.conn.execute("PRAGMA cache_size=-%s" % cache_kib)
+        self.conn.execute("PRAGMA temp_store=FILE")  # Sorts that outgrow the cache spill to disk.
+        with self.conn:
+            self.conn.execute("DROP TABLE IF EXISTS files")
+            self.conn.execute("CREATE TABLE files (fid TEXT NOT NULL UNIQUE, category TEXT, directory TEXT, "
+                              "fname TEXT, digest BLOB, fsize INTEGER, run TEXT, block INTEGER, offset INTEGER, "
+                              "length INTEGER, extra TEXT)")
+        self.pending = {}  # Shared with every view of this table.
+        self.where = "1"
+        self.params = ()
+        self.test = None
+        self.block = None
+
+    def _view(self, where, params, test, block=None):
+        """Returns a view of the rows of this table matching where, sharing
+        its connection and pending writes. test is where, as a predicate on
+        an entry, for entries which haven't been written yet."""
+        view = FileTable.__new__(FileTable)
+        view.__dict__.update(self.__dict__)
+        view.where, view.params, view.test, view.block = where, params, test, block
+        return view
+
+    def unpacked(self):
+        """Returns a view of the files without a "run" key, which are those
+        to be packed in this run."""
+        return self._view("run IS NULL", (), lambda entry: entry.run is None)
+
+    def in_block(self, num_block):
+        """Returns a view of the files placed in the argued block, in the
+        order they were placed. Entries added to the view are placed in it."""
+        return self._view("block = ?", (num_block,), lambda entry: entry.block == num_block, num_block)
+
+    def by_size(self):
+        """Returns the FIDs in this table (or view), largest file first."""
+        return FileTableOrder(self)
+
+    def total_size(self):
+        """Returns the sum of the sizes of the files in this table (or view)."""
+        self.flush()
+        return self.conn.execute("SELECT TOTAL(fsize) FROM files WHERE %s" % self.where, self.params).fetchone()[0]
+
+    def touch(self, entry):
+        """Queues a changed entry to be written to the table."""
+        self.pending[entry.fid] = entry
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Writes every changed entry to the table in a single transaction.
+        Rows are updated in place, so scans in progress are not disturbed."""
+        if not self.pending:
+            return
+        rows = []
+        for fid, entry in self.pending.items():
+            extra = None
+            if entry.extra is not None:
+                extra = json.dumps(entry.extra)
+            rows.append((fid,) + tuple(getattr(entry, column) for column in self.columns) + (extra,))
+        with self.conn:
+            self.conn.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (fid) DO "
+                                  "UPDATE SET " + ", ".join("%s=excluded.%s" % (column, column)
+                                                            for column in self.columns + ("extra",)), rows)
+        self.pending.clear()
+
+    def _entry(self, row):
+        """Returns the FileTableEntry for a row, or the pending entry for its
+        FID if it has been changed since it was written."""
+        entry = self.pending.get(row[0])
+        if entry is not None:
+            return entry
+        entry = FileTableEntry.__new__(FileTableEntry)
+        entry.table, entry.fid = self, row[0]
+        for column, value in zip(self.columns, row[1:]):
+            setattr(entry, column, value)
+        entry.extra = None
+        if row[-1] is not None:
+            entry.extra = json.loads(row[-1])
+        return entry
+
+    def _scan(self, ordered=False, reverse=False, offset=0, limit=None):
+        """Yields (fid, entry) pairs for the rows of this table or view, a
+        page at a time. Ordered scans go largest file first (or smallest,
+        if reversed), with ties broken on the FID as build_recovery_index
+        does; others go in the order the rows were added."""
+        page = 1000
+        if limit is not None:
+            page = limit
+        last = None
+        while True:
+            self.flush()
+            if ordered:
+                self.conn.execute("CREATE INDEX IF NOT EXISTS files_size ON files (fsize, fid)")
+                if self.block is not None:
+                    self.conn.execute("CREATE INDEX IF NOT EXISTS files_block ON files (block, fsize, fid)")
+                direction, after = ("DESC", "<") if not reverse else ("ASC", ">")
+                position = ""
+                if last is not None:
+                    position = "AND (fsize, fid) %s (?, ?) " % after
+                query = ("SELECT * FROM files WHERE %s %sORDER BY fsize %s, fid %s LIMIT ? OFFSET ?"
+                         % (self.where, position, direction, direction))
+                rows = self.conn.execute(query, self.params + (last or ()) + (page, offset)).fetchall()
+                if rows:
+                    last = (rows[-1][5], rows[-1][0])
+            else:
+                rows = self.conn.execute("SELECT rowid, * FROM files WHERE %s AND rowid > ? ORDER BY rowid LIMIT ?"
+                                         % self.where, self.params + (last or 0, page)).fetchall()
+                if rows:
+                    last = rows[-1][0]
+                rows = [row[1:] for row in rows]
+            offset = 0
+            for row in rows:
+                yield row[0], self._entry(row)
+            if len(rows) < page or limit is not None:
+                return
+
+    def items(self):
+        for fid, entry in self._scan(ordered=self.block is not None):
+            yield fid, entry
+
+    def values(self):
+        for fid, entry in self.items():
+            yield entry
+
+    def __iter__(self):
+        for fid, entry in self.items():
+            yield fid
+
+    def __getitem__(self, fid):
+        entry = self.pending.get(fid)
+        if entry is None:
+            row = self.conn.execute("SELECT * FROM files WHERE fid=? AND %s" % self.where,
+                                    (fid,) + self.params).fetchone()
+            if row is not None:
+                return self._entry(row)
+        elif self.test is None or self.test(entry):
+            return entry
+        raise KeyError(fid)
+
+    def __setitem__(self, fid, entry):
+        if not (isinstance(entry, FileTableEntry) and entry.table.pending is self.pending and entry.fid == fid):
+            if isinstance(entry, FileEntry):
+                bound = FileTableEntry.__new__(FileTableEntry)
+                for slot in FileEntry.__slots__:
+                    setattr(bound, slot, getattr(entry, slot))
+                if entry.extra is not None:
+                    bound.extra = dict(entry.extra)
+            else:  # A plain dict, as from a RIFF.
+                bound = FileTableEntry.__new__(FileTableEntry)
+                FileEntry.__init__(bound, entry["category"], entry["fpath"], entry["fsize"], entry.get("sha256"))
+                for key, value in entry.items():
+                    if key not in ["fname", "fpath", "category", "sha256", "fsize"]:
+                        FileEntry.__setitem__(bound, key, value)
+            bound.table, bound.fid = self, fid
+            entry = bound
+        if self.block is not None:
+            FileEntry.__setitem__(entry, "block", self.block)
+        self.touch(entry)
+
+    def __delitem__(self, fid):
+        self.flush()
+        with self.conn:
+            deleted = self.conn.execute("DELETE FROM files WHERE fid=? AND %s" % self.where,
+                                        (fid,) + self.params).rowcount
+        if not deleted:
+            raise KeyError(fid)
+
+    def __len__(self):
+        self.flush()
+        return self.conn.execute("SELECT COUNT(*) FROM files WHERE %s" % self.where, self.params).fetchone()[0]
+
+    def close(self):
+        """Writes any pending changes and closes the table."""
+        self.flush()
+        self.conn.close()
+
+
+class FileTableOrder(Sequence):
+    """The FIDs of a FileTable, largest file first, as build_recovery_index
+    sorts them. They are read from the table as they are needed."""
+
+    def __init__(self, table):
+        self.table = table
+
+    def __len__(self):
+        return len(self.table)
+
+    def __getitem__(self, position):
+        length = len(self)
+        if position < 0:  # Counted from the smallest file, reading the index backwards.
+            found = list(self.table._scan(ordered=True, reverse=True, offset=-position - 1, limit=1))
+        elif position < length:
+            found = list(self.table._scan(ordered=True, offset=position, limit=1))
+        else:
+            found = []
+        if not found:
+            raise IndexError(position)
+        return found[0][0]
+
+    def __iter__(self):
+        for fid, entry in self.table._scan(ordered=True):
+            yield fid
+
+
+class HashCache(object):
+    """A persistent, on-disk cache of file digests, used by build_ops_list to
+    avoid re-reading files which have not changed since the last run. Entries
+    are keyed on the file's (device, inode) and are only trusted while its
+    size, mtime_ns and ctime_ns still match what was recorded.
+
+    The cache is a SQLite database in WAL mode. Each process and thread opens
+    its own connection, so any number of parallel hashers may share it.
+    Digests of each algorithm are kept in their own table, so changing the
+    Digest Algorithm never returns a digest of the wrong kind.
+    """
+
+    def __init__(self, path, batch_size=1000, algorithm="sha256"):
+        """Open (or create) the cache database.
+
+        :param path: absolute path to the cache database file.
+        :param batch_size: how many pending writes to hold before committing.
+        :param algorithm: the digest algorithm of the digests to cache.
+        """
+        self.path = path
+        self.batch_size = batch_size
+        if algorithm not in DIGEST_ALGORITHMS:
+            raise ValueError("%s is not a digest algorithm Tapestry knows." % algorithm)
+        self.table = "hashes" if algorithm == "sha256" else "hashes_" + algorithm  # Older caches hold only sha256.
+        self.run_stamp = time.time_ns()  # Marks entries seen during this run.
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS %s (device INTEGER, inode INTEGER, size INTEGER, "
+                         "mtime_ns INTEGER, ctime_ns INTEGER, digest TEXT, path TEXT, seen INTEGER, "
+                         "PRIMARY KEY (device, inode))" % self.table)
+
+    def __getstate__(self):
+        # Connections can't cross process boundaries; children reconnect.
+        state = self.__dict__.copy()
+        del state["_local"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def _connection(self):
+        """Returns this thread's connection to the database, opening it if
+        this is the first use in this thread (or process)."""
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            local.conn = sqlite3.connect(self.path, timeout=60)
+            local.conn.execute("PRAGMA journal_mode=WAL")
+            local.conn.execute("PRAGMA synchronous=NORMAL")
+            local.pid = os.getpid()
+            local.pending_seen = []
+            local.pending_put = []
+        return local.conn
+
+    def get(self, path, stats):
+        """Returns the cached hex digest for the file at path, or None if there
+        is no entry or the entry is stale.
+
+        :param path: absolute path to the file, used only for eviction later.
+        :param stats: the os.stat_result for the file, taken before reading it.
+        """
+        conn = self._connection()
+        row = conn.execute("SELECT digest FROM %s WHERE device=? AND inode=? AND size=? AND mtime_ns=? "
+                           "AND ctime_ns=?" % self.table, (stats.st_dev, stats.st_ino, stats.st_size, stats.st_mtime_ns,
+                                              stats.st_ctime_ns)).fetchone()
+        if row is None:
+            return None
+        self._local.pending_seen.append((self.run_stamp, path, stats.st_dev, stats.st_ino))
+        self._maybe_flush()
+        return row[0]
+
+    def put(self, path, stats, digest):
+        """Records the digest of the file at path, replacing any entry for the
+        same (device, inode).
+
+        :param path: absolute path to the file.
+        :param stats: the os.stat_result for the file, taken before reading it.
+        :param digest: the hex digest of the file's contents.
+        """
+        self._connection()
+        self._local.pending_put.append((stats.st_dev, stats.st_ino, stats.st_size, stats.st_mtime_ns,
+                                        stats.st_ctime_ns, digest, path, self.run_stamp))
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        local = self._local
+        if len(local.pending_seen) + len(local.pending_put) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Commits this thread's pending writes in a single transaction."""
+        conn = self._connection()
+        local = self._local
+        with conn:
+            conn.executemany("UPDATE %s SET seen=?, path=? WHERE device=? AND inode=?" % self.table,
+                             local.pending_seen)
+            conn.executemany("INSERT OR REPLACE INTO %s VALUES (?, ?, ?, ?, ?, ?, ?, ?)" % self.table,
+                             local.pending_put)
+        local.pending_seen = []
+        local.pending_put = []
+
+    def prune(self):
+        """Evicts every entry not seen during this run whose file no longer
+        exists (or has since been replaced by a different file). Entries for
+        files which exist but were not crawled this run - such as the
+        inclusive categories during a default run - are kept.
+
+        :return: the number of entries evicted.
+        """
+        self.flush()
+        conn = self._connection()
+        evicted = []
+        rows = conn.execute("SELECT device, inode, path FROM %s WHERE seen < ?" % self.table,
+                            (self.run_stamp,)).fetchall()
+        for device, inode, path in rows:
+            try:
+                stats = os.stat(path)
+                if stats.st_dev == device and stats.st_ino == inode:
+                    continue
+            except OSError:
+                pass
+            evicted.append((device, inode))
+        with conn:
+            conn.executemany("DELETE FROM %s WHERE device=? AND inode=?" % self.table, evicted)
+        return len(evicted)
+
+    def close(self):
+        """Flushes pending writes and closes this thread's connection."""
+        if getattr(self._local, "pid", None) == os.getpid():
+            self.flush()
+            self._local.conn.close()
+            self._local.pid = None
+
+
+class FileHasher(object):
+    """Hashes files for build_ops_list on a pool of threads. hashlib releases
+    the GIL while it digests, so several files are read and hashed at once.
+    Each thread reads into one reused buffer with readinto, rather than
+    allocating a new bytes object for every read, and files of at least
+    mmap_threshold bytes are hashed straight from a memory map.
+
+    The read size depends on the storage each file is on, as told by
+    storage_type: large reads for spinning disks and network shares, where
+    each request is expensive, and smaller ones for solid state storage.
+    """
+
+    read_sizes = {"ssd": 1048576, "rotational": 4194304, "network": 4194304, "unknown": 1048576}
+
+    def __init__(self, threads=4, mmap_threshold=67108864, algorithm="sha256"):
+        """Start the pool.
+
+        :param threads: how many files to hash at once.
+        :param mmap_threshold: files at least this large are memory mapped.
+        :param algorithm: the digest algorithm to hash with.
+        """
+        self.threads = max(threads, 1)
+        self.mmap_threshold = mmap_threshold
+        self.algorithm = algorithm
+        self.pool = ThreadPoolExecutor(max_workers=self.threads)
+        self._local = threading.local()
+
+    def read_size(self, device):
+        """Returns how many bytes to read at a time from the given device."""
+        return self.read_sizes[storage_type(device)]
+
+    def _buffer(self, size):
+        """Returns this thread's reusable read buffer of the given size."""
+        buffers = getattr(self._local, "buffers", None)
+        if buffers is None:
+            buffers = self._local.buffers = {}
+        if size not in buffers:
+            buffers[size] = bytearray(size)
+        return buffers[size]
+
+    def hash_file(self, path, stats=None):
+        """Hashes one file in the calling thread.
+
+        :param path: absolute path to the file.
+        :param stats: the file's os.stat_result, if already known.
+        :return: the hexdigest of the file.
+        """
+        if stats is None:
+            stats = os.stat(path)
+        hasher = new_hasher(self.algorithm)
+        with open(path, "rb", buffering=0) as source:
+            size = os.fstat(source.fileno()).st_size
+            if size and size >= self.mmap_threshold:
+                with mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    if hasattr(mapped, "madvise"):
+                        mapped.madvise(mmap.MADV_SEQUENTIAL)
+                    hasher.update(mapped)
+            else:
+                buffer = self._buffer(self.read_size(stats.st_dev))
+                view = memoryview(buffer)
+                count = source.readinto(buffer)
+                while count:
+                    hasher.update(view[:count])
+                    count = source.readinto(buffer)
+                view.release()
+        return hasher.hexdigest()
+
+    def submit(self, path, stats=None):
+        """Queues a file to be hashed on the pool.
+
+        :return: a concurrent.futures.Future for the hexdigest.
+        """
+        return self.pool.submit(self.hash_file, path, stats)
+
+    def close(self):
+        """Waits for any queued files and stops the pool."""
+        self.pool.shutdown(wait=True)
+
+
+class RunCatalog(object):
+    """A local SQLite catalog of every run this machine has made, so that
+    questions such as "which run holds this version of this file" can be
+    answered without retrieving or decrypting any block. Each run's files
+    (with their categories, paths, sizes, digests and the block holding
+    them) and its blocks are recorded once the run is finished.
+    """
+
+    def __init__(self, path):
+        """Open (or create) the catalog database.
+
+        :param path: absolute path to the catalog database file.
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS runs (run TEXT PRIMARY KEY, date TEXT, comment TEXT, "
+                              "count_files INTEGER, size INTEGER, sum_blocks INTEGER, base_run TEXT, drop_dir TEXT)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS blocks (run TEXT, name TEXT, size INTEGER, "
+                              "PRIMARY KEY (run, name))")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS files (run TEXT, fid TEXT, category TEXT, path TEXT, "
+                              "full_path TEXT, fname TEXT, fsize INTEGER, sha256 TEXT, stored_in TEXT, PRIMARY KEY (run, fid))")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS files_path ON files (path)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS files_full_path ON files (full_path)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS files_fname ON files (fname)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS files_sha256 ON files (sha256)")
+
+    def record_run(self, manifest, ops_list, drop_dir):
+        """Records a finished run, replacing anything already recorded for the
+        same run label.
+
+        :param manifest: the run's manifest, as built by write_run_manifest.
+        :param ops_list: the complete ops list for the run. Files unchanged
+        in an incremental run are recorded too, as stored in their earlier
+        run's block.
+        :param drop_dir: the output directory the run was written to.
+        """
+        run = manifest["run"]
+        meta = manifest["metaRun"]
+
+        def files():  # A generator, so that a FileTable ops list is never held in memory.
+            for fid, entry in ops_list.items():
+                stored_in = None
+                if entry.get("block") is not None:
+                    stored_in = "%s-%s.tap" % (entry.get("run", run), entry["block"])
+                yield (run, fid, entry["category"], entry["fpath"], entry["category"]+"/"+entry["fpath"],
+                       os.path.basename(entry["fpath"]), entry["fsize"], entry.get("sha256"), stored_in)
+
+        with self.conn:
+            for table in ["runs", "blocks", "files"]:
+                self.conn.execute("DELETE FROM %s WHERE run=?" % table, (run,))
+            self.conn.execute("INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                              (run, meta["dateRec"], meta["comment"], meta["countFilesSum"],
+                               meta["sizeExtraLarge"], meta["sumBlock"], meta.get("baseRun"), drop_dir))
+            self.conn.executemany("INSERT INTO blocks VALUES (?, ?, ?)",
+                                  [(run, name, size) for name, size in manifest["blocks"].items()])
+            self.conn.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", files())
+
+    def search(self, paths=None, sha256=None, date=None, categories=None):
+        """Finds every recorded copy of the files matching all of the given
+        filters, newest run first.
+
+        :param paths: optional list of globs, matched against each file's
+        path below its category, against "category/path", or against its
+        name alone. A pattern without wildcards also matches everything
+        inside that directory.
+        :param sha256: optional digest, or the start of one.
+        :param date: optional date, or the start of one, such as "2019-01".
+        :param categories: optional list of category labels.
+        :return: list of (run, date, category, path, fsize, sha256,
+        stored_in) tuples.
+        """
+        clauses = []
+        values = []
+        if paths:
+            matches = []
+            for pattern in paths:
+                pattern = pattern.strip("/")
+                matches.append("files.path GLOB ? OR files.full_path GLOB ? OR files.fname GLOB ?")
+                values += [pattern, pattern, pattern]
+                if not any(char in pattern for char in "*?["):
+                    matches.append("files.path GLOB ? OR files.full_path GLOB ?")
+                    values += [pattern+"/*", pattern+"/*"]
+            clauses.append("(" + " OR ".join(matches) + ")")
+        if sha256:
+            clauses.append("files.sha256 GLOB ?")
+            values.append(sha256.lower()+"*")
+        if date:
+            clauses.append("runs.date GLOB ?")
+            values.append(date+"*")
+        if categories:
+            clauses.append("files.category IN (%s)" % ", ".join(["?"] * len(categories)))
+            values += categories
+        query = ("SELECT files.run, runs.date, files.category, files.path, files.fsize, files.sha256, "
+                 "files.stored_in FROM files JOIN runs ON files.run = runs.run")
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY runs.date DESC, files.run DESC, files.category, files.path"
+
+        return self.conn.execute(query, values).fetchall()
+
+    def runs(self):
+        """Returns a list of (run, date, comment, count_files, sum_blocks)
+        tuples for every recorded run, newest first."""
+        return self.conn.execute("SELECT run, date, comment, count_files, sum_blocks FROM runs "
+                                 "ORDER BY date DESC, run DESC").fetchall()
+
+    def close(self):
+        self.conn.close()
+
+
+class ChangeJournal(object):
+    """A persistent journal of the paths below the category directories which
+    have changed, kept by the resident watcher (tapestry --watch, see
+    ChangeWatcher) so that an incremental run can visit only those paths
+    rather than crawl every category. The watcher records each change with a
+    rising sequence number; a run takes a snapshot as its crawl begins and,
+    once the crawl is done, clears everything up to that snapshot. Changes
+    made during the crawl are kept for the next run.
+
+    The journal can only stand in for a crawl if it saw everything since the
+    crawl of the run it is compared against: the same watcher must have been
+    watching since before that crawl began, its event queue must not have
+    overflowed, and the categories and settings must be the same. Otherwise
+    everything is crawled, and the journal starts again from that crawl.
+
+    It is a SQLite database in WAL mode, shared by the watcher and each run.
+    """
+
+    heartbeat_interval = 15  # Seconds between the watcher's heartbeats.
+    everything = ""  # The category of a change which means every category must be crawled.
+
+    def __init__(self, path):
+        """Open (or create) the journal database.
+
+        :param path: absolute path to the journal database file.
+        """
+        self.path = path
+        self.seq = 0
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS changes (seq INTEGER, category TEXT, path TEXT, "
+                              "recursive INTEGER, PRIMARY KEY (category, path))")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)")
+
+    def _state(self):
+        return dict(self.conn.execute("SELECT key, value FROM state").fetchall())
+
+    def _set(self, **values):
+        """Updates the state table. Call inside a transaction."""
+        self.conn.executemany("INSERT OR REPLACE INTO state VALUES (?, ?)",
+                              [(key, None if value is None else str(value)) for key, value in values.items()])
+
+    def start(self, pid):
+        """Begins a new epoch, for a watcher which has just started watching
+        every directory. Changes made before it did may have been missed, so
+        the first crawl of the new epoch must crawl everything.
+
+        :param pid: the process ID of the watcher.
+        """
+        self.seq = int(self._state().get("seq") or 0)
+        with self.conn:
+            self._set(pid=pid, epoch=os.urandom(8).hex(), heartbeat=time.time(), degraded="")
+
+    def beat(self, degraded=""):
+        """Records that the watcher is still running.
+
+        :param degraded: if not empty, why the watcher can't currently see
+        every change, in which case the journal is not used.
+        """
+        with self.conn:
+            self._set(heartbeat=time.time(), degraded=degraded)
+
+    def stop(self):
+        """Records that the watcher has stopped, ending its epoch."""
+        with self.conn:
+            self._set(pid=None, epoch=None)
+
+    def record(self, changes):
+        """Records changes in a single transaction.
+
+        :param changes: iterable of (category, path below the category,
+        True if the whole directory at that path must be walked again)
+        tuples. The path of a category's top directory is "".
+        """
+        rows = []
+        for category, path, recursive in changes:
+            self.seq += 1
+            rows.append((self.seq, category, path, int(recursive)))
+        with self.conn:
+            self.conn.executemany("INSERT INTO changes VALUES (?, ?, ?, ?) ON CONFLICT (category, path) DO UPDATE "
+                                  "SET seq=excluded.seq, recursive=max(recursive, excluded.recursive)", rows)
+            self._set(seq=self.seq)
+
+    def _watching(self, state):
+        """Returns None if a watcher is keeping the journal, or why not."""
+        pid = state.get("pid")
+        if not pid or not state.get("epoch"):
+            return "no watcher is running (see tapestry --watch)"
+        if os.name == "posix":
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                return "its watcher is no longer running"
+            except PermissionError:
+                pass  # It is running, as another user.
+        if time.time() - float(state.get("heartbeat") or 0) > 4 * self.heartbeat_interval:
+            return "its watcher has stopped responding"
+        if state.get("degraded"):
+            return state["degraded"]
+        return None
+
+    def begin(self, base_run, signature):
+        """Takes a snapshot of the journal as a run's crawl begins, and works
+        out whether it can stand in for the crawl.
+
+        :param base_run: the run label of the run whose index the changes
+        would be applied to, or None if there is none.
+        :param signature: a string describing the categories and settings of
+        the crawl; it must match the one the journal was last cleared with.
+        :return: tuple of (snapshot, to pass to clear once the crawl is done;
+        dict of {category: {path: True if the directory there must be walked
+        again}}, or None if everything must be crawled; the reason why it
+        must, or None).
+        """
+        state = self._state()
+        seq = int(state.get("seq") or 0)
+        reason = self._watching(state)
+        epoch = state.get("epoch") if reason is None else None
+        if reason is None:
+            if state.get("consumed_epoch") != epoch:
+                reason = "its watcher was started after the last crawl"
+            elif base_run is None:
+                reason = "there is no earlier run to apply it to"
+            elif state.get("consumed_run") != base_run:
+                reason = "it was last cleared by %s, not %s" % (state.get("consumed_run"), base_run)
+            elif state.get("consumed_signature") != signature:
+                reason = "the categories or settings have changed since the last crawl"
+        if reason is not None:
+            return (seq, epoch), None, reason
+
+        changes = {}
+        for category, path, recursive in self.conn.execute("SELECT category, path, recursive FROM changes "
+                                                           "WHERE seq <= ?", (seq,)):
+            if category == self.everything:
+                return (seq, epoch), None, "its watcher's event queue overflowed, so changes were lost"
+            changes.setdefault(category, {})
+            changes[category][path] = changes[category].get(path, False) or bool(recursive)
+        for paths in changes.values():  # Nothing below a directory to be walked needs listing on its own.
+            for path in list(paths):
+                directory = path
+                while directory:
+                    directory = os.path.dirname(directory)
+                    if paths.get(directory):
+                        del paths[path]
+                        break
+
+        return (seq, epoch), changes, None
+
+    def clear(self, snapshot, run, signature):
+        """Clears every change up to a snapshot, once the crawl which began
+        with it is done, and records which run the crawl was for.
+
+        :param snapshot: as returned by begin.
+        :param run: the run label of the current run.
+        :param signature: as passed to begin.
+        """
+        seq, epoch = snapshot
+        with self.conn:
+            self.conn.execute("DELETE FROM changes WHERE seq <= ?", (seq,))
+            self._set(consumed_epoch=epoch, consumed_run=run, consumed_signature=signature)
+
+    def close(self):
+        self.conn.close()
+
+
+class ChangeWatcher(object):
+    """The resident watcher behind tapestry --watch. It subscribes to inotify
+    on every directory of the argued categories, adding watches as
+    directories are created or moved in, and records each change below them
+    in a ChangeJournal: files by their path, and directories which appear,
+    vanish or change permissions as wholes, to be walked again. If the
+    kernel's event queue overflows, the journal is marked so that the next
+    run crawls everything, and while a category's top directory is not being
+    watched (such as after it was moved away) the journal is not used.
+
+    Only Linux has inotify, which is reached through ctypes.
+    """
+
+    # From <sys/inotify.h>
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_UNMOUNT = 0x00002000
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_DONT_FOLLOW = 0x02000000
+    IN_EXCL_UNLINK = 0x04000000
+    IN_ISDIR = 0x40000000
+    events = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_EXCL_UNLINK)
+
+    def __init__(self, journal, category_paths):
+        """Open an inotify instance. Nothing is watched until start.
+
+        :param journal: the tapestry.ChangeJournal to record changes in.
+        :param category_paths: dict of {category: top directory} to watch.
+        """
+        if system() != "Linux":
+            raise OSError("inotify is only available on Linux.")
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self.journal = journal
+        self.category_paths = category_paths
+        self.watches = {}  # wd: (category, directory)
+        self.watched = {}  # directory: wd
+        self.lost = set()  # Categories whose top directory is not being watched.
+        self.failed = ""  # Why some directory could not be watched, if one couldn't.
+        self.notices = []  # Messages for the log, collected by the caller.
+        self.last_beat = 0
+
+    def start(self):
+        """Watches every directory of every category, then begins the
+        journal's new epoch.
+
+        :return: the number of directories being watched.
+        """
+        for category, top in self.category_paths.items():
+            if not self._watch_tree(category, top, top=True):
+                self.lost.add(category)
+        self.journal.start(os.getpid())
+        self.beat()
+        return len(self.watches)
+
+    def _add_watch(self, category, directory, top=False):
+        mask = self.events
+        if not top:  # A category's top directory may itself be a link, which the crawl follows.
+            mask |= self.IN_DONT_FOLLOW
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error in (errno.ENOSPC, errno.ENOMEM):  # Anything else is gone, or can't be crawled either.
+                self.failed = ("%s could not be watched: %s. Raise fs.inotify.max_user_watches and restart "
+                               "the watcher." % (directory, os.strerror(error)))
+                self.notices.append(self.failed)
+            return False
+        self.watches[wd] = (category, directory)
+        self.watched[directory] = wd
+        return True
+
+    def _watch_tree(self, category, directory, top=False):
+        """Watches a directory and every directory below it which the crawl
+        would walk. Returns whether the directory itself is watched."""
+        if not self._add_watch(category, directory, top):
+            return False
+        for dir_path, sub_dirs, files in os.walk(directory):
+            for sub_dir in sub_dirs:
+                path = os.path.join(dir_path, sub_dir)
+                if not os.path.islink(path):
+                    self._add_watch(category, path)
+        return True
+
+    def _unwatch_tree(self, directory):
+        for path in [path for path in self.watched if path == directory or path.startswith(directory + os.sep)]:
+            wd = self.watched.pop(path)
+            self.watches.pop(wd, None)
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def _relative(self, category, path):
+        relative = os.path.relpath(path, self.category_paths[category])
+        return "" if relative == "." else relative
+
+    def _lose(self, category, changes):
+        changes[(self.journal.everything, "")] = True
+        self.last_beat = 0  # So the journal is marked as degraded at once.
+        if category not in self.lost:
+            self.lost.add(category)
+            self.notices.append("The top directory of %s is no longer being watched." % category)
+
+    def _handle(self, wd, mask, name, changes):
+        if mask & self.IN_Q_OVERFLOW:
+            changes[(self.journal.everything, "")] = True
+            self.notices.append("The inotify event queue overflowed, so the next run will crawl everything.")
+            return
+        if wd not in self.watches:
+            return
+        category, directory = self.watches[wd]
+        is_top = directory == self.category_paths[category]
+        if mask & self.IN_IGNORED:  # The watch is gone, because its directory is.
+            del self.watches[wd]
+            if self.watched.get(directory) == wd:
+                del self.watched[directory]
+            if is_top:
+                self._lose(category, changes)
+            return
+        if not name:  # An event on the watched directory itself.
+            if mask & self.IN_UNMOUNT or (is_top and mask & (self.IN_DELETE_SELF | self.IN_MOVE_SELF)):
+                self._lose(category, changes)
+            elif mask & self.IN_ATTRIB:
+                changes[(category, self._relative(category, directory))] = True
+            return
+        path = os.path.join(directory, name)
+        is_dir = bool(mask & self.IN_ISDIR)
+        if is_dir:
+            if mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+                self._unwatch_tree(path)
+            elif path not in self.watched and not os.path.islink(path):
+                self._watch_tree(category, path)
+        key = (category, self._relative(category, path))
+        changes[key] = changes.get(key, False) or is_dir
+
+    def process(self, timeout):
+        """Waits up to timeout seconds for events, then records every change
+        they describe, and beats if a heartbeat is due.
+
+        :param timeout: how long to wait for events, in seconds.
+        :return: the number of changed paths recorded.
+        """
+        changes = {}  # (category, path): recursive
+        if select.select([self.fd], [], [], timeout)[0]:
+            for count_reads in range(1024):  # Commit at least every 64 MiB of events.
+                try:
+                    data = os.read(self.fd, 65536)
+                except BlockingIOError:
+                    break
+                offset = 0
+                while offset < len(data):
+                    wd, mask, cookie, length = struct.unpack_from("iIII", data, offset)
+                    name = os.fsdecode(data[offset + 16:offset + 16 + length].rstrip(b"\0"))
+                    offset += 16 + length
+                    self._handle(wd, mask, name, changes)
+        if changes:
+            self.journal.record((category, path, recursive) for (category, path), recursive in changes.items())
+        if time.monotonic() - self.last_beat >= self.journal.heartbeat_interval:
+            self.beat()
+        return len(changes)
+
+    def beat(self):
+        """Tries to watch any lost category again, then records a heartbeat."""
+        for category in sorted(self.lost):
+            top = self.category_paths[category]
+            self._unwatch_tree(top)
+            if self._watch_tree(category, top, top=True):
+                self.lost.discard(category)
+                self.journal.record([(category, "", True)])
+                self.notices.append("The top directory of %s is being watched again." % category)
+        degraded = self.failed
+        if self.lost:
+            degraded = "the top directory of %s is not being watched" % ", ".join(sorted(self.lost))
+        self.journal.beat(degraded)
+        self.last_beat = time.monotonic()
+
+    def close(self):
+        os.close(self.fd)
+
+
+class HashingReader(object):
+    """Minimal read-only wrapper around an open file which hashes every byte
+    it hands out, used to hash a file while tarfile streams it into a member.
+    The member size is fixed by its header, so if the file turns out to be
+    shorter than expected the shortfall is padded with zeroes and the `short`
+    flag is raised.
+    """
+
+    def __init__(self, source, expected, algorithm="sha256"):
+        """Wrap the file.
+
+        :param source: a file object opened for binary reading.
+        :param expected: the number of bytes the caller will read.
+        :param algorithm: the digest algorithm to hash with.
+        """
+        self.source = source
+        self.remaining = expected
+        self.hasher = new_hasher(algorithm)
+        self.short = False
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.source.read(size)
+        if len(data) < size:
+            self.short = True
+            data += bytes(size - len(data))
+        self.remaining -= size
+        self.hasher.update(data)
+        return data
+
+    def hexdigest(self):
+        return self.hasher.hexdigest()
+
+
+class BinaryIndex(Mapping):
+    """A run's index in a binary form which can be queried where it lies, so
+    that recovering (or comparing against) a run with millions of files does
+    not mean loading all of them. It is written beside the index block's
+    RIFF, and read by RecoveryIndex in preference to it.
+
+    The file is a header, then one record per file (holding its FID, its
+    category and path, and its entry as JSON), then the run's metadata as
+    JSON, then two tables of record offsets: one sorted by FID and one by
+    category and path. Either can be binary searched, so a lookup reads only
+    about log2(n) records. It behaves as a read-only dict of FID: entry.
+    """
+    magic = b"TAPRIDX\x00"
+    version = 1
+    header = struct.Struct("<8sIIQQQQ")  # magic, version, count, then the offsets of the records, metadata and tables.
+    record = struct.Struct("<HII")  # The lengths of the FID, path key and JSON entry which follow.
+
+    def __init__(self, buffer):
+        """
+        :param buffer: the whole index, as bytes or an mmap.
+        """
+        if len(buffer) < self.header.size:
+            raise RecoveryIndexError("The binary index is empty or truncated.")
+        magic, version, self.count, records, metadata, self.by_fid, self.by_path = self.header.unpack_from(buffer)
+        if magic != self.magic or version != self.version:
+            raise RecoveryIndexError("The binary index is not a version %s index, or is corrupt." % self.version)
+        if not records <= metadata <= self.by_fid or self.by_path != self.by_fid + 8 * self.count \
+                or len(buffer) != self.by_path + 8 * self.count:  # Each table holds one 8-byte offset per file.
+            raise RecoveryIndexError("The binary index is truncated, or its header is corrupt.")
+        self.buffer = buffer
+        try:
+            self.metadata = json.loads(bytes(buffer[metadata:self.by_fid]).decode("utf-8"))
+        except ValueError:
+            raise RecoveryIndexError("The binary index's metadata is corrupt.")
+
+    @classmethod
+    def open(cls, index_file):
+        """Returns a BinaryIndex for a file object. A file on disk is memory
+        mapped; anything else, such as a member of a tarfile, is read.
+
+        :param index_file: a binary reader positioned at the start of the index.
+        """
+        if isinstance(getattr(index_file, "raw", None), io.FileIO):
+            if os.fstat(index_file.fileno()).st_size < cls.header.size:  # mmap won't map an empty file.
+                raise RecoveryIndexError("The binary index is empty or truncated.")
+            return cls(mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ))
+        return cls(index_file.read())
+
+    @staticmethod
+    def path_key(category, fpath):
+        """The bytes a file's category and path are sorted and searched by."""
+        return (category + "\x00" + fpath).encode("utf-8", "surrogatepass")
+
+    @classmethod
+    def write(cls, path, index, metadata, batch_size=10000):
+        """Writes the argued index to a new binary index file. The keys of a
+        FileTable are sorted on disk, by SQLite, rather than in memory.
+
+        :param path: absolute path of the file to write.
+        :param index: dict (or FileTable) of FID: entry, such as the ops list.
+        :param metadata: dict of the RIFF's other keys, such as "metaRun".
+        :param batch_size: how many keys to move to a FileTable at a time.
+        """
+        spilled = isinstance(index, FileTable)
+        if spilled:
+            index.conn.execute("CREATE TEMP TABLE IF NOT EXISTS binary_index_keys (fid BLOB, path BLOB, offset INTEGER)")
+            index.conn.execute("DELETE FROM binary_index_keys")
+        keys = []
+        count = 0
+        with open(path, "wb") as out:
+            out.write(b"\x00" * cls.header.size)
+            offset = cls.header.size
+            for fid, entry in index.items():
+                entry = dict(entry)
+                fid_bytes = fid.encode("utf-8")
+                key = cls.path_key(entry["category"], entry["fpath"])
+                body = json.dumps(entry).encode("utf-8")
+                out.write(cls.record.pack(len(fid_bytes), len(key), len(body)) + fid_bytes + key + body)
+                keys.append((fid_bytes, key, offset))
+                count += 1
+                offset += cls.record.size + len(fid_bytes) + len(key) + len(body)
+                if spilled and len(keys) >= batch_size:
+                    index.conn.executemany("INSERT INTO binary_index_keys VALUES (?, ?, ?)", keys)
+                    keys = []
+            if spilled:
+                index.conn.executemany("INSERT INTO binary_index_keys VALUES (?, ?, ?)", keys)
+            position_metadata = offset
+            out.write(json.dumps(metadata).encode("utf-8"))
+            tables = []
+            for field, column in enumerate(["fid", "path"]):
+                tables.append(out.tell())
+                if spilled:
+                    cursor = index.conn.execute("SELECT offset FROM binary_index_keys ORDER BY %s" % column)
+                    chunks = iter(lambda: [row[0] for row in cursor.fetchmany(batch_size)], [])
+                else:
+                    chunks = [[item[2] for item in sorted(keys, key=lambda item: item[field])]]
+                for chunk in chunks:
+                    offsets = array("Q", chunk)
+                    if sys.byteorder != "little":
+                        offsets.byteswap()
+                    offsets.tofile(out)
+            out.seek(0)
+            out.write(cls.header.pack(cls.magic, cls.version, count, cls.header.size, position_metadata,
+                                      tables[0], tables[1]))
+        if spilled:
+            index.conn.execute("DROP TABLE binary_index_keys")
+
+        return path
+
+    def _offset(self, table, position):
+        return struct.unpack_from("<Q", self.buffer, table + 8 * position)[0]
+
+    def _fields(self, offset):
+        """Returns the FID, path key and JSON entry of the record at offset."""
+        len_fid, len_key, len_body = self.record.unpack_from(self.buffer, offset)
+        start = offset + self.record.size
+        return (bytes(self.buffer[start:start + len_fid]),
+                bytes(self.buffer[start + len_fid:start + len_fid + len_key]),
+                bytes(self.buffer[start + len_fid + len_key:start + len_fid + len_key + len_body]))
+
+    def _key(self, offset, field):
+        """Returns just the FID (field 0) or path key (field 1) of a record."""
+        len_fid, len_key, len_body = self.record.unpack_from(self.buffer, offset)
+        start = offset + self.record.size
+        if field == 0:
+            return self.buffer[start:start + len_fid]
+        return self.buffer[start + len_fid:start + len_fid + len_key]
+
+    def _search(self, table, field, target):
+        """Binary searches a table for the record whose field (0 for the FID,
+        1 for the path key) is target, returning its fields or None."""
+        keys = _TableKeys(self, table, field)
+        position = bisect.bisect_left(keys, target)
+        if position < self.count:
+            fields = self._fields(self._offset(table, position))
+            if fields[field] == target:
+                return fields
+        return None
+
+    def find_path(self, category, fpath):
+        """Returns the FID of the file at fpath in category, or None."""
+        fields = self._search(self.by_path, 1, self.path_key(category, fpath))
+        if fields is None:
+            return None
+        return fields[0].decode("utf-8")
+
+    def __getitem__(self, fid):
+        fields = self._search(self.by_fid, 0, fid.encode("utf-8"))
+        if fields is None:
+            raise KeyError(fid)
+        return json.loads(fields[2].decode("utf-8"))
+
+    def __contains__(self, fid):
+        return self._search(self.by_fid, 0, fid.encode("utf-8")) is not None
+
+    def items(self):
+        for position in range(self.count):
+            fid, key, body = self._fields(self._offset(self.by_fid, position))
+            yield fid.decode("utf-8"), json.loads(body.decode("utf-8"))
+
+    def values(self):
+        for fid, entry in self.items():
+            yield entry
+
+    def __iter__(self):
+        for position in range(self.count):
+            yield self._fields(self._offset(self.by_fid, position))[0].decode("utf-8")
+
+    def __len__(self):
+        return self.count
+
+
+class _TableKeys(Sequence):
+    """One of a BinaryIndex's sorted tables, seen as a list of its keys, so
+    that it can be searched with bisect."""
+
+    def __init__(self, index, table, field):
+        self.index, self.table, self.field = index, table, field
+
+    def __getitem__(self, position):
+        return self.index._key(self.index._offset(self.table, position), self.field)
+
+    def __len__(self):
+        return self.index.count
+
+
 class RecoveryIndex(object):
     """Special utility class for loading and translating Tapestry recovery
     index files and presenting them back to the script in a universal way. Made
-    for both the old Recovery Pickle design as well as the NewRIFF format.
+    for both the old Recovery Pickle design as well as the NewRIFF format, and
+    for the binary index (see BinaryIndex) kept with a run's index block.
     """
 
     def __init__(self, index_file):
@@ -436,10 +2413,23 @@ class RecoveryIndex(object):
         """
         self.pickle_failed = False
         self.json_failed = False
+        self.by_path = None
+
+        if index_file.read(len(BinaryIndex.magic)) == BinaryIndex.magic:
+            index_file.seek(0)
+            self.mode = "bin"
+            self.file_index = BinaryIndex.open(index_file)
+            self.run_metadata = self.file_index.metadata["metaRun"]
+            self.digest_algorithm = self.run_metadata.get("digestAlgorithm", "sha256")
+            self.blocks = self.run_metadata["sumBlock"]
+            self.referenced_runs = self.run_metadata.get("referencedRuns", [])
+            self.partial = self.file_index.metadata.get("indexScope", "run") == "block"
+            return
+        index_file.seek(0)
 
         try:
             self.pickled_data = pickle.load(index_file)
-        except pickle.UnpicklingError:  # In this case we must have a newRiff:
+        except (pickle.UnpicklingError, EOFError):  # In this case we must have a newRiff:
             self.pickle_failed = True
 
         try:
@@ -456,27 +2446,77 @@ class RecoveryIndex(object):
 
         if self.mode == "json":
             self.run_metadata = self.unpacked_json["metaRun"]
+            self.digest_algorithm = self.run_metadata.get("digestAlgorithm", "sha256")
             self.file_index = self.unpacked_json["index"]
             self.blocks = self.unpacked_json["metaRun"]["sumBlock"]
+            self.referenced_runs = self.run_metadata.get("referencedRuns", [])
+            self.partial = self.unpacked_json.get("indexScope", "run") == "block"
         elif self.mode == "pkl":
             self.blocks, self.rec_paths, self.rec_sections = self.pickled_data
+            self.digest_algorithm = "sha256"
+            self.referenced_runs = []
+            self.partial = False
         else:  # We have entered a cursed state...
             raise RecoveryIndexError("The self.mode variable is an unexpected value. Are you hacking?")
 
+    def merge(self, other):
+        """Adds the file entries of another RIFF-based index to this one. Used
+        to piece a run's index together from its blocks' own RIFFs when the
+        index block is not available.
+
+        :param other: another tapestry.RecoveryIndex in json mode.
+        """
+        if self.mode != "json" or other.mode != "json":
+            raise RecoveryIndexError("Only RIFF-format indexes can be merged.")
+        self.file_index.update(other.file_index)
+        self.by_path = None
+
+    def find_path(self, category, fpath):
+        """Returns the FID of the file at fpath in category, or None if the
+        index holds no such file (or is a Recovery Pickle).
+
+        :param category: the category label of the file.
+        :param fpath: the file's path relative to its category.
+        """
+        if self.mode == "bin":
+            return self.file_index.find_path(category, fpath)
+        elif self.mode != "json":
+            return None
+        if self.by_path is None:  # Built on first use, and kept up to date by merge().
+            self.by_path = {}
+            for fid, entry in self.file_index.items():
+                self.by_path.update({(entry["category"], entry["fpath"]): fid})
+        return self.by_path.get((category, fpath))
+
+    def locate(self, file_key):
+        """Returns where a file is stored: the run whose blocks hold it (None
+        for the run this index belongs to), the number of its block, and the
+        offset and length of its member in the block's tarball. Parts that are
+        not recorded, as in indexes written before blocks were mapped, are
+        None.
+
+        :param file_key: A string representing a valid file ID.
+        """
+        if self.mode not in ["json", "bin"]:
+            return None, None, None, None
+        entry = self.file_index.get(file_key, {})
+        return entry.get("run"), entry.get("block"), entry.get("offset"), entry.get("length")
+
     def find(self, file_key):
         """Expectes a FID value as the argument and will return the
         category and sub-path accordingly.
 
         :param file_key: A string representing a valid file ID.
         """
-        if file_key.lower() in ["recovery-pkl", "recovery-riff"]:
+        if file_key.lower() in ["recovery-pkl", "recovery-riff", "recovery-index"]:
             category = "skip"
             sub_path = "skip"
             return category, sub_path
-        elif self.mode == "json":
+        elif self.mode in ["json", "bin"]:
             try:
-                category = self.file_index[file_key]["category"]
-                sub_path = self.file_index[file_key]["fpath"]
+                entry = self.file_index[file_key]
+                category = entry["category"]
+                sub_path = entry["fpath"]
             except KeyError:
                 category = b"404"
                 sub_path = b"404"
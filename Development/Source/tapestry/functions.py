@@ -9,25 +9,37 @@ github: https://www.github.com/ZAdamMac/Tapestry
 
 from . import classes as tapestry
 import argparse
-from collections import namedtuple
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import configparser
 import datetime
+import fnmatch
 import getpass
 import gnupg
 import hashlib
 import io
+import json
 import keyring
-import multiprocessing as mp
 import os
 import paramiko.ssh_exception as sshe
 import platform
 import pysftp
-from random import shuffle
+import queue
+import re
 import shutil
+import signal
+import sqlite3
+import struct
 import sys
 import tarfile
 import textwrap
+import threading
+import time
 import uuid
+try:
+    import fcntl
+except ImportError:  # Not on Windows, where the physical read order falls back to file IDs.
+    fcntl = None
 
 __version__ = "2.2.0"
 
@@ -71,6 +83,47 @@ def announce():
     debug_print("The current OS is: " + platform.system())
 
 
+def build_blocks(sizes, ops_list, namespace):
+    """Performs the blocksort, assigning every file in the ops list to a
+    tapestry.Block using first-fit-decreasing bin packing. The assignment
+    depends only on the order of sizes, which build_recovery_index makes
+    deterministic. The number of the block each file is placed in is written
+    into its ops list entry, and the fill efficiency of each block is logged.
+    If the ops list is a tapestry.FileTable, sizes is streamed from it and
+    the blocks hold views of it, rather than the entries themselves.
+
+    :param sizes: a list object returned by build_recovery_index, made up of
+    strings indicating file identifier values sorted by the size of the file.
+    :param ops_list: The full ops list prepared by build_ops_list.
+    :param namespace: the entire namespace object.
+    :return: list of filled tapestry.Block objects, in block-number order. If
+    there is nothing to pack, a single empty block is returned to carry the RIFF.
+    """
+    ns = namespace
+    block_name_base = ns.compid+"-"+str(datetime.date.today())
+    if len(sizes) == 0:  # Nothing to pack, but the run's RIFF still needs a block to travel in.
+        ns.sum_blocks = 1
+        return [tapestry.Block(block_name_base + "-1", ns.block_size_raw, 1, 0)]
+    smallest = ops_list[sizes[-1]]['fsize']
+    table = None
+    if isinstance(ops_list, tapestry.FileTable):
+        table = ops_list
+    packer = tapestry.BlockPacker(block_name_base, ns.block_size_raw, smallest, table)
+    for item in sizes:
+        entry = ops_list[item]
+        entry.update({"block": packer.place(item, entry).num_block})
+
+    ns.logs.log("The blocksort produced %s blocks. Fill efficiency follows." % len(packer.blocks))
+    for block in packer.blocks:
+        message = ("%s: %s files, %s of %s bytes (%.1f%% full)" %
+                   (block.name, block.files, block.size, block.max_size, block.efficiency() * 100))
+        ns.logs.log(message)
+        debug_print(message)
+    ns.sum_blocks = len(packer.blocks)
+
+    return packer.blocks
+
+
 def build_ops_list(namespace):
     """A simple function which performs the crawling we need to do, and returns
     the findex of a RIFF). The returned index is not sorted by size and has to
@@ -81,58 +134,348 @@ def build_ops_list(namespace):
     :return:
     """
     ns = namespace
+    # With fused hashing, files are hashed as they are packed; only cached digests are used here.
+    do_hashing = not ns.fused_hashing
     ns.logs.log("Building the Operations list. A list of rejected files and their reasons follows.")
     ns.logs.log("For a list of files that were not rejected, decrypt and read the main RIFF file.")
     # Step 1: Index Everything for the Blocksort
     files_index = {}  # This comes out the same as the 'findex' key in a NewRIFF JSON
+    if ns.spill_to_disk:
+        files_index = tapestry.FileTable(os.path.join(ns.workDir, "ops-list.db"))
     node = uuid.getnode()
+    hash_cache = None
+    if ns.hash_cache_path:
+        hash_cache = tapestry.HashCache(ns.hash_cache_path, algorithm=ns.digest_algorithm)
+    count_cached = 0
+    hasher = None
+    if do_hashing:
+        hasher = tapestry.FileHasher(ns.hash_threads, algorithm=ns.digest_algorithm)
+    pending = deque()  # Entries waiting on their digests, kept in the order they were found.
+    window = max(ns.hash_threads, 1) * 64
+    deferred = []  # With a Read Order, files are hashed after the crawl, sorted by read_order_key.
+    count_hashed = 0
+    bytes_hashed = 0
+
+    def finish(fid, entry, absolute_path, stats, future):
+        if future is not None:
+            try:
+                hash_digest = future.result()
+            except PermissionError:
+                message = ("Error accessing %s: %s. Was this a network share file?"
+                           % (absolute_path, access_test(absolute_path)))
+                print(message)
+                ns.logs.log(message)
+                files_index.pop(fid, None)  # Deferred entries were already added.
+                return
+            except OSError as e:  # Gone since the crawl found it, which with a Read Order may be a while ago.
+                message = "Error reading %s: %s. It has been left out of this run." % (absolute_path, e)
+                print(message)
+                ns.logs.log(message)
+                files_index.pop(fid, None)
+                return
+            entry["sha256"] = hash_digest
+            if hash_cache is not None:
+                hash_cache.put(absolute_path, stats, hash_digest)
+        files_index.update({fid: entry})
+
     run_list = ns.categories_default
     if ns.inc:
         for category in ns.categories_inclusive:
             run_list.append(category)
-    for category in run_list:
-        for dir_path, sub_dirs, files in os.walk(ns.category_paths[category]):
-            for file in files:
-                absolute_path = os.path.join(dir_path, file)
-                sub_path = os.path.relpath(absolute_path, ns.category_paths[category])
-                access_test_results = access_test(absolute_path)
-                if False not in access_test_results:
-                    size = os.path.getsize(absolute_path)
-                    try:
-                        if size <= ns.block_size_raw:  # We'll be handling this file.
-                            hasher = hashlib.new('sha256')
-                            with open(absolute_path, "rb") as contents:
-                                chunk = contents.read(io.DEFAULT_BUFFER_SIZE)
-                                while chunk != b"":
-                                    hasher.update(chunk)
-                                    chunk = contents.read(io.DEFAULT_BUFFER_SIZE)
-                            hash_digest = hasher.hexdigest()
-                            file_descriptor = {
-                                'fname': file, 'sha256': hash_digest, 'category': category,
-                                'fpath': sub_path, 'fsize': size
-                                }
-                            files_index.update({str(uuid.uuid1(node)): file_descriptor})
-                        else:
-                            size_pretty = size / 1048576
-                            block_size_pretty = ns.block_size_raw / 1048576
-                            message = ("{%s} %s is larger than %s (%s) and is being excluded" %
-                                (category, file, size_pretty, block_size_pretty))
-                            print(message)
-                            ns.logs.log(message)
-                    except PermissionError:
-                        message = ("Error accessing %s: %s. Was this a network share file?"
-                                   % (absolute_path, access_test_results))
-                        print(message)
-                        ns.logs.log(message)
-                else:
-                    message = ("Error accessing %s: %s. Verify it exists and you have permissions" %
-                              (absolute_path, access_test_results))
-                    print(message)
-                    ns.logs.log(message)
+    current_run = ns.compid+"-"+str(datetime.date.today())
+    crawl = crawl_categories(ns, run_list)
+    journal = None
+    carried_from = None  # The run unchanged files were carried over from, if the change journal was used.
+    count_carried = 0
+    if ns.change_journal_path:
+        journal = tapestry.ChangeJournal(ns.change_journal_path)
+        signature = json.dumps({"categories": {category: ns.category_paths[category] for category in run_list},
+                                "blockSize": ns.block_size_raw, "digestAlgorithm": ns.digest_algorithm},
+                               sort_keys=True)
+        base_run, previous_index = None, None
+        if ns.incremental:
+            base_run, previous_index = find_previous_index(ns.drop, ns.compid, current_run)
+            if previous_index is not None and previous_index.mode == "pkl":
+                base_run = None
+        snapshot, changes, reason = journal.begin(base_run, signature)
+        if changes is None:
+            if ns.incremental:
+                ns.logs.log("The change journal can't stand in for the crawl, so everything will be crawled: %s."
+                            % reason)
+        else:
+            for category in run_list:  # inotify can't see changes other machines make to a network share.
+                try:
+                    if tapestry.storage_type(os.stat(ns.category_paths[category]).st_dev) == "network":
+                        changes[category] = {"": True}
+                except OSError:
+                    changes[category] = {"": True}
+            count_changes = sum(len(paths) for paths in changes.values())
+            for fid, entry in previous_index.file_index.items():
+                category, fpath = entry["category"], entry["fpath"]
+                if category not in run_list or listed_in_changes(fpath, changes.get(category, {})):
+                    continue
+                if entry["sha256"] is None:  # Not hashed when it was found, so it has to be visited.
+                    changes.setdefault(category, {}).update({fpath: False})
+                    continue
+                files_index.update({str(uuid.uuid1(node)): tapestry.FileEntry(category, fpath, entry["fsize"],
+                                                                              entry["sha256"])})
+                count_carried += 1
+            crawl = crawl_changes(ns, changes)
+            carried_from = base_run
+            ns.logs.log("The change journal listed %s changed paths; %s unchanged files were carried over from %s "
+                        "without being visited." % (count_changes, count_carried, base_run))
+    count_found = 0
+    started = time.time()
+    for category, absolute_path, stats, accessible in crawl:
+        count_found += 1
+        sub_path = os.path.relpath(absolute_path, ns.category_paths[category])
+        if accessible:
+            size = stats.st_size
+            if size <= ns.block_size_raw:  # We'll be handling this file.
+                hash_digest = None
+                future = None
+                fid = str(uuid.uuid1(node))
+                if hash_cache is not None:
+                    hash_digest = hash_cache.get(absolute_path, stats)
+                if hash_digest is None and do_hashing:
+                    if ns.read_order == "none":
+                        future = hasher.submit(absolute_path, stats)
+                    else:
+                        deferred.append((read_order_key(absolute_path, stats, ns.read_order), fid,
+                                         absolute_path, stats))
+                    count_hashed += 1
+                    bytes_hashed += size
+                elif hash_digest is not None:
+                    count_cached += 1
+                file_descriptor = tapestry.FileEntry(category, sub_path, size, hash_digest)
+                pending.append((fid, file_descriptor, absolute_path, stats, future))
+                # Entries are finished in order, as soon as they're hashed, so that only a bounded window waits.
+                while pending and (len(pending) > window or pending[0][4] is None
+                                   or pending[0][4].done()):
+                    finish(*pending.popleft())
+            else:
+                size_pretty = size / 1048576
+                block_size_pretty = ns.block_size_raw / 1048576
+                message = ("{%s} %s is larger than %s (%s) and is being excluded" %
+                    (category, os.path.basename(absolute_path), size_pretty, block_size_pretty))
+                print(message)
+                ns.logs.log(message)
+        else:
+            message = ("Error accessing %s: %s. Verify it exists and you have permissions" %
+                      (absolute_path, access_test(absolute_path)))
+            print(message)
+            ns.logs.log(message)
+    elapsed = max(time.time() - started, 0.001)
+    ns.logs.log("The crawl found %s files in %.1f seconds (%.0f files/s), scanning with %s threads."
+                % (count_found, elapsed, count_found / elapsed, ns.crawl_threads))
+    while pending:
+        finish(*pending.popleft())
+    if deferred:
+        deferred.sort()
+        ns.logs.log("Hashing %s files in %s read order." % (len(deferred), ns.read_order))
+        for key, fid, absolute_path, stats in deferred:
+            pending.append((fid, files_index[fid], absolute_path, stats, hasher.submit(absolute_path, stats)))
+            while len(pending) > window:
+                finish(*pending.popleft())
+        while pending:
+            finish(*pending.popleft())
+    if hasher is not None:
+        hasher.close()
+        elapsed = max(time.time() - started, 0.001)
+        ns.logs.log("%s files (%.1f MiB) were hashed at %.1f MiB/s, using %s threads."
+                    % (count_hashed, bytes_hashed / 1048576, bytes_hashed / 1048576 / elapsed, hasher.threads))
+
+    if journal is not None:
+        journal.clear(snapshot, current_run, signature)
+        journal.close()
+
+    if hash_cache is not None:
+        evicted = 0
+        if carried_from is None:  # Carried files are never looked at, so only a full crawl can tell what's stale.
+            evicted = hash_cache.prune()
+        hash_cache.close()
+        ns.logs.log("The hash cache supplied %s of %s digests, and %s stale entries were evicted."
+                    % (count_cached, len(files_index), evicted))
 
     return files_index
 
 
+def build_block_members(block, namespace):
+    """Lists the (fid, absolute path) pairs a block task needs to build the
+    argued block.
+
+    :param block: a filled tapestry.Block object.
+    :param namespace: the entire namespace object.
+    :return: list of (fid, path) tuples, in the order the block was filled,
+    or sorted by read_order_key if a Read Order is configured.
+    """
+    members = []
+    for fid, file_metadata in block.file_index.items():
+        path = os.path.join(namespace.category_paths[file_metadata["category"]],
+                            file_metadata['fpath'])
+        members.append((fid, path))
+    if namespace.read_order != "none":  # Offsets are recorded as members are added, so any order will do.
+        members.sort(key=lambda member: read_order_key(member[1], None, namespace.read_order))
+
+    return members
+
+
+def build_block_riffs(collection_blocks, ops_list, namespace):
+    """Writes the RIFF for each packed block into the drop directory. Each
+    RIFF indexes only the files in its own block; the full index for the run
+    is written once, by build_index_task.
+
+    :param collection_blocks: list of tapestry.Block objects, already filled.
+    :param ops_list: The full ops list prepared by build_ops_list.
+    :param namespace: the entire namespace object.
+    :return: list of absolute paths to the RIFFs, in block order.
+    """
+    ns = namespace
+    riffs = []
+    sum_files = 0
+    for block in collection_blocks:
+        sum_files += block.files
+    for block in collection_blocks:
+        riffs.append(block.meta(len(collection_blocks), ns.sum_size, sum_files,
+                                str(datetime.date.today()), ns.comment_string, ops_list, ns.drop,
+                                ns.base_run, ns.referenced_runs, digest_algorithm=ns.digest_algorithm))
+
+    return riffs
+
+
+def build_block_tasks(collection_blocks, ops_list, namespace):
+    """Provided the list of packed Block objects, writes each block's RIFF and
+    returns one TaskBlockBuild per block, along with the list of tarfiles
+    those tasks will create. Shared by the unix and windows packers, which
+    differ only in how they execute the tasks. With fused hashing, the index
+    is not final until the blocks are packed, so no RIFFs are written here;
+    see finalize_fused_index.
+
+    :param collection_blocks: list of tapestry.Block objects, already filled.
+    :param ops_list: The full ops list prepared by build_ops_list.
+    :param namespace: the entire namespace object.
+    :return: tuple of (list of tasks, list of absolute tarfile paths)
+    """
+    ns = namespace
+    tasks = []
+    block_final_paths = []
+    if ns.fused_hashing:
+        riffs = [None] * len(collection_blocks)
+    else:
+        riffs = build_block_riffs(collection_blocks, ops_list, ns)
+    for block, this_riff in zip(collection_blocks, riffs):
+        tarf = os.path.join(ns.workDir, (block.name+".tar"))
+        block_final_paths.append(tarf)
+        members = build_block_members(block, ns)
+        tasks.append(tapestry.TaskBlockBuild(tarf, members, this_riff, ns.fused_hashing, ns.digest_algorithm))
+
+    return tasks, block_final_paths
+
+
+def build_incremental_list(namespace, ops_list):
+    """Compares the ops list from the current crawl against the index of the
+    most recent previous run for this compid found in the drop directory.
+    Files whose category, path, size and sha256 are all unchanged are not
+    packed again; their entries keep the FID they were originally stored
+    under and gain a "run" key naming the run whose blocks hold them, along
+    with the block, offset and length recorded by that run. If no
+    previous run can be found the whole ops list is packed, as in a full run.
+    A tapestry.FileTable ops list is compared into a new FileTable, and the
+    files to pack are a view of it.
+
+    :param namespace: the entire namespace object.
+    :param ops_list: The full ops list prepared by build_ops_list.
+    :return: tuple of (ops list for the RIFF, ops list of files to pack)
+    """
+    ns = namespace
+    current_run = ns.compid+"-"+str(datetime.date.today())
+    base_run, previous_index = find_previous_index(ns.drop, ns.compid, current_run)
+    if previous_index is None:
+        message = ("WARNING: --incremental was given, but no previous run could be found in %s, so a full backup "
+                   "will be made." % ns.drop)
+        if ns.catalog_path and os.path.isfile(ns.catalog_path):
+            catalog = tapestry.RunCatalog(ns.catalog_path)
+            count_runs = len([run for run in catalog.runs() if run[0].startswith(ns.compid+"-")
+                              and run[0] != current_run])
+            catalog.close()
+            if count_runs:
+                message += (" The catalog records %s earlier run(s) of this machine; copy the latest one's index "
+                            "RIFF (ending -0.riff) back to %s to make incremental runs against it."
+                            % (count_runs, ns.drop))
+        print(message)
+        ns.logs.log(message)
+        return ops_list, ops_list
+
+    full_index = {}
+    to_pack = {}
+    if isinstance(ops_list, tapestry.FileTable):
+        full_index = tapestry.FileTable(os.path.splitext(ops_list.path)[0] + "-incremental.db")
+        to_pack = full_index.unpacked()
+    referenced_runs = set()
+    same_digests = previous_index.digest_algorithm == ns.digest_algorithm
+    if not same_digests:
+        print("%s was hashed with %s, not %s, so every file will be packed again." %
+              (base_run, previous_index.digest_algorithm, ns.digest_algorithm))
+        ns.logs.log("The digest algorithm changed since %s, so no files can be referenced from it." % base_run)
+    for fid, entry in ops_list.items():
+        previous_fid = None
+        if same_digests:
+            previous_fid = previous_index.find_path(entry["category"], entry["fpath"])
+        if previous_fid is not None:
+            previous_entry = previous_index.file_index[previous_fid]
+            if previous_entry["sha256"] == entry["sha256"] and previous_entry["fsize"] == entry["fsize"]:
+                entry = entry.copy()
+                entry.update({"run": previous_entry.get("run", base_run)})
+                for key in ["block", "offset", "length"]:  # Where the earlier run stored it.
+                    if key in previous_entry:
+                        entry.update({key: previous_entry[key]})
+                referenced_runs.add(entry["run"])
+                full_index.update({previous_fid: entry})
+                continue
+        full_index.update({fid: entry})
+        to_pack.update({fid: entry})
+    if isinstance(ops_list, tapestry.FileTable):
+        ops_list.close()
+
+    ns.base_run = base_run
+    ns.referenced_runs = sorted(referenced_runs)
+    ns.logs.log("Incremental run against %s: %s of %s files are new or changed; the rest are referenced "
+                "from %s earlier run(s)." % (base_run, len(to_pack), len(full_index), len(referenced_runs)))
+
+    return full_index, to_pack
+
+
+def build_index_task(ops_list, namespace, gpg_agent):
+    """Writes the full RIFF for the run into the drop directory as block 0 of
+    the run, along with the same index in binary form (see BinaryIndex), and
+    returns a TaskBlockStream which will turn them into an encrypted block
+    holding nothing but those two. The index block is signed,
+    deposited and retrieved along with the other blocks, and is where
+    recovery looks for the run's index first.
+
+    :param ops_list: the complete ops list for the run, including the entries
+    for unchanged files in an incremental run.
+    :param namespace: the entire namespace object, after build_blocks.
+    :param gpg_agent: a python-gnupg GPG agent object.
+    :return: a tapestry.TaskBlockStream.
+    """
+    ns = namespace
+    index_block = tapestry.Block(ns.compid+"-"+str(datetime.date.today())+"-0", 0, 0, 0)
+    sum_files = sum(1 for entry in ops_list.values() if entry.get("run") is None)
+    riff = index_block.meta(ns.sum_blocks, ns.sum_size, sum_files, str(datetime.date.today()),
+                            ns.comment_string, ops_list, ns.drop, ns.base_run, ns.referenced_runs, "run",
+                            ns.digest_algorithm)
+    binary_index = tapestry.BinaryIndex.write(os.path.join(ns.drop, index_block.name+".ridx"), ops_list,
+                                              {"metaBlock": index_block.block_metadata,
+                                               "metaRun": index_block.run_metadata, "indexScope": "run"})
+    level = None
+    if ns.compress:
+        level = ns.compressLevel
+
+    return tapestry.TaskBlockStream(os.path.join(ns.drop, index_block.name+".tap"), [], riff,
+                                    ns.activeFP, gpg_agent, level, binary_index)
+
+
 def build_recovery_index(ops_list):
     """Provided with the output of a build_ops_list function, this function
     will return a sorted recovery index (fit for blocksort, which is contained
@@ -140,18 +483,64 @@ def build_recovery_index(ops_list):
 
     :param ops_list: the "files_index" object returned by build_ops_list
     """
+    if isinstance(ops_list, tapestry.FileTable):  # Sorted on disk, and read back as it is packed.
+        return ops_list.by_size(), ops_list.total_size()
+
     dict_sizes = {}
     sum_size = 0
     for findex in ops_list.keys():
         sum_size += ops_list[findex]['fsize']
         dict_sizes.update({findex: ops_list[findex]['fsize']})
 
-    working_index = sorted(dict_sizes, key=dict_sizes.__getitem__)
-    working_index.reverse()
+    # Ties are broken on the FID so that the blocksort is deterministic.
+    working_index = sorted(dict_sizes, key=lambda fid: (dict_sizes[fid], fid), reverse=True)
 
     return working_index, sum_size
 
 
+def catalog_run(ops_list, namespace):
+    """Records the finished run in the local catalog (see RunCatalog), so that
+    it can be searched with --search. A catalog which can't be written is
+    logged, but doesn't fail the run.
+
+    :param ops_list: the complete ops list for the run.
+    :param namespace: the entire namespace object, after write_run_manifest.
+    :return:
+    """
+    ns = namespace
+    try:
+        catalog = tapestry.RunCatalog(ns.catalog_path)
+        catalog.record_run(ns.run_manifest, ops_list, ns.drop)
+        catalog.close()
+    except (sqlite3.Error, OSError) as error:
+        ns.logs.log("The run could not be recorded in the catalog at %s: %s" % (ns.catalog_path, error))
+        return
+    ns.logs.log("Recorded %s files from %s in the catalog at %s." %
+                (len(ops_list), ns.run_manifest["run"], ns.catalog_path))
+
+
+def check_block_digests(namespace, digests, index):
+    """Compares the digests measured from a block's members with those in the
+    index, logging every file which is missing from the index or whose hash
+    does not match.
+
+    :param namespace: the entire namespace object.
+    :param digests: dict of FID: hexdigest, in the index's digest algorithm.
+    :param index: dict of FID: file entry, such as the ops list.
+    :return: the number of failed checks.
+    """
+    count_failed = 0
+    for fid, digest in digests.items():
+        if fid not in index:
+            count_failed += 1
+            namespace.logs.log("File %s was not found in the recovery index." % fid)
+        elif digest != index[fid]['sha256']:
+            count_failed += 1
+            namespace.logs.log("File %s has an invalid hash." % fid)
+
+    return count_failed
+
+
 def clean_up(working_directory):
     """Releases the memory space used up by temp, because we're polite."""
     if os.path.exists(working_directory):
@@ -168,37 +557,11 @@ def compress_blocks(ns, targets, do_compression=True, compression_level=1):
     :return: list of absolute paths of the resulting files.
     """
     if do_compression:
-        worker_count = os.cpu_count()
-        compress_queue = mp.JoinableQueue()
+        tasks = []
         for target in targets:
-            task = tapestry.TaskCompress(target, compression_level)
-            compress_queue.put(task)
-        workers = []
-        sum_jobs = int(compress_queue.qsize())
-        done = mp.JoinableQueue()
-        for i in range(worker_count):
-            workers.append(tapestry.ChildProcess(compress_queue, done, ns.workDir, ns.debug))
-        rounds_complete = 0
+            tasks.append(tapestry.TaskCompress(target, compression_level))
         debug_print(str(targets)+"\n")
-        for w in workers:
-            w.start()
-        working = True
-        status_print(0, sum_jobs, "Compressing", "Working...")  # We need an initial status print
-        while working:
-            message = done.get()
-            if message is None:
-                working = False
-            else:
-                if not ns.debug:
-                    message = "Working..."
-                rounds_complete += 1
-                status_print(rounds_complete, sum_jobs, "Compressing", message)
-                if rounds_complete == sum_jobs:
-                    done.put(None)  # Use none as a poison pill to kill the queue.
-                done.task_done()
-        compress_queue.join()
-        for w in workers:
-            compress_queue.put(None)
+        run_tasks(ns, tasks, "Compressing", fatal=True)
         replacement_list = []
         for target in targets:
             out = target+".bz2"
@@ -210,6 +573,122 @@ def compress_blocks(ns, targets, do_compression=True, compression_level=1):
     return replacement_list
 
 
+def crawl_categories(namespace, categories, roots=None):
+    """Walks each of the argued categories, yielding every file found in
+    exactly the order os.walk would, but listing directories with os.scandir
+    on a pool of ns.crawl_threads threads. Each file is stat'd once, through
+    its directory entry, and checked with a single os.access call, so on a
+    network share most of the waiting for the server happens in parallel.
+    Directories are listed ahead of the caller, by at most 64 per thread.
+
+    :param namespace: the entire namespace object.
+    :param categories: list of category labels, as keys of ns.category_paths.
+    :param roots: optional list of (category, directory) tuples to walk
+    instead of the categories' top directories.
+    :return: generator of (category, absolute path, os.stat_result or None,
+    True if the file exists and can be read and written) tuples.
+    """
+    ns = namespace
+    lock = threading.Lock()
+    budget = [max(ns.crawl_threads, 1) * 64]  # Listings which may run ahead of the caller.
+    pool = ThreadPoolExecutor(max_workers=max(ns.crawl_threads, 1))
+
+    def scan(node):
+        files, subdirectories = scan_directory(node["path"])
+        children = [{"path": path, "future": None, "ahead": False} for path in subdirectories]
+        with lock:
+            for child in children:
+                if budget[0] > 0:
+                    try:
+                        child["future"] = pool.submit(scan, child)
+                    except RuntimeError:  # The caller has stopped walking and shut the pool down.
+                        break
+                    budget[0] -= 1
+                    child["ahead"] = True
+        return files, children
+
+    try:
+        stack = []
+        if roots is None:
+            roots = [(category, ns.category_paths[category]) for category in categories]
+        for category, path in roots:
+            root = {"category": category, "path": path, "future": None, "ahead": False}
+            root["future"] = pool.submit(scan, root)
+            stack.append(root)
+        stack.reverse()
+        while stack:  # Depth first, each directory's files before its subdirectories, as os.walk goes.
+            node = stack.pop()
+            if node["future"] is None:
+                node["future"] = pool.submit(scan, node)
+            files, children = node["future"].result()
+            if node["ahead"]:
+                with lock:
+                    budget[0] += 1
+            for child in reversed(children):
+                child["category"] = node["category"]
+                stack.append(child)
+            for path, stats, accessible in files:
+                yield node["category"], path, stats, accessible
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def crawl_changes(namespace, changes):
+    """Visits only the paths a change journal listed, yielding what
+    crawl_categories would have found at each: a changed file is stat'd and
+    checked on its own, and a changed directory, such as one which was
+    created or moved into place, is walked with crawl_categories. Paths
+    which no longer exist yield nothing.
+
+    :param namespace: the entire namespace object.
+    :param changes: dict of {category: {path below the category: True if the
+    directory there must be walked}}, as from tapestry.ChangeJournal.begin.
+    :return: generator of (category, absolute path, os.stat_result or None,
+    True if the file exists and can be read and written) tuples.
+    """
+    ns = namespace
+    roots = []
+    for category, paths in changes.items():
+        for path, recursive in sorted(paths.items()):
+            absolute_path = os.path.join(ns.category_paths[category], path)
+            if path and os.path.islink(absolute_path) and os.path.isdir(absolute_path):
+                continue  # Linked directories are not walked.
+            if recursive or os.path.isdir(absolute_path):
+                if os.path.isdir(absolute_path):
+                    roots.append((category, absolute_path))
+                continue
+            try:
+                stats = os.stat(absolute_path)
+                accessible = os.access(absolute_path, os.R_OK | os.W_OK)
+            except OSError:
+                if not os.path.lexists(absolute_path):
+                    continue
+                stats, accessible = None, False
+            yield category, absolute_path, stats, accessible
+    if roots:
+        yield from crawl_categories(ns, [], roots)
+
+
+def listed_in_changes(fpath, paths):
+    """Tells whether a file is among the changes a change journal listed for
+    its category: either the file itself, or a directory above it which is to
+    be walked again.
+
+    :param fpath: the file's path relative to its category.
+    :param paths: dict of {path: True if the directory there must be walked},
+    one category's part of the changes from tapestry.ChangeJournal.begin.
+    :return: bool
+    """
+    if fpath in paths:
+        return True
+    directory = fpath
+    while directory:
+        directory = os.path.dirname(directory)
+        if paths.get(directory):
+            return True
+    return False
+
+
 def debug_print(body):
     """Checks for the value of a global variable, debug, and determines whether
     or not to print the "body" argument to stout.
@@ -240,36 +719,10 @@ def decompress_blocks(namespace):
             if file.endswith(".decrypted"):
                 found_decrypted.append(os.path.join(foo, file))
 
-    tasks = mp.JoinableQueue()  # Let's populate the queue
+    tasks = []
     for file in found_decrypted:
-        tasks.put(tapestry.TaskDecompress(file))
-    sum_jobs = tasks.qsize()
-
-    workers = []
-    done = mp.JoinableQueue()
-    for i in range(os.cpu_count()):
-        workers.append(tapestry.ChildProcess(tasks, done, ns.workDir, ns.debug))
-    rounds_complete = 0
-    status_print(rounds_complete, sum_jobs, "Decompressing", "Working...")
-    for w in workers:
-        w.start()
-    working = True
-    while working:
-        message = done.get()
-        if message is None:
-            working = False
-        else:
-            if not ns.debug:
-                message = "Working..."
-            rounds_complete += 1
-            status_print(rounds_complete, sum_jobs, "Decompressing", message)
-            if rounds_complete == sum_jobs:
-                done.put(None)  # Use none as a poison pill to kill the queue.
-            done.task_done()
-    tasks.join()
-    for w in workers:
-        tasks.put(None)
-    tasks.join()
+        tasks.append(tapestry.TaskDecompress(file))
+    run_tasks(ns, tasks, "Decompressing")
 
 
 def decrypt_blocks(ns, verified_blocks, gpg_agent):
@@ -283,70 +736,61 @@ def decrypt_blocks(ns, verified_blocks, gpg_agent):
     :param gpg_agent: A python-gnupg GPG object.
     :return:
     """
-    worker_count = os.cpu_count()
-    """It should be noted this method of obtaining the maximum number of
-    processes to spawn is highly simplistic. Performance enhancements in
-    Tapestry's future will likely focus around finding a more elegant way
-    to do this.
-    """
-    tasks = mp.JoinableQueue()  # This queue provides jobs to be done.
-    done = mp.JoinableQueue()  # This queue provides jobs which ARE done.
-    workers = []
-    for i in range(worker_count):
-        workers.append(tapestry.ChildProcess(tasks, done, ns.workDir, ns.debug))
+    tasks = []
     for block in verified_blocks:
         if not os.path.exists(block+".decrypted"):  # No sense repeating
-            tasks.put(tapestry.TaskDecrypt(block, ns.workDir, gpg_agent))
-    sum_jobs = tasks.qsize()
-    rounds_complete = 0
-    for w in workers:
-        w.start()
-    working = True
-    if sum_jobs > 0:  # This would be the case if the block fails.
-        status_print(rounds_complete, sum_jobs, "Decrypting", "Working...")
-        while working:
-            message = done.get()
-            if message is None:
-                working = False
-            else:
-                if not ns.debug:
-                    message = "Working..."
-                rounds_complete += 1
-                status_print(rounds_complete, sum_jobs, "Decrypting", message)
-                if rounds_complete == sum_jobs:
-                    done.put(None)  # Use none as a poison pill to kill the queue.
-                done.task_done()
-        tasks.join()
-        for w in workers:
-            tasks.put(None)
-        tasks.join()
+            tasks.append(tapestry.TaskDecrypt(block, ns.workDir, gpg_agent))
+    if len(tasks) > 0:  # This would be the case if the block fails.
+        for result in run_tasks(ns, tasks, "Decrypting"):
+            if result.ok and "Failed" in result.value:
+                ns.logs.log(result.value)
     else:
         print("""Skipping Decryption as the current backup was decrypted during initial preparation.""")
-        for w in workers:
-            tasks.put(None)
-        tasks.join()
 
 
 def do_main(namespace, gpg_agent):
     """Basic function that holds the runtime for the entire build process."""
     debug_print("Entering do_main")
     ns = namespace
+    if ns.incremental and ns.fused_hashing and not ns.hash_cache_path:
+        # Unhashed crawl entries can't match the previous run, so everything would be repacked.
+        message = ("WARNING: Fused Hashing leaves the crawl without digests to compare against the previous run, "
+                   "and no Hash Cache Path is set to supply them, so every file would be packed again. Fused "
+                   "Hashing has been turned off for this incremental run.")
+        print(message)
+        ns.logs.log(message)
+        ns.fused_hashing = False
     print("Gathering a list of files to archive - this could take a few minutes.")
     ops_list = build_ops_list(namespace)
     debug_print("Have ops list")
+    ns.base_run = None
+    ns.referenced_runs = []
+    if ns.incremental:
+        ops_list, ops_to_pack = build_incremental_list(namespace, ops_list)
+    else:
+        ops_to_pack = ops_list
     print("Sorting the files to be archived - this could take a few minutes")
-    raw_recovery_index, namespace.sum_size = build_recovery_index(ops_list)
+    raw_recovery_index, namespace.sum_size = build_recovery_index(ops_to_pack)
     debug_print("Have RI, Proceeding to Pack")
-    if sys.platform == "win32":
-        list_blocks = windows_pack_blocks(raw_recovery_index, ops_list, namespace)
+    if ns.pipeline_blocks:
+        error = pipeline_blocks(raw_recovery_index, ops_list, namespace, gpg_agent)
+        if error:
+            print("Tapestry has encountered an error with the SFTP connection and is exiting.")
+            print("Your files will be retained locally.")
+            print("Error: %s" % error)
+            ns.logs.log("The following error arose during SFTP setup, and was fatal: \n %s" % error)
+            ns.logs.save()
+            clean_up(ns.workDir)
+            exit(5)
     else:
-        list_blocks = unix_pack_blocks(raw_recovery_index, ops_list, namespace)
-    list_blocks = compress_blocks(ns, list_blocks, ns.compress, ns.compressLevel)
-    prevalidate_blocks(ns, list_blocks, ops_list)
-    encrypt_blocks(list_blocks, gpg_agent, ns.activeFP, ns)
-    sign_blocks(namespace, gpg_agent)
-    if namespace.modeNetwork.lower() == "sftp":
-        sftp_deposit_files(namespace)
+        produce_blocks(raw_recovery_index, ops_list, namespace, gpg_agent)
+        sign_blocks(namespace, gpg_agent)
+        write_run_manifest(ops_list, namespace, gpg_agent)
+        if namespace.modeNetwork.lower() == "sftp":
+            sftp_deposit_files(namespace)
+    catalog_run(ops_list, namespace)
+    if isinstance(ops_list, tapestry.FileTable):
+        ops_list.close()
     clean_up(namespace.workDir)
     print("The temporary working directories have been cleared and your files")
     print("are now stored here: %s" % namespace.drop)
@@ -367,13 +811,14 @@ def do_recovery(namespace, gpg_agent):
     else:
         ns.logs.log("Attempting to search %s for recovery files." % namespace.recovery_path)
         rec_index = media_retrieve_files(namespace.recovery_path, namespace.workDir,
-                                         gpg_agent, ns.logs)
+                                         gpg_agent, ns.logs, ns.restore_paths, ns.restore_categories)
         namespace.rec_index = rec_index
         debug_print("DoRecovery: namespace after MRF: %s" % namespace)
     verified_blocks = verify_blocks(namespace, gpg_agent)
-    decrypt_blocks(namespace, verified_blocks, gpg_agent)
-    decompress_blocks(namespace)
-    unpack_blocks(namespace)
+    if not (ns.streaming_restore and stream_restore_blocks(namespace, verified_blocks, gpg_agent)):
+        decrypt_blocks(namespace, verified_blocks, gpg_agent)
+        decompress_blocks(namespace)
+        unpack_blocks(namespace)
     clean_up(namespace.workDir)
     debug_print("REC: Got this far, so I should terminate")
     ns.logs.save()
@@ -392,36 +837,212 @@ def encrypt_blocks(targets, gpg_agent, fingerprint, namespace):
     """
     ns = namespace
     out = ns.drop
-    jobs = mp.JoinableQueue()
+    tasks = []
     for target in targets:
-        job = tapestry.TaskEncrypt(target, fingerprint, out, gpg_agent)
-        jobs.put(job)
-    workers = []
-    sum_jobs = int(jobs.qsize())
-    done = mp.JoinableQueue()
-    for i in range(os.cpu_count()):
-        workers.append(tapestry.ChildProcess(jobs, done, ns.workDir, ns.debug))
-    rounds_complete = 0
-    for w in workers:
-        w.start()
-    working = True
-    status_print(rounds_complete, sum_jobs, "Encrypting", "Working...")
-    while working:
-        message = done.get()
-        if message is None:
-            working = False
-        if not ns.debug:
-            message = "Working..."
-        rounds_complete += 1
-        if rounds_complete == sum_jobs:
-            done.put(None)  # Use none as a poison pill to kill the queue.
-        if rounds_complete <= sum_jobs:
-            status_print(rounds_complete, sum_jobs, "Encrypting", message)
-        done.task_done()
-    jobs.join()
-    for w in workers:
-        jobs.put(None)
-    jobs.join()
+        tasks.append(tapestry.TaskEncrypt(target, fingerprint, out, gpg_agent))
+    failures = [result.value for result in run_tasks(ns, tasks, "Encrypting", fatal=True)
+                if "Failed" in result.value]
+    for failure in failures:
+        ns.logs.log(failure)
+    if failures:
+        abort_run(ns, "%s of %s blocks could not be encrypted." % (len(failures), len(tasks)))
+
+
+def physical_offset(path):
+    """Asks the filesystem where the first extent of a file starts on disk,
+    using the FIEMAP ioctl, which Linux supports on most local filesystems.
+
+    :param path: absolute path to the file.
+    :return: the physical byte offset of the file's first extent, or None if
+    it has none (such as an empty file) or it can't be found out.
+    """
+    if fcntl is None:
+        return None
+    header = struct.Struct("=QQLLLL")  # fm_start, fm_length, fm_flags, fm_mapped_extents, fm_extent_count, reserved
+    extent = struct.Struct("=QQQQQLLLL")  # fe_logical, fe_physical, fe_length, reserved, fe_flags, reserved
+    request = bytearray(header.pack(0, 0xFFFFFFFFFFFFFFFF, 0, 0, 1, 0) + bytes(extent.size))
+    try:
+        with open(path, "rb") as f:
+            fcntl.ioctl(f.fileno(), 0xC020660B, request, True)  # FS_IOC_FIEMAP
+    except OSError:
+        return None
+    if header.unpack_from(request)[3] == 0:
+        return None
+
+    return extent.unpack_from(request, header.size)[1]
+
+
+def read_order_key(path, stats, policy):
+    """Returns a sort key which puts reads of the argued file in the order
+    the Read Order policy asks for. Files are grouped by device, then sorted
+    by inode number ("inode"), which on most filesystems roughly follows
+    where they were allocated, or by where their data actually starts on
+    disk ("physical"). Files without a known physical offset sort by inode,
+    ahead of the rest of their device.
+
+    :param path: absolute path to the file.
+    :param stats: the file's os.stat_result, or None to stat it here.
+    :param policy: "inode" or "physical".
+    :return: a tuple of integers.
+    """
+    if stats is None:
+        try:
+            stats = os.stat(path)
+        except OSError:
+            return 0, -1, 0
+    offset = -1
+    if policy == "physical":
+        offset = physical_offset(path)
+        if offset is None:
+            offset = -1
+
+    return stats.st_dev, offset, stats.st_ino
+
+
+def record_block_layout(ops_list, layout):
+    """Writes the offset and length of each packed member, as returned by
+    TaskBlockBuild or TaskBlockStream, into its ops list entry, so that the
+    run's index can say where in its block every file is.
+
+    :param ops_list: The full ops list prepared by build_ops_list.
+    :param layout: dict of FID: result, each holding "offset" and "length".
+    :return:
+    """
+    for fid, member in layout.items():
+        if fid in ops_list:
+            ops_list[fid].update({"offset": member["offset"], "length": member["length"]})
+
+
+def drop_skipped_files(namespace, ops_list, skipped, collection_blocks=()):
+    """Leaves the files a block task couldn't read, because they had gone or
+    become unreadable since the crawl, out of the run's index, and logs each.
+    The block's own RIFF has already left them out, unless it is still to be
+    written from the blocks, as with fused hashing.
+
+    :param namespace: the entire namespace object.
+    :param ops_list: The full ops list prepared by build_ops_list.
+    :param skipped: dict of FID: error, as returned by TaskBlockBuild or
+    TaskBlockStream.
+    :param collection_blocks: list of tapestry.Block objects whose RIFFs are
+    yet to be written.
+    :return:
+    """
+    ns = namespace
+    for fid, error in skipped.items():
+        entry = ops_list.pop(fid, None)
+        if entry is not None:
+            fid = os.path.join(ns.category_paths[entry["category"]], entry["fpath"])
+        message = "Error reading %s: %s. It has been left out of this run." % (fid, error)
+        print(message)
+        ns.logs.log(message)
+    for block in collection_blocks:
+        if isinstance(block.file_index, dict):  # A FileTable's views lose the files along with the ops list.
+            for fid in skipped:
+                block.file_index.pop(fid, None)
+
+
+def finalize_fused_index(collection_blocks, block_final_paths, ops_list, digests, namespace):
+    """Completes the index of a fused-hashing run once its blocks are packed.
+    The digests and sizes measured while packing are written into the ops
+    list, files which changed while they were read are flagged and logged,
+    the hash cache (if any) is updated, and each block's RIFF is written and
+    appended to its tarfile. The end of each tarfile is known from the layout
+    of its last member, so the RIFF is written over the end-of-archive marker
+    there without reading the tarfile back.
+
+    :param collection_blocks: list of tapestry.Block objects, already packed.
+    :param block_final_paths: the tarfiles returned by build_block_tasks.
+    :param ops_list: The full ops list prepared by build_ops_list.
+    :param digests: dict of FID: result, as returned by TaskBlockBuild.
+    :param namespace: the entire namespace object.
+    :return:
+    """
+    ns = namespace
+    hash_cache = None
+    if ns.hash_cache_path:
+        hash_cache = tapestry.HashCache(ns.hash_cache_path, algorithm=ns.digest_algorithm)
+    count_changed = 0
+    for fid, result in digests.items():
+        entry = ops_list[fid]
+        entry.update({"sha256": result["sha256"], "fsize": result["fsize"]})
+        path = os.path.join(ns.category_paths[entry["category"]], entry["fpath"])
+        if result["changed"]:
+            count_changed += 1
+            entry.update({"changedDuringRead": True})
+            message = "%s changed while it was being packed; the stored copy may be inconsistent." % path
+            print(message)
+            ns.logs.log(message)
+        elif hash_cache is not None:
+            try:
+                hash_cache.put(path, os.stat(path), result["sha256"])
+            except OSError:
+                pass  # Gone since packing; the cache will simply miss it next time.
+    if hash_cache is not None:
+        hash_cache.close()
+    ns.logs.log("Fused hashing recorded %s digests; %s files changed while being read." %
+                (len(digests), count_changed))
+
+    riffs = build_block_riffs(collection_blocks, ops_list, ns)
+    for block, tarf, riff in zip(collection_blocks, block_final_paths, riffs):
+        end = max([digests[fid]["offset"] + digests[fid]["length"] for fid in block.file_index if fid in digests],
+                  default=0)  # Where the end-of-archive marker starts; opening with "a:" would read every header.
+        with open(tarf, "r+b") as f:
+            f.seek(end)
+            f.truncate()
+            with tarfile.open(fileobj=f, mode="w:") as tar:
+                tar.add(riff, arcname="recovery-riff", recursive=False)
+
+
+def find_previous_index(drop_dir, compid, current_run):
+    """Searches the drop directory for the RIFFs left behind by earlier runs of
+    this machine and loads the index of the most recent one. The current run
+    is excluded, since its outputs will be overwritten. The run's full index
+    is read from its index block's binary index or RIFF (block 0); older runs
+    carried the full index in every RIFF, and if a newer run's block 0 RIFF
+    is missing, the index is pieced together from its blocks' RIFFs. A binary
+    index which is empty, truncated or otherwise unreadable is passed over
+    for the RIFF.
+
+    :param drop_dir: the output directory, ns.drop.
+    :param compid: the compid of this machine.
+    :param current_run: the run label (compid-date) of the current run.
+    :return: tuple of (run label, tapestry.RecoveryIndex), or (None, None).
+    """
+    latest_run = None
+    run_riffs = {}
+    if os.path.isdir(drop_dir):
+        for file in os.listdir(drop_dir):
+            if not file.endswith(".riff"):
+                continue
+            run_label, block_number = parse_block_name(file)
+            if block_number is None or run_label == current_run:
+                continue
+            if run_label.startswith(compid+"-") and len(run_label) == len(compid) + 11:
+                run_riffs.setdefault(run_label, {}).update({block_number: os.path.join(drop_dir, file)})
+                if latest_run is None or run_label[-10:] > latest_run[-10:]:
+                    latest_run = run_label
+
+    if latest_run is None:
+        return None, None
+    riffs = run_riffs[latest_run]
+    binary_index = os.path.join(drop_dir, latest_run+"-0.ridx")
+    if 0 in riffs and os.path.isfile(binary_index):  # Memory mapped, so nothing is loaded up front.
+        try:
+            with open(binary_index, "rb") as index_file:
+                return latest_run, tapestry.RecoveryIndex(index_file)
+        except tapestry.RecoveryIndexError as e:
+            print("The binary index %s could not be read (%s). The run's RIFF will be used instead."
+                  % (binary_index, e))
+    with open(riffs[min(riffs)], "rb") as riff:
+        previous_index = tapestry.RecoveryIndex(riff)
+    if previous_index.mode != "json":
+        return None, None
+    if previous_index.partial:
+        for block_number in sorted(riffs)[1:]:
+            with open(riffs[block_number], "rb") as riff:
+                previous_index.merge(tapestry.RecoveryIndex(riff))
+
+    return latest_run, previous_index
 
 
 def format_table(dict_data, list_column_order, output_width):
@@ -552,6 +1173,21 @@ def keyring_get_value(key, strict=True):
     return value
 
 
+def get_worker_pool(namespace):
+    """Returns the run's shared worker pool, starting one on the namespace if
+    it doesn't have one yet. runtime() starts the pool up front and shuts it
+    down at the end; the lazy start is there for callers that build their
+    own namespace.
+
+    :param namespace: the entire namespace object.
+    :return: a started tapestry.WorkerPool.
+    """
+    ns = namespace
+    if getattr(ns, "pool", None) is None:
+        ns.pool = tapestry.WorkerPool(ns.workDir, debug=ns.debug).start()
+    return ns.pool
+
+
 def get_user_input(message, dict_data, resp_column, list_column_order):
     # get the size of the terminal window
     width, height = shutil.get_terminal_size((80, 24))
@@ -579,35 +1215,131 @@ def get_user_input(message, dict_data, resp_column, list_column_order):
     return lookup_list[response]
 
 
-def media_retrieve_files(mountpoint, temp_path, gpg_agent, logs):
+def load_run_manifest(path, gpg_agent, logs):
+    """Checks the detached signature on a run manifest, as written by
+    write_run_manifest, then decrypts and parses it. Nothing here touches the
+    run's blocks, so this is the cheap first step of recovery and validation.
+
+    :param path: absolute path to the .manifest file; its signature is
+    expected alongside it, as path+".sig".
+    :param gpg_agent: a python-gnupg GPG agent object.
+    :param logs: ns.logs, the SimpleLogger object.
+    :return: the manifest as a dict, or None if it is missing, unsigned,
+    can't be decrypted or can't be read, in which case the caller should fall
+    back to the run's blocks.
+    """
+    if not (os.path.isfile(path) and os.path.isfile(path+".sig")):
+        return None
+    with open(path+".sig", "rb") as sig:
+        verified = gpg_agent.verify_file(sig, path)
+    if not verified.valid:
+        logs.log("The run manifest %s has an invalid signature and was ignored." % os.path.basename(path))
+        return None
+    with open(path, "rb") as f:
+        k = gpg_agent.decrypt_file(f, always_trust=True)
+    if not k.ok:
+        logs.log("The run manifest %s could not be decrypted, status: %s" % (os.path.basename(path), k.status))
+        return None
+    try:
+        manifest = json.loads(k.data.decode("utf-8"))
+    except ValueError:
+        logs.log("The run manifest %s is damaged and was ignored." % os.path.basename(path))
+        return None
+    if manifest.get("run") != parse_block_name(path)[0]:
+        logs.log("The run manifest %s belongs to %s and was ignored." % (os.path.basename(path), manifest.get("run")))
+        return None
+
+    return manifest
+
+
+def summarise_run_manifest(manifest):
+    """Describes the run behind a manifest in a few lines, so that the user
+    can tell whether it is the backup they are after.
+
+    :param manifest: a dict, as returned by load_run_manifest.
+    :return: a string.
+    """
+    meta = manifest["metaRun"]
+    lines = ["Run %s, taken on %s: %s" % (manifest["run"], meta["dateRec"], meta["comment"]),
+             "%s files (%s bytes) in %s blocks, %s bytes stored." %
+             (meta["countFilesSum"], meta["sizeExtraLarge"], meta["sumBlock"], sum(manifest["blocks"].values()))]
+    if meta.get("baseRun") is not None:
+        lines.append("Incremental against %s; unchanged files are in the blocks of: %s" %
+                     (meta["baseRun"], ", ".join(meta["referencedRuns"])))
+
+    return "\n".join(lines)
+
+
+def media_select_run(found_blocks, logs):
+    """Works out which runs have blocks among found_blocks and, where there is
+    more than one, polls the user for the run to recover, in the manner of
+    sftp_select_retrieval_target. Runs are offered most recent first, and an
+    empty response accepts the most recent.
+
+    :param found_blocks: list of .tap file names found on the media.
+    :param logs: ns.logs, the SimpleLogger object.
+    :return: the label of the selected run.
+    """
+    dict_counts = {}
+    for file in found_blocks:
+        run_label = parse_block_name(file)[0]
+        dict_counts.update({run_label: dict_counts.get(run_label, 0) + 1})
+    list_runs = sorted(dict_counts, key=lambda label: label[-10:], reverse=True)  # Run labels end in their date.
+    if len(list_runs) == 1:
+        return list_runs[0]
+
+    print("Blocks from more than one run were found on the media. Please enter the option number")
+    print("for the run you'd like to recover, or press enter for the most recent.")
+    for number, run_label in enumerate(list_runs, 1):
+        print("%s - %s (%s blocks found)" % (number, run_label, dict_counts[run_label]))
+    while True:
+        response = input("Enter the row number of your selection: ").strip()
+        if response == "":
+            selected = list_runs[0]
+            break
+        elif response.isdigit() and 1 <= int(response) <= len(list_runs):
+            selected = list_runs[int(response)-1]
+            break
+        print("Please enter a number from 1 to %s." % len(list_runs))
+    logs.log("The user selected %s from the runs on the media: %s" % (selected, list_runs))
+    return selected
+
+
+def media_retrieve_files(mountpoint, temp_path, gpg_agent, logs, paths=None, categories=None):
     """Iterates over mountpoint, moving .tap files and their signatures to the
-    temporary working directory. Early in operation, will retrieve the recovery
-    pickle or NewRIFF index from the first block it finds.
+    temporary working directory. If the run left a manifest (see
+    write_run_manifest), it is read first, to describe the run and name its
+    blocks. Early in operation, will retrieve the recovery
+    pickle or NewRIFF index from the first block it finds, which is the run's
+    index block (block 0) wherever one was written. Where blocks from more
+    than one run are present, the user chooses the run to recover (see
+    media_select_run), and only the blocks of that run and of the earlier
+    runs its index references (see --incremental) are retrieved. If paths or categories are given, only
+    the blocks holding the files they select are retrieved.
 
     :param mountpoint: absolute path to the media mountpoint.
     :param temp_path: absolute path to the system's working directory.
     :param gpg_agent: a python-gnupg gpg agent object
     :param logs: ns.logs, the SimpleLogger object.
+    :param paths: optional list of globs, as for select_restore_files.
+    :param categories: optional list of category labels.
     :return:
     """
     print("Now searching local media for the first block. This includes decrypting")
     print("the first block in order to obtain the recovery index. Please wait.")
-    found_blocks = []
-    found_sigs = []
+    found_files = {}
+    found_manifests = {}
     initial_block_hunt = True
 
     while initial_block_hunt:
+        debug_print("media_retrieve_files' mountpoint is: %s" % mountpoint)
         for location, sub_directories, files in os.walk(mountpoint):
-            debug_print("media_retrieve_files' mountpoint is: %s" % mountpoint)
-            if not os.path.exists(temp_path):  # We must create this explicitly for shutil
-                os.mkdir(temp_path)
             for file in files:
-                if file.endswith(".tap"):
-                    found_blocks.append(file)
-                    shutil.copy(os.path.join(location, file), os.path.join(temp_path, file))
-                elif file.endswith(".tap.sig"):
-                    found_sigs.append(file)
-                    shutil.copy(os.path.join(location, file), os.path.join(temp_path, file))
+                if file.endswith(".tap") or file.endswith(".tap.sig"):
+                    found_files.update({file: os.path.join(location, file)})
+                elif file.endswith(".manifest") or file.endswith(".manifest.sig"):
+                    found_manifests.update({file: os.path.join(location, file)})
+        found_blocks = sorted([file for file in found_files if file.endswith(".tap")])
 
         if len(found_blocks) == 0:
             print("The are no recovery files on the mountpoint at %s" % mountpoint)
@@ -617,8 +1349,28 @@ def media_retrieve_files(mountpoint, temp_path, gpg_agent, logs):
         else:
             initial_block_hunt = False
 
+    if not os.path.exists(temp_path):  # We must create this explicitly for shutil
+        os.mkdir(temp_path)
+
+    recovered_run = media_select_run(found_blocks, logs)
+    first_block = [file for file in found_blocks if parse_block_name(file)[0] == recovered_run][0]
+    manifest = None
+    manifest_name = recovered_run+"-0.manifest"
+    if manifest_name in found_manifests and manifest_name+".sig" in found_manifests:
+        for file in [manifest_name, manifest_name+".sig"]:
+            shutil.copy(found_manifests[file], os.path.join(temp_path, file))
+        manifest = load_run_manifest(os.path.join(temp_path, manifest_name), gpg_agent, logs)
+    if manifest is None:
+        logs.log("No usable manifest was found for %s; the first block will describe the run." % recovered_run)
+    else:
+        print(summarise_run_manifest(manifest))
+        logs.log(summarise_run_manifest(manifest))
+        if manifest["indexBlock"] in found_blocks:
+            first_block = manifest["indexBlock"]
+    shutil.copy(found_files[first_block], os.path.join(temp_path, first_block))
+
     # Now we need to obtain a recovery file of some kind.
-    decrypted_first = tapestry.TaskDecrypt(os.path.join(temp_path, found_blocks[0]), temp_path, gpg_agent)
+    decrypted_first = tapestry.TaskDecrypt(os.path.join(temp_path, first_block), temp_path, gpg_agent)
     decrypted_first = decrypted_first()
     debug_print("MRF: decrypted_first is: %s" % decrypted_first)
     debug_print("MRF: The conditional is therefore: %s" % decrypted_first.split(" ")[1].lower())
@@ -628,12 +1380,8 @@ def media_retrieve_files(mountpoint, temp_path, gpg_agent, logs):
         tapfile_contents = tar.getnames()
         debug_print("The provided block contains: %s" % str(tapfile_contents))
 
-        if "recovery-pkl" in tapfile_contents:
-            index_file = tar.extractfile("recovery-pkl")
-        elif "recovery-riff" in tapfile_contents:
-            index_file = tar.extractfile("recovery-riff")
-        else:
-            index_file = open("/dev/null", "rb")  # Just for giggles
+        index_file = open_recovery_index(tar, temp_path)
+        if index_file is None:
             print("Something has gone wrong!")
             print("One or more blocks are corrupt and missing their recovery index.")
             print("This is a fatal error.")
@@ -647,18 +1395,51 @@ def media_retrieve_files(mountpoint, temp_path, gpg_agent, logs):
 
     # If we made it this far, we have a recovery file, so let's return a recovery index
     rec_index = tapestry.RecoveryIndex(index_file)
+    if rec_index.partial:
+        print("The index block for this run was not found, so the index will be rebuilt from the blocks.")
+        logs.log("No index block was found for %s; its index is being rebuilt from the block RIFFs." % recovered_run)
+    runs_needed = [recovered_run] + rec_index.referenced_runs
+    logs.log("Recovering run %s, which also requires blocks from: %s" % (recovered_run, rec_index.referenced_runs))
+    wanted = select_restore_blocks(rec_index, recovered_run, paths, categories, logs)
+    expected_blocks = rec_index.blocks
+    if wanted is not None:
+        expected_blocks = len([block for block in wanted if block[0] == recovered_run])
+
+    copied_blocks = {first_block}
+    retrieving = True
+    while retrieving:
+        for file in sorted(found_files):
+            run_label, block_number = parse_block_name(file)
+            if block_number == 0 and run_label != recovered_run:
+                continue  # Only the recovered run's own index is needed.
+            if wanted is not None and block_number != 0 and (run_label, block_number) not in wanted:
+                continue
+            if file not in copied_blocks and run_label in runs_needed:
+                shutil.copy(found_files[file], os.path.join(temp_path, file))
+                copied_blocks.add(file)
+        run_blocks = [file for file in copied_blocks
+                      if file.endswith(".tap") and parse_block_name(file) != (recovered_run, 0)
+                      and parse_block_name(file)[0] == recovered_run]
+        if len(run_blocks) < expected_blocks:
+            print("One or more blocks are missing. Please insert the next disk")
+            if manifest is not None:
+                missing = [file for file in sorted(manifest["blocks"]) if file not in copied_blocks
+                           and (wanted is None or parse_block_name(file) in wanted)]
+                print("Still needed: %s" % ", ".join(missing))
+            input("Press enter to continue")
+            for location, sub_directories, files in os.walk(mountpoint):
+                for file in files:
+                    if file.endswith(".tap") or file.endswith(".tap.sig"):
+                        found_files.update({file: os.path.join(location, file)})
+        else:
+            retrieving = False
 
-    while len(found_blocks) < rec_index.blocks:
-        print("One or more blocks are missing. Please insert the next disk")
-        input("Press enter to continue")
-        for location, sub_directories, files in os.walk(mountpoint):
-            for file in files:
-                if file.endswith(".tap"):
-                    found_blocks.append(file)
-                    shutil.copy(file, os.path.join(temp_path, file))
-                elif file.endswith(".tap.sig"):
-                    found_sigs.append(file)
-                    shutil.copy(file, os.path.join(temp_path, file))
+    for run in rec_index.referenced_runs:
+        if wanted is not None and not [block for block in wanted if block[0] == run]:
+            continue  # None of the selected files are in this run's blocks.
+        if not [file for file in copied_blocks if parse_block_name(file)[0] == run]:
+            print("No blocks were found for %s, which this run depends on; its files will be missing." % run)
+            logs.log("No blocks were found for the referenced run %s." % run)
 
     return rec_index
 
@@ -668,8 +1449,8 @@ def unix_pack_blocks(sizes, ops_list, namespace):
     returns a list of those files and their absolute paths to be processed by
     the next stage of events. This version is specific to unix systems (defined
     as all non-windows systems in this case) and uses the multiprocessing
-    module to gain about a 20% performance increase on average compared to the
-    windows version.
+    module to build several blocks at once. Each block is built start to finish
+    by a single worker, so no locking between workers is required.
 
     :param sizes: a list object returned by build_recovery_index, made up of
     strings indicating file identifier values sorted by the size of the file.
@@ -679,82 +1460,46 @@ def unix_pack_blocks(sizes, ops_list, namespace):
     :return:
     """
     ns = namespace
-    collection_blocks = []
-    block_final_paths = []
-    block_name_base = ns.compid+"-"+str(datetime.date.today())
-    counter = 1  # Remember to increment this later
-    smallest = ops_list[sizes[-1]]['fsize']
-    working_block = tapestry.Block(
-        (block_name_base+"-"+str(counter)), ns.block_size_raw, counter, smallest
-    )
-    packing = True
-    while packing:
-        for item in sizes:
-            placed = working_block.put(item, ops_list[item])
-            if placed:
-                sizes.remove(item)
-        if working_block.full:  # We need a new block, unpacked items.
-            collection_blocks.append(working_block)
-            counter += 1
-            working_block = tapestry.Block(
-                (block_name_base+"-"+str(counter)), ns.block_size_raw, counter, smallest
-            )
-        elif len(sizes) == 0:
-            collection_blocks.append(working_block)
-            packing = False  # The list is empty and we're therefore done.
-    tarf_queue = mp.JoinableQueue()
-    locks = {}
-    temp_queue = []  # We need a temporary queue to avoid having the blocks all lined up.
-    sum_files = 0
-    for block in collection_blocks:
-        sum_files += block.files
-    sum_sizes = ns.sum_size
-    for block in collection_blocks:
-        this_block_lock = mp.Lock()
-        locks.update({block.name: this_block_lock})
-        tarf = os.path.join(ns.workDir, (block.name+".tar"))
-        block_final_paths.append(tarf)
-        for fid, file_metadata in block.file_index.items():
-            path = os.path.join(ns.category_paths[file_metadata["category"]],
-                                file_metadata['fpath'])
-            this_task = tapestry.TaskTarBuild(tarf, fid, path, block.name)
-            temp_queue.append(this_task)
-        this_riff = block.meta(len(collection_blocks), sum_sizes, sum_files,
-                               str(datetime.date.today()), ns.comment_string, ops_list, ns.drop)
-        this_task = tapestry.TaskTarBuild(tarf, "recovery-riff",
-                                          this_riff, block.name)
-        tarf_queue.put(this_task)
-    shuffle(temp_queue)  # Shuffling these tasks before feeding them into the queue is actually a speed boost.
-    for task in temp_queue:
-        tarf_queue.put(task)
-    sum_jobs = int(tarf_queue.qsize())
-    done = mp.JoinableQueue()
-    workers = []
-    for i in range(os.cpu_count()):
-        workers.append(tapestry.ChildProcess(tarf_queue, done, ns.workDir, locks, ns.debug))
-    rounds_complete = 0
-    for w in workers:
-        w.start()
-    working = True
-    while working:
-        message = done.get()
-        if message is None:
-            working = False
-        else:
-            if not namespace.debug:
-                message = "Working..."
-            rounds_complete += 1
-            status_print(rounds_complete, sum_jobs, "Packing", message)
-            if rounds_complete == sum_jobs:
-                done.put(None)  # Use none as a poison pill to kill the queue.
-            done.task_done()
-    tarf_queue.join()
-    for w in workers:
-        tarf_queue.put(None)
+    collection_blocks = build_blocks(sizes, ops_list, ns)
+    tasks, block_final_paths = build_block_tasks(collection_blocks, ops_list, ns)
+    digests = {}
+    skipped = {}
+    for result in run_tasks(ns, tasks, "Packing", fatal=True):  # A block missing files can't be let through.
+        digests.update(result.value[1])  # Fused hashing returns the digests along with the layout.
+        skipped.update(result.value[2])
+    record_block_layout(ops_list, digests)
+    drop_skipped_files(ns, ops_list, skipped, collection_blocks)
+    if ns.fused_hashing:
+        finalize_fused_index(collection_blocks, block_final_paths, ops_list, digests, ns)
 
     return block_final_paths
 
 
+def open_recovery_index(tar, temp_path):
+    """Opens the most useful recovery index held in a block: a Recovery Pickle
+    for the oldest runs, otherwise the binary index carried by an index block,
+    otherwise the block's RIFF. The binary index is extracted into temp_path
+    first, so that RecoveryIndex can memory map it.
+
+    :param tar: an open tarfile.TarFile of a decrypted block.
+    :param temp_path: the working directory to extract into.
+    :return: a binary file object to hand to RecoveryIndex, or None if the
+    block holds no index at all.
+    """
+    contents = tar.getnames()
+    if "recovery-pkl" in contents:
+        return tar.extractfile("recovery-pkl")
+    elif "recovery-index" in contents:
+        member = tar.getmember("recovery-index")
+        path = os.path.join(temp_path, "recovery-index.ridx")
+        with open(path, "wb") as out:
+            shutil.copyfileobj(tar.extractfile(member), out)
+        return open(path, "rb")
+    elif "recovery-riff" in contents:
+        return tar.extractfile("recovery-riff")
+    return None
+
+
 def parse_args(namespace):
     """Parse arguments and return the modified namespace object"""
     ns = namespace
@@ -766,6 +1511,8 @@ def parse_args(namespace):
                         action="store_true")
     parser.add_argument('--inc', help="Tells the system to include non-default sections in the backup process.",
                         action="store_true")
+    parser.add_argument('--incremental', help="Pack only files that are new or changed since the last run.",
+                        action="store_true")
     parser.add_argument('--debug', help="Increase output verbosity.", action="store_true")
     parser.add_argument('--genKey', help="Generates a new key before proceeding with any other functions called.",
                         action="store_true")
@@ -777,10 +1524,26 @@ def parse_args(namespace):
                                          action="store_true")
     parser.add_argument('-n', help="note to add to the metadata for this run for your future reference",
                         action='store', default=None)
+    parser.add_argument('--path', help="With --rcv, restore only files whose path below their category (or "
+                                       "category/path) matches this glob, or which are inside this directory. "
+                                       "With --search, find only these files. May be given more than once.",
+                        action="append", default=None)
+    parser.add_argument('--category', help="With --rcv, restore only files from this category. With --search, "
+                                           "find only files from this category. May be given more than once.",
+                        action="append", default=None)
+    parser.add_argument('--search', help="Search the catalog of previous runs, using --path, --category, --hash "
+                                         "and --date, without touching any block.", action="store_true")
+    parser.add_argument('--hash', help="With --search, find only files whose SHA-256 starts with this.",
+                        action="store", default=None)
+    parser.add_argument('--date', help="With --search, find only runs whose date (YYYY-MM-DD) starts with this.",
+                        action="store", default=None)
+    parser.add_argument('--watch', help="Run the watcher which keeps the change journal (see Change Journal Path) "
+                                        "up to date, until stopped.", action="store_true")
     args = parser.parse_args()
 
     ns.rcv = args.rcv
     ns.inc = args.inc
+    ns.incremental = args.incremental
     ns.debug = args.debug
     ns.devtest = args.devtest
     ns.genKey = args.genKey
@@ -788,6 +1551,12 @@ def parse_args(namespace):
     ns.validation_target = args.validate
     ns.secrets = args.secrets
     ns.comment_string = args.n
+    ns.restore_paths = args.path
+    ns.restore_categories = args.category
+    ns.search = args.search
+    ns.search_hash = args.hash
+    ns.search_date = args.date
+    ns.watch = args.watch
     if ns.validation_target is not None:
         ns.demand_validate = True
     else:
@@ -796,13 +1565,29 @@ def parse_args(namespace):
     return ns
 
 
+def parse_block_name(filename):
+    """Splits the filename of a block, or of one of its companion files, into
+    the label of the run that produced it (compid-date) and its block number.
+
+    :param filename: a name such as "compid-2019-01-01-3.tap.sig".
+    :return: tuple of (run label, int block number); names that do not follow
+    the block naming scheme come back as (name without extensions, None).
+    """
+    name = os.path.basename(filename)
+    match = re.match(r"^(.+)-(\d+)(\.[\w.]*)?$", name)
+    if match is None:
+        return name.split(".")[0], None
+
+    return match.group(1), int(match.group(2))
+
+
 def windows_pack_blocks(sizes, ops_list, namespace):
     """Processes files by creating the individual tarred tapblock files, and
     returns a list of those files and their absolute paths to be processed by
     the next stage of events. This version is meant to be used when the
     detected operating system is windows (sys.platform == "win32"). This runs
-    in a single-process workflow because we've yet to implement an operating
-    locking method under windows.
+    the same block-building tasks as the unix version, but executes them one
+    after the other in a single process.
 
     :param sizes: a list object returned by build_recovery_index, made up of
     strings indicating file identifier values sorted by the size of the file.
@@ -812,51 +1597,26 @@ def windows_pack_blocks(sizes, ops_list, namespace):
     :return:
     """
     ns = namespace
-    collection_blocks = []
-    block_final_paths = []
-    block_name_base = ns.compid + "-" + str(datetime.date.today())
-    counter = 1  # Remember to increment this later
-    smallest = ops_list[sizes[-1]]['fsize']
-    working_block = tapestry.Block(
-        (block_name_base + "-" + str(counter)), ns.block_size_raw, counter, smallest
-    )
     if not os.path.exists(ns.workDir):
         os.mkdir(ns.workDir)
-
-    packing = True
-    while packing:
-        for item in sizes:
-            placed = working_block.put(item, ops_list[item])
-            if placed:
-                sizes.remove(item)
-        if working_block.full:  # We need a new block, unpacked items.
-            collection_blocks.append(working_block)
-            counter += 1
-            working_block = tapestry.Block(
-                (block_name_base + "-" + str(counter)), ns.block_size_raw, counter, smallest
-            )
-        elif len(sizes) == 0:
-            collection_blocks.append(working_block)
-            packing = False  # The list is empty and we're therefore done.
-    sum_files = 0
-    for block in collection_blocks:
-        sum_files += block.files
-    sum_sizes = ns.sum_size
-    current_counter = 0
-    for block in collection_blocks:
-        tarf = os.path.join(ns.workDir, (block.name + ".tar"))
-        block_final_paths.append(tarf)
-        for fid, file_metadata in block.file_index.items():
-            current_counter += 1
-            path = os.path.join(ns.category_paths[file_metadata["category"]],
-                                file_metadata['fpath'])
-            with tarfile.open(tarf, "a:") as tf:
-                tf.add(path, arcname=fid, recursive=False)
-            status_print(current_counter, sum_files, "Packing", None)
-        this_riff = block.meta(len(collection_blocks), sum_sizes, sum_files,
-                               str(datetime.date.today()), ns.comment_string, ops_list, ns.drop)
-        with tarfile.open(tarf, "a:") as tf:
-            tf.add(this_riff, arcname="recovery-riff", recursive=False)
+    collection_blocks = build_blocks(sizes, ops_list, ns)
+    tasks, block_final_paths = build_block_tasks(collection_blocks, ops_list, ns)
+    rounds_complete = 0
+    digests = {}
+    skipped = {}
+    status_print(rounds_complete, len(tasks), "Packing", "Working...")
+    for task in tasks:
+        message, block_digests, block_skipped = task()  # Fused hashing returns the digests along with the layout.
+        digests.update(block_digests)
+        skipped.update(block_skipped)
+        if not ns.debug:
+            message = "Working..."
+        rounds_complete += 1
+        status_print(rounds_complete, len(tasks), "Packing", message)
+    record_block_layout(ops_list, digests)
+    drop_skipped_files(ns, ops_list, skipped, collection_blocks)
+    if ns.fused_hashing:
+        finalize_fused_index(collection_blocks, block_final_paths, ops_list, digests, ns)
 
     return block_final_paths
 
@@ -916,6 +1676,29 @@ def parse_config(namespace):
         ns.uid = config.get("Environment Variables", "uid")
         ns.drop = config.get("Environment Variables", "Output Path", fallback=None)
         ns.do_validation = config.getboolean("Environment Variables", "Build-Time File Validation", fallback=True)
+        ns.hash_cache_path = config.get("Environment Variables", "Hash Cache Path", fallback=None)
+        ns.crawl_threads = config.getint("Environment Variables", "Crawl Threads", fallback=8)
+        ns.hash_threads = config.getint("Environment Variables", "Hash Threads", fallback=4)
+        ns.digest_algorithm = config.get("Environment Variables", "Digest Algorithm", fallback="sha256").lower()
+        ns.read_order = config.get("Environment Variables", "Read Order", fallback="none").lower()
+        if ns.read_order not in ["none", "inode", "physical"]:
+            print("%s is not a supported Read Order. Use one of: none, inode, physical." % ns.read_order)
+            exit(3)
+        if ns.digest_algorithm not in tapestry.DIGEST_ALGORITHMS:
+            print("%s is not a supported Digest Algorithm. Use one of: %s." %
+                  (ns.digest_algorithm, ", ".join(tapestry.DIGEST_ALGORITHMS)))
+            exit(3)
+        ns.catalog_path = config.get("Environment Variables", "Catalog Path", fallback=None)
+        if not ns.catalog_path and ns.drop:  # By default the catalog sits beside the output directory.
+            ns.catalog_path = os.path.join(os.path.dirname(os.path.normpath(ns.drop)), "tapestry-catalog.db")
+        ns.fused_hashing = config.getboolean("Environment Variables", "Fused Hashing", fallback=False)
+        ns.streaming_build = config.getboolean("Environment Variables", "Streaming Build", fallback=False)
+        ns.pipeline_blocks = config.getboolean("Environment Variables", "Pipeline Blocks", fallback=False)
+        ns.streaming_restore = config.getboolean("Environment Variables", "Streaming Restore", fallback=False)
+        ns.spill_to_disk = config.getboolean("Environment Variables", "Spill To Disk", fallback=False)
+        ns.change_journal_path = config.get("Environment Variables", "Change Journal Path", fallback=None)
+        if ns.streaming_build or ns.pipeline_blocks:  # Blocks carry the RIFF, so the index must be complete first.
+            ns.fused_hashing = False
     except configparser.NoOptionError:
         print("Tapestry has attempted to reference a required option which is missing from the config file.")
         print("Please confirm the structure of your config file is correct.")
@@ -986,7 +1769,19 @@ def place_config_template(path):
             "keysize": "2048",
             "use compression": "True",
             "compression level": "2",
-            "Build-Time File Validation": "True"
+            "Build-Time File Validation": "True",
+            "Hash Cache Path": "",
+            "Crawl Threads": "8",
+            "Hash Threads": "4",
+            "Digest Algorithm": "sha256",
+            "Read Order": "none",
+            "Catalog Path": "",
+            "Fused Hashing": "False",
+            "Streaming Build": "False",
+            "Pipeline Blocks": "False",
+            "Streaming Restore": "False",
+            "Spill To Disk": "False",
+            "Change Journal Path": ""
         },
         "Network Configuration": {
             "mode": "none",
@@ -1034,41 +1829,68 @@ def sign_blocks(namespace, gpg_agent):
     """
     ns = namespace
     out = ns.drop
-    jobs = mp.JoinableQueue()
+    tasks = []
     for root, bar, files in os.walk(namespace.drop):
         debug_print(str(files)+"\n")
         for file in files:
             if file.endswith(".tap"):
                 target = os.path.join(root, file)
-                job = tapestry.TaskSign(target, ns.sigFP, out, gpg_agent)
-                jobs.put(job)
-    workers = []
-    sum_jobs = int(jobs.qsize())
-    debug_print(sum_jobs)
-    done = mp.JoinableQueue()
-    for i in range(os.cpu_count()):
-        workers.append(tapestry.ChildProcess(jobs, done, ns.workDir, ns.debug))
-    rounds_complete = 0
-    for w in workers:
-        w.start()
-    working = True
-    status_print(rounds_complete, sum_jobs, "Signing", "Working...")
-    while working:
-        message = done.get()
-        if message is None:
-            working = False
-        if not ns.debug:
-            message = "Working..."
-        rounds_complete += 1
-        if rounds_complete == sum_jobs:
-            done.put(None)  # Use none as a poison pill to kill the queue.
-        if rounds_complete <= sum_jobs:  # Patches the 200% bug.
-            status_print(rounds_complete, sum_jobs, "Signing", message)
-        done.task_done()
-    jobs.join()
-    for w in workers:
-        jobs.put(None)
-    jobs.join()
+                tasks.append(tapestry.TaskSign(target, ns.sigFP, out, gpg_agent))
+    debug_print(len(tasks))
+    failures = [result.value for result in run_tasks(ns, tasks, "Signing", fatal=True)
+                if "Failed" in result.value]
+    for failure in failures:
+        ns.logs.log(failure)
+    if failures:
+        abort_run(ns, "%s of %s blocks could not be signed." % (len(failures), len(tasks)))
+
+
+def write_run_manifest(ops_list, namespace, gpg_agent, block_sizes=None):
+    """Writes the run's manifest: a small file, encrypted and signed apart from
+    the blocks, which describes the run and names each of its blocks and their
+    sizes. Recovery and validation read it first, so they can say what a run
+    is and which blocks it needs without decrypting any block. The manifest
+    is named after the index block, as "<run>-0.manifest", with its detached
+    signature beside it.
+
+    :param ops_list: the complete ops list for the run.
+    :param namespace: the entire namespace object, once the blocks are done.
+    :param gpg_agent: a python-gnupg GPG agent object.
+    :param block_sizes: optional dict of .tap name: size in bytes, for when
+    the blocks may no longer be in the drop directory. If None, the drop
+    directory is searched for them.
+    :return: list of the absolute paths of the manifest and its signature.
+    The manifest itself is left in ns.run_manifest, for catalog_run.
+    """
+    ns = namespace
+    run = ns.compid+"-"+str(datetime.date.today())
+    if block_sizes is None:
+        block_sizes = {}
+        for file in os.listdir(ns.drop):
+            if file.endswith(".tap") and parse_block_name(file)[0] == run:
+                block_sizes.update({file: os.path.getsize(os.path.join(ns.drop, file))})
+    comment = ns.comment_string
+    if comment is None:
+        comment = "No Comment"
+    meta = {"sumBlock": ns.sum_blocks, "sizeExtraLarge": ns.sum_size,
+            "countFilesSum": sum(1 for entry in ops_list.values() if entry.get("run") is None),
+            "dateRec": str(datetime.date.today()), "comment": comment}
+    if ns.base_run is not None:
+        meta.update({"baseRun": ns.base_run, "referencedRuns": ns.referenced_runs})
+    index_block = None
+    if run+"-0.tap" in block_sizes:
+        index_block = run+"-0.tap"
+    manifest = {"run": run, "metaRun": meta, "indexBlock": index_block, "blocks": block_sizes}
+    ns.run_manifest = manifest
+
+    path = os.path.join(ns.drop, run+"-0.manifest")
+    k = gpg_agent.encrypt(json.dumps(manifest), ns.activeFP, output=path, armor=True, always_trust=True)
+    if not k.ok:
+        ns.logs.log("The run manifest could not be encrypted, status: %s" % k.status)
+        return []
+    ns.logs.log(tapestry.TaskSign(path, ns.sigFP, ns.drop, gpg_agent)())
+
+    return [path, path+".sig"]
 
 
 def start_gpg(ns):
@@ -1086,6 +1908,8 @@ def start_gpg(ns):
 def status_print(done, total, job, message):
     """Prints a basic status message. If not interrupted, prints it on one line"""
     length_bar = 15.0
+    if total == 0:  # An empty stage is trivially complete.
+        done, total = 1, 1
     done_bar = int(round((done / total) * length_bar))
     done_bar_print = str("#" * int(done_bar) + "-" * int(round((length_bar - done_bar))))
     percent = int(round((done / total) * 100))
@@ -1097,10 +1921,306 @@ def status_print(done, total, job, message):
     sys.stdout.flush()
 
 
+def stream_blocks(sizes, ops_list, namespace, gpg_agent):
+    """Produces every block with a TaskBlockStream, so that each goes from its
+    source files to a finished .tap in the drop directory without any
+    intermediate files. Blocks are streamed in parallel, except on windows,
+    where they are produced one after the other. When build-time validation
+    is enabled, the digests measured while streaming are checked against the
+    index.
+
+    :param sizes: a list object returned by build_recovery_index.
+    :param ops_list: The full ops list prepared by build_ops_list.
+    :param namespace: the entire namespace object.
+    :param gpg_agent: a python-gnupg GPG agent object.
+    :return: the number of blocks which could not be produced.
+    """
+    ns = namespace
+    if not os.path.exists(ns.workDir):
+        os.mkdir(ns.workDir)
+    collection_blocks = build_blocks(sizes, ops_list, ns)
+    riffs = build_block_riffs(collection_blocks, ops_list, ns)
+    level = None
+    if ns.compress:
+        level = ns.compressLevel
+    tasks = []
+    for block, riff in zip(collection_blocks, riffs):
+        tap = os.path.join(ns.drop, block.name+".tap")
+        tasks.append(tapestry.TaskBlockStream(tap, build_block_members(block, ns), riff,
+                                              ns.activeFP, gpg_agent, level, algorithm=ns.digest_algorithm))
+    sum_jobs = len(tasks)
+
+    if sys.platform == "win32":
+        results = (tapestry.TaskResult.of(None, task) for task in tasks)
+    else:
+        results = get_worker_pool(ns).run(tasks)
+
+    rounds_complete = 0
+    count_failed = 0
+    status_print(rounds_complete, sum_jobs, "Streaming", "Working...")
+    for result in results:
+        if result.ok:
+            block_ok, message, digests, skipped = result.value
+        else:
+            block_ok, message, digests, skipped = False, str(result), {}, {}
+        if not block_ok:
+            count_failed += 1
+            print("\n%s" % message)
+            ns.logs.log(message)
+        record_block_layout(ops_list, digests)
+        drop_skipped_files(ns, ops_list, skipped)
+        for fid, digest in digests.items():
+            if digest["changed"]:
+                ns.logs.log("%s changed while it was being packed; the stored copy may be inconsistent."
+                            % os.path.join(ns.category_paths[ops_list[fid]["category"]], ops_list[fid]["fpath"]))
+        if ns.do_validation:
+            check_block_digests(ns, {fid: digest["sha256"] for fid, digest in digests.items()}, ops_list)
+        if not ns.debug:
+            message = "Working..."
+        rounds_complete += 1
+        status_print(rounds_complete, sum_jobs, "Streaming", message)
+
+    return count_failed
+
+
+def scan_directory(path):
+    """Lists one directory for crawl_categories, as os.walk would: entries
+    which are directories (following links) are subdirectories, to be walked
+    unless they are themselves links, and everything else is a file. Each
+    file's stat_result is taken from its directory entry, and one os.access
+    call checks that it can be both read and written. A directory which
+    can't be listed is skipped, as os.walk skips it.
+
+    :param path: absolute path to the directory.
+    :return: tuple of (list of (path, os.stat_result or None, bool) tuples
+    for the files, list of paths of subdirectories to walk), in the order
+    os.scandir returned them.
+    """
+    files = []
+    subdirectories = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    if not entry.is_symlink():
+                        subdirectories.append(entry.path)
+                    continue
+                try:
+                    stats = entry.stat()
+                    accessible = os.access(entry.path, os.R_OK | os.W_OK)
+                except OSError:
+                    stats, accessible = None, False
+                files.append((entry.path, stats, accessible))
+    except OSError:
+        return [], []
+
+    return files, subdirectories
+
+
+def search_catalog(namespace):
+    """Searches the local catalog of previous runs with the filters given by
+    --path, --category, --hash and --date, and prints every copy of every
+    matching file, with the run and block it can be recovered from. No block
+    is read.
+
+    :param namespace: the namespace object, after parse_args and parse_config.
+    :return: the list of matching rows, as returned by RunCatalog.search.
+    """
+    ns = namespace
+    if not ns.catalog_path or not os.path.isfile(ns.catalog_path):
+        print("There is no catalog at %s yet; one is made at the end of each run." % ns.catalog_path)
+        return []
+    started = time.monotonic()
+    catalog = tapestry.RunCatalog(ns.catalog_path)
+    rows = catalog.search(ns.restore_paths, ns.search_hash, ns.search_date, ns.restore_categories)
+    catalog.close()
+    elapsed = time.monotonic() - started
+
+    for run, date, category, path, fsize, sha256, stored_in in rows:
+        print("%s  %s/%s  (%s bytes, sha256 %s)  in %s" % (run, category, path, fsize, str(sha256)[:16], stored_in))
+    print("%s matching copies found in %.1f ms." % (len(rows), elapsed * 1000))
+    ns.logs.log("Catalog search for paths %s, categories %s, hash %s, date %s found %s copies." %
+                (ns.restore_paths, ns.restore_categories, ns.search_hash, ns.search_date, len(rows)))
+
+    return rows
+
+
+def select_restore_files(rec_index, paths=None, categories=None):
+    """Picks out the files to restore from a recovery index. A file is
+    selected if its category is one of categories, and its path below the
+    category (or "category/path") matches one of the globs in paths or lies
+    inside a directory named by one. Either filter may be left out.
+
+    :param rec_index: a tapestry.RecoveryIndex.
+    :param paths: list of glob strings, or None.
+    :param categories: list of category labels, or None.
+    :return: a set of FIDs, or None if there are no filters.
+    """
+    if not paths and not categories:
+        return None
+    if rec_index.mode in ["json", "bin"]:
+        fids = rec_index.file_index
+    else:
+        fids = rec_index.rec_paths
+    patterns = [pattern.strip("/") for pattern in paths or []]
+    selected = set()
+    for fid in fids:
+        category, sub_path = rec_index.find(fid)
+        if categories and category not in categories:
+            continue
+        sub_path = sub_path.strip("~/")
+        if patterns:
+            matched = False
+            for candidate in [sub_path, "%s/%s" % (category, sub_path)]:
+                for pattern in patterns:
+                    if fnmatch.fnmatchcase(candidate, pattern) or candidate.startswith(pattern+"/"):
+                        matched = True
+            if not matched:
+                continue
+        selected.add(fid)
+
+    return selected
+
+
+def select_restore_blocks(rec_index, recovered_run, paths, categories, logs):
+    """Works out which blocks hold the files selected by the restore filters,
+    so that only those need to be fetched, verified and decrypted. If the
+    index can't say where every selected file is, such as a Recovery Pickle,
+    an older RIFF, or a run whose index block is missing, every block is
+    needed and None is returned.
+
+    :param rec_index: the tapestry.RecoveryIndex of the run being recovered.
+    :param recovered_run: the label (compid-date) of that run.
+    :param paths: list of glob strings, or None.
+    :param categories: list of category labels, or None.
+    :param logs: ns.logs, the SimpleLogger object.
+    :return: a set of (run label, block number) tuples, or None.
+    """
+    selected = select_restore_files(rec_index, paths, categories)
+    if selected is None:
+        return None
+    if rec_index.partial:
+        print("Without the index block, every block must be retrieved to find the selected files.")
+        logs.log("Restore filters could not narrow the blocks to retrieve, as the index block is missing.")
+        return None
+    wanted = set()
+    for fid in selected:
+        run, number, offset, length = rec_index.locate(fid)
+        if number is None:
+            print("This index does not record which block holds each file, so every block will be retrieved.")
+            logs.log("Restore filters could not narrow the blocks to retrieve, as the index has no block numbers.")
+            return None
+        wanted.add((run or recovered_run, number))
+    if not selected:
+        print("No files in this run match the restore filters.")
+    logs.log("Restore filters selected %s files, held in %s blocks." % (len(selected), len(wanted)))
+
+    return wanted
+
+
+def plan_block_extraction(namespace, found_blocks, selected=None):
+    """Works out which files to restore from each decrypted block using only
+    the block numbers recorded in the recovered index, so that no block has
+    to be opened to find out what it holds. Blocks of a run whose index does
+    not map every file to its block, such as runs made before the mapping
+    was recorded, are left out of the plan.
+
+    :param namespace: The system namespace object.
+    :param found_blocks: list of absolute paths to blocks, either decrypted
+    or still encrypted.
+    :param selected: optional set of FIDs; if given, only those are planned.
+    :return: dict of block path: list of (fid, category_dir, sub_path)
+    tuples in tarball order.
+    """
+    ns = namespace
+    plan = {}
+    if ns.rec_index.mode not in ["json", "bin"]:
+        return plan
+    found = {}
+    for block in found_blocks:
+        found.update({parse_block_name(block): block})
+    own_runs = set([run for run, number in found if run not in ns.rec_index.referenced_runs])
+    if len(own_runs) != 1:  # Can't tell which blocks belong to the index's own run.
+        return plan
+    own_run = own_runs.pop()
+
+    located = []
+    unmapped_runs = set()
+    for fid in ns.rec_index.file_index:
+        if selected is not None and fid not in selected:
+            continue
+        run, number, offset, length = ns.rec_index.locate(fid)
+        run = run or own_run
+        if number is None:
+            unmapped_runs.add(run)
+        else:
+            located.append((run, number, offset, fid))
+    for run, number in found:
+        if run not in unmapped_runs:
+            plan.update({found[(run, number)]: []})
+
+    for run, number, offset, fid in sorted(located, key=lambda item: (item[0], item[1], item[2] or 0)):
+        block = found.get((run, number))
+        if block not in plan:
+            continue
+        category_label, sub_path = ns.rec_index.find(fid)
+        try:
+            category_dir = ns.category_paths[category_label]
+        except KeyError:
+            category_dir = os.path.join(ns.drop, str(category_label))
+        plan[block].append((fid, category_dir, sub_path))
+
+    return plan
+
+
+def stream_restore_blocks(namespace, verified_blocks, gpg_agent):
+    """Restores every verified block with a TaskBlockRestore, which pipes
+    gpg's output through the decompressor and into the tar extractor, so no
+    decrypted or decompressed copy of any block is written. This needs the
+    index to say what each block holds; if it can't, nothing is done and
+    False is returned so that the blocks can be restored the usual way.
+
+    :param namespace: The system namespace object.
+    :param verified_blocks: list of absolute paths to the verified blocks.
+    :param gpg_agent: a python-gnupg GPG agent object.
+    :return: True if the blocks were restored, False otherwise.
+    """
+    ns = namespace
+    plan = {}
+    if not ns.rec_index.partial:
+        selected = select_restore_files(ns.rec_index, ns.restore_paths, ns.restore_categories)
+        plan = plan_block_extraction(ns, verified_blocks, selected)
+    if not plan or set(plan) != set(verified_blocks):
+        ns.logs.log("The index can't say what every block holds, so blocks are being decrypted before restoring.")
+        return False
+
+    tasks = []
+    for block, entries in plan.items():
+        if entries:
+            tasks.append(tapestry.TaskBlockRestore(block, entries, gpg_agent))
+    for result in run_tasks(ns, tasks, "Restoring"):
+        if result.ok:
+            block_ok, message, failures = result.value
+            if not block_ok:
+                ns.logs.log(message)
+            for fid, error in failures.items():
+                ns.logs.log("Could not restore %s: %s" % (fid, error))
+
+    return True
+
+
 def unpack_blocks(namespace):
     """Provided a namespace object, this function will crawl the defined
     working directory, looking for decrypted tap files to unpack into their
-    destinations according to the recovered index.
+    destinations according to the recovered index. What each block holds is
+    planned from the index where it records each file's block, and only
+    blocks it doesn't cover are listed. Each block is then read once, start
+    to finish, by its own TaskTarExtractBlock, so blocks are restored in
+    parallel rather than files.
 
     :param namespace: The system namespace object.
     :return:
@@ -1111,59 +2231,48 @@ def unpack_blocks(namespace):
     for foo, bar, files in os.walk(ns.workDir):
         for file in files:
             if file.endswith(".decrypted"):
-                found_decrypted.append(file)
+                found_decrypted.append(os.path.join(foo, file))
+
+    if ns.rec_index.partial:  # No index block, so each block's own RIFF has to fill in the index.
+        for block in found_decrypted:
+            with tarfile.open(block, "r:*") as tap:
+                if "recovery-riff" in tap.getnames():
+                    ns.rec_index.merge(tapestry.RecoveryIndex(tap.extractfile("recovery-riff")))
 
-    files_to_unpack = {}  # Now we need to iterate over each of those blocks for files
+    selected = select_restore_files(ns.rec_index, ns.restore_paths, ns.restore_categories)
+    files_to_unpack = plan_block_extraction(ns, found_decrypted, selected)
     for block in found_decrypted:
+        if block in files_to_unpack:
+            continue
+        entries = []  # The index doesn't say what this block holds, so it has to be listed.
         with tarfile.open(block, "r:*") as tap:
             members = tap.getnames()
-            for file in members:
-                # debug_print("UB: Trying to unblock %s" % str({file: block}))
-                files_to_unpack.update({file: block})
-
-    tasks = mp.JoinableQueue()  # Let's populate the queue
-    for file in files_to_unpack:
-        skip = False
-        category_label, sub_path = ns.rec_index.find(file)
-        if category_label == b"404":
-            skip = True
-        elif category_label == "skip":
-            skip = True
-        try:
-            category_dir = ns.category_paths[category_label]
-        except KeyError:
-            category_dir = os.path.join(ns.drop, str(category_label))
-            # Because cat_label sometimes comes back as b"404", we need to smash it back to strings.
-        if not skip:
-            tap_absolute = os.path.join(ns.workDir, files_to_unpack[file])
-            tasks.put(tapestry.TaskTarUnpack(tap_absolute, file, category_dir, sub_path))
-    sum_jobs = tasks.qsize()
-
-    workers = []
-    done = mp.JoinableQueue()
-    for i in range(os.cpu_count()):
-        workers.append(tapestry.ChildProcess(tasks, done, ns.workDir, ns.debug))
-    rounds_complete = 0
-    status_print(rounds_complete, sum_jobs, "Unpacking", "Working...")
-    for w in workers:
-        w.start()
-    working = True
-    while working:
-        message = done.get()
-        if message is None:
-            working = False
-        else:
-            if not ns.debug:
-                message = "Working..."
-            rounds_complete += 1
-            status_print(rounds_complete, sum_jobs, "Unpacking", message)
-            if rounds_complete >= sum_jobs:
-                done.put(None)  # Use none as a poison pill to kill the queue.
-            done.task_done()
-    tasks.join()
-    for w in workers:
-        tasks.put(None)
-    tasks.join()
+        for file in members:
+            skip = False
+            category_label, sub_path = ns.rec_index.find(file)
+            if category_label == b"404":
+                skip = True
+            elif category_label == "skip":
+                skip = True
+            elif selected is not None and file not in selected:
+                skip = True
+            try:
+                category_dir = ns.category_paths[category_label]
+            except KeyError:
+                category_dir = os.path.join(ns.drop, str(category_label))
+                # Because cat_label sometimes comes back as b"404", we need to smash it back to strings.
+            if not skip:
+                entries.append((file, category_dir, sub_path))
+        files_to_unpack.update({block: entries})
+
+    tasks = []
+    for block, entries in files_to_unpack.items():
+        if entries:
+            tasks.append(tapestry.TaskTarExtractBlock(block, entries))
+    for result in run_tasks(ns, tasks, "Unpacking"):
+        if result.ok:
+            for fid, error in result.value[2].items():
+                ns.logs.log("Could not restore %s: %s" % (fid, error))
 
 
 def update_secrets():
@@ -1234,6 +2343,58 @@ def verify_keys(ns, gpg):
     debug_print(ns.activeFP)
 
 
+def run_tasks(namespace, tasks, job, fatal=False):
+    """Runs a list of tasks on the shared worker pool, showing a status bar
+    as they finish. Tasks which raised are logged, and counted on screen once
+    every task has finished. If fatal is set, any such task stops the run
+    (see abort_run); otherwise what that means is left to the caller.
+
+    :param namespace: the entire namespace object.
+    :param tasks: a list of task objects.
+    :param job: a string, such as "Encrypting", to show beside the status bar.
+    :param fatal: True if every task must succeed for the run to go on.
+    :return: a list of TaskResult objects, in the order the tasks finished.
+    """
+    ns = namespace
+    results = []
+    sum_jobs = len(tasks)
+    status_print(0, sum_jobs, job, "Working...")
+    for result in get_worker_pool(ns).run(tasks):
+        if not result.ok:
+            ns.logs.log("%s raised an exception:\n%s" % (result.task_name, result.error))
+        results.append(result)
+        message = "Working..."
+        if ns.debug:
+            message = str(result)
+        status_print(len(results), sum_jobs, job, message)
+    count_failed = len([result for result in results if not result.ok])
+    if count_failed:
+        message = "%s of %s tasks failed while %s." % (count_failed, sum_jobs, job.lower())
+        if fatal:
+            abort_run(ns, message)
+        print("\n%s See the log for details." % message)
+
+    return results
+
+
+def abort_run(namespace, message):
+    """Stops a build when one of its blocks could not be finished, rather
+    than go on to sign, record and deliver a backup which silently leaves
+    out the files that block held. Exits with code 7.
+
+    :param namespace: the entire namespace object.
+    :param message: what went wrong, for the screen and the log.
+    :return:
+    """
+    ns = namespace
+    print("\n%s" % message)
+    print("Tapestry could not finish every block of this run, so it has stopped. See the log for details.")
+    ns.logs.log("FATAL ERROR: %s The run has been stopped." % message)
+    ns.logs.save()
+    clean_up(ns.workDir)
+    exit(7)
+
+
 def runtime():
     global state
     keyring.get_keyring()
@@ -1243,7 +2404,13 @@ def runtime():
         update_secrets()
         exit(0)
     state = parse_config(state)
+    if state.watch:  # Before logging starts, which would replace the log of any run made today.
+        watch_categories(state)
+        exit(0)
     state = start_logging(state)
+    if state.search:
+        search_catalog(state)
+        exit(0)
     gpg_conn = start_gpg(state)
     announce()
     if state.modeNetwork.lower() != "none":
@@ -1251,18 +2418,67 @@ def runtime():
                 and state.network_credential_value is None:
             print("Tapestry is running in network storage mode and requires some credentialing information.")
             state.network_credential_pass = getpass.getpass(prompt="Enter Network Credential Passphrase: ")
-    if state.demand_validate:
-        demand_validate(state, gpg_conn)
-        exit(0)  # We have nothing else to do, so exit.
-    if state.genKey:
-        state = generate_keys(state, gpg_conn)
-    verify_keys(state, gpg_conn)
-    if state.rcv:
-        do_recovery(state, gpg_conn)
-    else:
-        do_main(state, gpg_conn)
-    clean_up(state.workDir)
-    exit(0)
+    get_worker_pool(state)  # One set of workers serves every stage of the run.
+    try:
+        if state.demand_validate:
+            demand_validate(state, gpg_conn)
+            exit(0)  # We have nothing else to do, so exit.
+        if state.genKey:
+            state = generate_keys(state, gpg_conn)
+        verify_keys(state, gpg_conn)
+        if state.rcv:
+            do_recovery(state, gpg_conn)
+        else:
+            do_main(state, gpg_conn)
+        clean_up(state.workDir)
+        exit(0)
+    finally:
+        state.pool.shutdown()
+
+
+def watch_categories(namespace):
+    """Runs the watcher for tapestry --watch, which keeps the change journal
+    up to date for every category, default and inclusive, until it is
+    interrupted or terminated. Its messages are printed with the time, rather
+    than logged, since it runs for far longer than any one day's log.
+
+    :param namespace: the namespace object, after parse_config.
+    :return:
+    """
+    ns = namespace
+    if not ns.change_journal_path:
+        print("Set a Change Journal Path in the config file to use --watch.")
+        exit(3)
+    categories = {}
+    for category in ns.categories_default + ns.categories_inclusive:
+        categories.update({category: ns.category_paths[category]})
+    journal = tapestry.ChangeJournal(ns.change_journal_path)
+    try:
+        watcher = tapestry.ChangeWatcher(journal, categories)
+    except OSError as e:
+        print("The change journal can't be kept on this system: %s" % e)
+        exit(3)
+
+    def stop(signal_number, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        count_watched = watcher.start()
+        print("%s Watching %s directories in %s categories. The next run will crawl everything; later runs "
+              "need only visit what changed." % (time.strftime("%Y-%m-%d %H:%M:%S"), count_watched, len(categories)))
+        while True:
+            for notice in watcher.notices:
+                print("%s %s" % (time.strftime("%Y-%m-%d %H:%M:%S"), notice))
+            watcher.notices = []
+            watcher.process(journal.heartbeat_interval)
+    except KeyboardInterrupt:
+        print("%s The watcher has stopped, so the next run will crawl everything."
+              % time.strftime("%Y-%m-%d %H:%M:%S"))
+    finally:
+        journal.stop()
+        journal.close()
+        watcher.close()
 
 
 def start_logging(ns):
@@ -1351,7 +2567,7 @@ def sftp_deposit_files(namespace):
     :return:
     """
     ns = namespace  # For Brevity
-    allowed_files = ["tap", "sig", "riff"]  # We don't need to or want to send just anything.
+    allowed_files = ["tap", "sig", "riff", "manifest"]  # We don't need to or want to send just anything.
 
     conn, error = sftp_connect(ns)
 
@@ -1365,20 +2581,43 @@ def sftp_deposit_files(namespace):
         exit(5)
 
     for cwd, dirs, files in os.walk(ns.drop):
+        sending = []
         for file in files:
-            fname, suffix = file.split(".")
+            suffix = file.rsplit(".", 1)[-1]
             if suffix in allowed_files:
-                sending = os.path.join(cwd, file)
-                error = sftp_place(conn, sending, ns.dirNet)
-                if error:
-                    print(error)
-                    ns.logs.log("SFTP Error: %s during delivery of %s" % (error, file))
-                    if not ns.retainLocal:
-                        print("Switching to local retention for this and future files.")
-                        ns.logs.log("Because of the above-stated error, backup files will be retained locally.")
-                        ns.retainLocal = True
-                if not ns.retainLocal:
-                    os.remove(sending)
+                sending.append(os.path.join(cwd, file))
+        sftp_deposit_block(ns, conn, sending)
+
+
+def sftp_deposit_block(namespace, connection, paths):
+    """Places the argued files on the SFTP share, then removes the local
+    copies unless local retention is configured. The RIFF of each run's index
+    block is always kept, since find_previous_index needs it to make the next
+    incremental run. Any error in placing a file is logged and switches this
+    and all later files to local retention.
+
+    :param namespace: the tapestry namespace object.
+    :param connection: a connection object as returned by sftp_connect.
+    :param paths: list of absolute paths of the files to send.
+    :return: the last error encountered, or None.
+    """
+    ns = namespace
+    last_error = None
+    for sending in paths:
+        placed, error = sftp_place(connection, sending, ns.dirNet)
+        if error:
+            last_error = error
+            print(error)
+            ns.logs.log("SFTP Error: %s during delivery of %s" % (error, os.path.basename(sending)))
+            if not ns.retainLocal:
+                print("Switching to local retention for this and future files.")
+                ns.logs.log("Because of the above-stated error, backup files will be retained locally.")
+                ns.retainLocal = True
+        is_index = sending.endswith(".riff") and parse_block_name(sending)[1] == 0
+        if not ns.retainLocal and not is_index:
+            os.remove(sending)
+
+    return last_error
 
 
 def sftp_fetch(connection, remote_path, tgt, work_path):
@@ -1418,7 +2657,7 @@ def sftp_find(sftp, storagedir):
     # Paramiko and pysftp return unicode strings; we want to bash to local.
     list_returned = []
     for each in list_remote_files:
-        if each.endswith(".tap") or each.endswith(".sig"):  # We are interested in only these extensions.
+        if each.endswith(".tap") or each.endswith(".sig") or each.endswith(".manifest"):  # Only these extensions.
             list_returned.append(str(each))
 
     return list_returned
@@ -1459,9 +2698,32 @@ def sftp_retrieve_files(namespace, gpg_agent):
     list_target_files = sftp_select_retrieval_target(list_all_files)  # Get the files the user actually wants
 
     list_found_files = []
+    if not os.path.exists(ns.workDir):
+        os.mkdir(ns.workDir)
 
+    # The manifest comes first, if the run left one, to describe the run and name its blocks.
     is_error_notfound = False
-    for file in list_target_files:  # physically retrieve those files.
+    manifest = None
+    for file in sorted(list_target_files):
+        if file.endswith(".manifest") and file+".sig" in list_all_files:
+            if sftp_fetch(conn, ns.dirNet, file, ns.workDir) is None and \
+                    sftp_fetch(conn, ns.dirNet, file+".sig", ns.workDir) is None:
+                list_found_files += [os.path.join(ns.workDir, file), os.path.join(ns.workDir, file+".sig")]
+                manifest = load_run_manifest(os.path.join(ns.workDir, file), gpg, ns.logs)
+            break
+    if manifest is None:
+        ns.logs.log("No usable manifest was found; the first block will describe the run.")
+    else:
+        print(summarise_run_manifest(manifest))
+        ns.logs.log(summarise_run_manifest(manifest))
+        listed = set(manifest["blocks"])
+        list_target_files = [file for file in list_target_files if file.split(".")[0]+".tap" in listed]
+
+    # The index comes next, from the index block (block 0) if there is one, so that it can select the rest.
+    first_block = sorted([file for file in list_target_files if file.endswith(".tap")])[0]
+    if manifest is not None and manifest["indexBlock"] in list_target_files:
+        first_block = manifest["indexBlock"]
+    for file in [first_block, first_block+".sig"]:
         error = sftp_fetch(conn, ns.dirNet, file, ns.workDir)
         if error is not None:
             is_error_notfound = True
@@ -1469,15 +2731,8 @@ def sftp_retrieve_files(namespace, gpg_agent):
             ns.logs.log("%s - skipping" % error)
         else:
             list_found_files.append(os.path.join(ns.workDir, file))
-
-    if is_error_notfound:
-        print("One or more files were not able to be retrieved from the remote store.")
-        print("If you wish do not wish to continue with only a partial restore, press ctrl+c now.")
-        ns.logs.log("For the reasons above, this is a partial restore only.")
-        foo = input("Press enter to continue.")
-
-    # Now we need to obtain a recovery file of some kind.
-    decrypted_first = tapestry.TaskDecrypt(os.path.join(ns.workDir, list_found_files[0]), ns.workDir, gpg_agent)
+    first_block = os.path.join(ns.workDir, first_block)
+    decrypted_first = tapestry.TaskDecrypt(first_block, ns.workDir, gpg_agent)
     decrypted_first = decrypted_first()
     debug_print("SRF: decrypted_first is: %s" % decrypted_first)
     debug_print("SRF: The conditional is therefore: %s" % decrypted_first.split(" ")[1].lower())
@@ -1487,12 +2742,8 @@ def sftp_retrieve_files(namespace, gpg_agent):
         tapfile_contents = tar.getnames()
         debug_print("The provided block contains: %s" % str(tapfile_contents))
 
-        if "recovery-pkl" in tapfile_contents:
-            index_file = tar.extractfile("recovery-pkl")
-        elif "recovery-riff" in tapfile_contents:
-            index_file = tar.extractfile("recovery-riff")
-        else:
-            index_file = open("/dev/null", "rb")  # Just for giggles
+        index_file = open_recovery_index(tar, ns.workDir)
+        if index_file is None:
             print("Something has gone wrong!")
             print("One or more blocks are corrupt and missing their recovery index.")
             print("This is a fatal error.")
@@ -1510,7 +2761,45 @@ def sftp_retrieve_files(namespace, gpg_agent):
 
     # If we made it this far, we have a recovery file, so let's return a recovery index
     rec_index = tapestry.RecoveryIndex(index_file)
-    if len(list_found_files) != rec_index.blocks:
+    if rec_index.partial:
+        print("The index block for this run was not found, so the index will be rebuilt from the blocks.")
+        ns.logs.log("No index block was retrieved; the index is being rebuilt from the block RIFFs.")
+    recovered_run = parse_block_name(first_block)[0]
+    wanted = select_restore_blocks(rec_index, recovered_run, ns.restore_paths, ns.restore_categories, ns.logs)
+    expected_blocks = rec_index.blocks
+    if wanted is not None:
+        expected_blocks = len([block for block in wanted if block[0] == recovered_run])
+
+    for file in list_target_files:  # physically retrieve those files.
+        if os.path.join(ns.workDir, file) in list_found_files:
+            continue
+        if wanted is not None and parse_block_name(file) not in wanted:
+            continue
+        error = sftp_fetch(conn, ns.dirNet, file, ns.workDir)
+        if error is not None:
+            is_error_notfound = True
+            print("%s - skipping" % error)
+            ns.logs.log("%s - skipping" % error)
+        else:
+            list_found_files.append(os.path.join(ns.workDir, file))
+
+    if is_error_notfound:
+        print("One or more files were not able to be retrieved from the remote store.")
+        print("If you wish do not wish to continue with only a partial restore, press ctrl+c now.")
+        ns.logs.log("For the reasons above, this is a partial restore only.")
+        foo = input("Press enter to continue.")
+
+    for file in list_all_files:  # Unchanged files of an incremental run live in the blocks of earlier runs.
+        run_label, block_number = parse_block_name(file)
+        if wanted is not None and (run_label, block_number) not in wanted:
+            continue
+        if file not in list_target_files and run_label in rec_index.referenced_runs and block_number != 0:
+            error = sftp_fetch(conn, ns.dirNet, file, ns.workDir)
+            if error is not None:
+                print("%s - skipping" % error)
+                ns.logs.log("%s - skipping" % error)
+    if len([file for file in list_found_files
+            if file.endswith(".tap") and parse_block_name(file)[1] != 0]) != expected_blocks:
         print("There is a a mismatch in the number of recovered blocks and the amount of blocks listed in the"
               " recovery index. Would you like to continue?")
         input("Press enter to continue or ctrl+c to cancel.")
@@ -1536,6 +2825,8 @@ def sftp_select_retrieval_target(list_available):
     # Then we need a list of available machines
     dict_availability = {}
     for file in list_working:
+        if not file.endswith(".tap"):  # Manifests are listed too, but aren't blocks.
+            continue
         name_machine, year, month, day, blocknumber = file.split("-")
         date = ("%s-%s-%s" % (year, month, day))
         if name_machine not in dict_availability.keys():
@@ -1572,53 +2863,329 @@ def sftp_select_retrieval_target(list_available):
     return list_to_fetch
 
 
-def prevalidate_blocks(namespace, list_blocks, index):
-    if namespace.do_validation:
-        ns = namespace
-        ns.logs.log("Lines beneath this point are failed hash validation checks.")
-        jobs = mp.JoinableQueue()
-        for file in list_blocks:
-            with tarfile.open(file, mode="r:*") as tf:
-                list_members = tf.getnames()
-                for member in list_members:
-                    if member != "recovery-riff":  # Obviously we can't validate this noise.
-                        task = tapestry.TaskCheckIntegrity(file, member, index[member]['sha256'])
-                        jobs.put(task)
-        workers = []
-        sum_jobs = int(jobs.qsize())
-        debug_print(sum_jobs)
-        done = mp.JoinableQueue()
-        for i in range(os.cpu_count()):
-            workers.append(tapestry.ChildProcess(jobs, done, ns.workDir, ns.debug))
-        rounds_complete = 0
-        for w in workers:
-            w.start()
-        working = True
-        status_print(rounds_complete, sum_jobs, "Checking Block Integrity", "Working...")
-        # We removed the "... Working" message issue because this task returns useful messages.
-        # This might get replaced when/if we include runtime logging again.
-        while working:
-            message = done.get()
-            if message is None:
-                working = False
-            else:
-                if message[0]:  # We only need to output the actual output if the job fails.
-                    message[1] = "Working"
+def pipeline_blocks(sizes, ops_list, namespace, gpg_agent):
+    """Produces, signs and (in sftp mode) deposits every block, moving each
+    block on to its next stage as soon as it finishes the current one instead
+    of waiting for every block at each stage. Worker slots are always given
+    to the furthest-along block first, so finished blocks drain out (and are
+    uploaded) while later blocks are still being packed. The run's index
+    block enters the pipeline at its own "index" stage once every other block
+    has been packed, so that it can record where each file was placed, and
+    then follows the other blocks through signing and deposit. The run
+    manifest is written and deposited once every block is done. The number of blocks
+    waiting in or working on each stage is shown as the job runs, and the
+    peak depth and total work time of each stage is logged at the end.
+
+    :param sizes: a list object returned by build_recovery_index.
+    :param ops_list: The full ops list prepared by build_ops_list.
+    :param namespace: the entire namespace object.
+    :param gpg_agent: a python-gnupg GPG agent object.
+    :return: an error string if the SFTP connection could not be made, else None.
+    """
+    ns = namespace
+    if not os.path.exists(ns.workDir):
+        os.mkdir(ns.workDir)
+    collection_blocks = build_blocks(sizes, ops_list, ns)
+    riffs = dict(zip([block.name for block in collection_blocks],
+                     build_block_riffs(collection_blocks, ops_list, ns)))
+    blocks = {block.name: block for block in collection_blocks}
+    paths = {}
+    level = None
+    if ns.compress:
+        level = ns.compressLevel
+
+    if ns.streaming_build:
+        stages = ["stream"]
+    else:
+        stages = ["pack"]
+        if ns.compress:
+            stages.append("compress")
+        if ns.do_validation:
+            stages.append("validate")
+        stages.append("encrypt")
+    stages += ["index", "sign"]
+    if ns.modeNetwork.lower() == "sftp":
+        stages.append("deposit")
+    index_name = ns.compid+"-"+str(datetime.date.today())+"-0"
+    routes = {name: [stage for stage in stages if stage != "index"] for name in blocks}
+    routes.update({index_name: stages[stages.index("index"):]})
+
+    def make_task(stage, name):
+        tap = os.path.join(ns.drop, name+".tap")
+        if stage == "pack":
+            paths[name] = os.path.join(ns.workDir, name+".tar")
+            task = tapestry.TaskBlockBuild(paths[name], build_block_members(blocks[name], ns), riffs[name])
+        elif stage == "compress":
+            task = tapestry.TaskCompress(paths[name], level)
+            paths[name] += ".bz2"
+        elif stage == "validate":
+            task = tapestry.TaskVerifyBlock(paths[name], algorithm=ns.digest_algorithm)
+        elif stage == "encrypt":
+            task = tapestry.TaskEncrypt(paths[name], ns.activeFP, ns.drop, gpg_agent)
+        elif stage == "stream":
+            task = tapestry.TaskBlockStream(tap, build_block_members(blocks[name], ns), riffs[name],
+                                            ns.activeFP, gpg_agent, level, algorithm=ns.digest_algorithm)
+        elif stage == "index":
+            task = build_index_task(ops_list, ns, gpg_agent)
+        else:  # sign
+            task = tapestry.TaskSign(tap, ns.sigFP, ns.drop, gpg_agent)
+        return tapestry.TaskStage(stage, name, task)
+
+    pool = get_worker_pool(ns)
+    submitted = {}
+
+    # SFTP connections can't be shared with the workers, so deposits are made from a thread here.
+    deposits = queue.Queue()
+    deposited = queue.Queue()
+    deposit_errors = []
+
+    def depositor():
+        """Deposits each block named on the deposits queue, and always answers
+        on the deposited queue, with the error if the deposit raised, so
+        that the pipeline is never left waiting on a deposit which died."""
+        conn = None
+        try:
+            conn, error = sftp_connect(ns)
+        except Exception as e:
+            error = "Could not connect to the remote SFTP host: %s" % e
+        if error:
+            deposit_errors.append(error)
+        name = deposits.get()
+        while name is not None:
+            started = time.monotonic()
+            result, error = None, None
+            try:
+                if conn is None:
+                    result = "Retained locally"
+                elif isinstance(name, list):  # The manifest, sent once every block is done.
+                    sftp_deposit_block(ns, conn, name)
                 else:
-                    ns.logs.log(message[1])
+                    sending = [os.path.join(ns.drop, name+".tap"), os.path.join(ns.drop, name+".tap.sig"),
+                               os.path.join(ns.drop, name+".riff")]
+                    result = sftp_deposit_block(ns, conn, sending)
+            except Exception as e:
+                error = "%s: %s" % (type(e).__name__, e)
+            if isinstance(name, list):
+                if error:
+                    deposit_errors.append("The run manifest could not be deposited: %s" % error)
+            else:
+                deposited.put(["deposit", name, result, time.monotonic() - started, error])
+            name = deposits.get()
+
+    if "deposit" in stages:
+        deposit_thread = threading.Thread(target=depositor)
+        deposit_thread.start()
+
+    pending = {stage: deque() for stage in stages}
+    in_flight = {stage: 0 for stage in stages}
+    peak_depth = {stage: 0 for stage in stages}
+    work_time = {stage: 0.0 for stage in stages}
+    for name in blocks:
+        pending[routes[name][0]].append(name)
+    unpacked = set(blocks)  # The index block waits for these, so that it has every file's offset.
+    block_sizes = {}  # Taken as each block is signed, since deposited blocks may not be kept locally.
+
+    def busy():
+        return sum([in_flight[stage] for stage in stages if stage != "deposit"])
+
+    def dispatch():
+        while busy() < pool.size:
+            for stage in reversed(stages):
+                if stage != "deposit" and pending[stage]:
+                    name = pending[stage].popleft()
+                    submitted[pool.submit(make_task(stage, name))] = (stage, name)
+                    in_flight[stage] += 1
+                    break
+            else:
+                break
+        if "deposit" in stages:
+            while pending["deposit"]:
+                deposits.put(pending["deposit"].popleft())
+                in_flight["deposit"] += 1
+
+    def collect():
+        """Waits for the next worker result, or for a deposit if no worker is
+        busy, then picks up any other deposits that have finished meanwhile.
+        A deposit which raised stops the run."""
+        finished = []
+        if busy() > 0:
+            outcome = pool.get()
+            stage, name = submitted.pop(outcome.task_id)
+            if outcome.ok:
+                finished.append(outcome.value + [None])
+            else:
+                finished.append([stage, name, None, outcome.elapsed, str(outcome)])
+        else:
+            finished.append(deposited.get())
+        while not deposited.empty():
+            finished.append(deposited.get())
+        for stage, name, result, elapsed, error in finished:
+            if stage == "deposit" and error:
+                deposits.put(None)
+                deposit_thread.join()
+                abort_run(ns, "Block %s could not be deposited: %s" % (name, error))
+        return finished
+
+    def depths():
+        for stage in stages:
+            peak_depth[stage] = max(peak_depth[stage], len(pending[stage]) + in_flight[stage])
+        return " | ".join(["%s %s" % (stage, len(pending[stage]) + in_flight[stage]) for stage in stages])
+
+    sum_steps = sum([len(route) for route in routes.values()])
+    failed_blocks = []
+    rounds_complete = 0
+    blocks_remaining = len(routes)
+    dispatch()
+    status_print(rounds_complete, sum_steps, "Pipeline", depths())
+    while blocks_remaining > 0:
+        for stage, name, result, elapsed, error in collect():
+            in_flight[stage] -= 1
+            work_time[stage] += elapsed
             rounds_complete += 1
-            if rounds_complete == sum_jobs:
-                done.put(None)  # Use none as a poison pill to kill the queue.
-            if rounds_complete <= sum_jobs:  # Patches the 200% bug.
-                status_print(rounds_complete, sum_jobs, "Checking Block Integrity", message[1])
-            done.task_done()
-        jobs.join()
-        for w in workers:  # Make extra certain all the children are dead.
-            jobs.put(None)
-        jobs.join()  # TODO replace lines below with better logic during the improved logging process.
-        print("Please review the above lines for any failed files, and capture that information for your records.")
-        print("Failures were also logged to %s" % ns.drop)
-        ns.logs.log("Review lines above this mark for failed validation checks.")
+            failed = False
+            if error:
+                failed = True
+                ns.logs.log("Block %s failed at the %s stage: %s" % (name, stage, error))
+            elif stage == "pack":
+                record_block_layout(ops_list, result[1])
+                drop_skipped_files(ns, ops_list, result[2])
+            elif stage in ["validate", "stream", "index"]:
+                block_ok, message, digests = result[:3]
+                if stage in ["stream", "index"]:
+                    record_block_layout(ops_list, digests)
+                    drop_skipped_files(ns, ops_list, result[3])
+                    digests = {fid: digest["sha256"] for fid, digest in digests.items()}
+                    failed = not block_ok
+                if not block_ok:
+                    ns.logs.log(message)
+                if ns.do_validation:
+                    check_block_digests(ns, digests, ops_list)
+            elif stage in ["encrypt", "sign"]:
+                failed = "Failed" in result
+                if failed:
+                    ns.logs.log(result)
+                elif stage == "sign":
+                    block_sizes.update({name+".tap": os.path.getsize(os.path.join(ns.drop, name+".tap"))})
+                elif stage == "encrypt":  # The intermediate files are no longer needed.
+                    os.remove(os.path.join(ns.workDir, name+".tar"))
+                    if paths[name] != os.path.join(ns.workDir, name+".tar"):
+                        os.remove(paths[name])
+            if stage == stages[0]:
+                unpacked.discard(name)
+                if not unpacked:
+                    pending["index"].append(index_name)
+            route = routes[name]
+            if failed:
+                failed_blocks.append(name)
+            if failed or stage == route[-1]:
+                rounds_complete += len(route) - route.index(stage) - 1
+                blocks_remaining -= 1
+            else:
+                pending[route[route.index(stage) + 1]].append(name)
+        dispatch()
+        status_print(rounds_complete, sum_steps, "Pipeline", depths())
+
+    if failed_blocks:
+        if "deposit" in stages:
+            deposits.put(None)
+            deposit_thread.join()
+        abort_run(ns, "%s of %s blocks could not be finished: %s." % (len(failed_blocks), len(routes),
+                                                                      ", ".join(sorted(failed_blocks))))
+    manifest = write_run_manifest(ops_list, ns, gpg_agent, block_sizes)
+    if "deposit" in stages:
+        if manifest:
+            deposits.put(manifest)
+        deposits.put(None)
+        deposit_thread.join()
+    print("")
+    for stage in stages:
+        ns.logs.log("Pipeline stage %s: peak depth of %s blocks, %.1f seconds of work." %
+                    (stage, peak_depth[stage], work_time[stage]))
+    if deposit_errors:
+        return deposit_errors[0]
+
+    return None
+
+
+def prevalidate_blocks(namespace, list_blocks, index, algorithm="sha256"):
+    """Checks every file in the argued blocks against its hash in the index.
+    Each block is read exactly once, start to finish, by a TaskVerifyBlock,
+    and several blocks are checked at once. The digests each task returns are
+    compared to the index here, and any failures are logged.
+
+    :param namespace: the entire namespace object.
+    :param list_blocks: list of absolute paths to block tarfiles, compressed
+    or otherwise.
+    :param index: dict of FID: file entry, such as the ops list or the
+    file_index of a RecoveryIndex.
+    :param algorithm: the digest algorithm of the index, which the blocks'
+    members are hashed with for comparison.
+    :return: the number of failed checks.
+    """
+    ns = namespace
+    ns.logs.log("Lines beneath this point are failed hash validation checks.")
+    tasks = []
+    for file in list_blocks:
+        tasks.append(tapestry.TaskVerifyBlock(file, algorithm=algorithm))
+    sum_jobs = len(tasks)
+    rounds_complete = 0
+    count_failed = 0
+    status_print(rounds_complete, sum_jobs, "Checking Block Integrity", "Working...")
+    for result in get_worker_pool(ns).run(tasks):
+        if result.ok:
+            block_ok, message, digests = result.value
+        else:
+            block_ok, message, digests = False, str(result), {}
+        if not block_ok:
+            count_failed += 1
+            ns.logs.log(message)
+        count_failed += check_block_digests(ns, digests, index)
+        if not ns.debug:
+            message = "Working..."
+        rounds_complete += 1
+        status_print(rounds_complete, sum_jobs, "Checking Block Integrity", message)
+    if count_failed > 0:
+        print("%s files failed validation. Capture that information for your records." % count_failed)
+        print("Failures were logged to %s" % ns.drop)
+    ns.logs.log("Review lines above this mark for failed validation checks.")
+
+    return count_failed
+
+
+def produce_blocks(sizes, ops_list, namespace, gpg_agent):
+    """Turns the sorted list of files into finished, encrypted blocks in the
+    drop directory. How that is done is an internal detail of this function:
+    by default, blocks are packed, compressed, validated and encrypted as
+    separate stages with intermediate files in the working directory, while
+    with Streaming Build enabled each block is made in one pass by
+    stream_blocks. Once every block is made, the run's index block is
+    produced from the final ops list.
+
+    :param sizes: a list object returned by build_recovery_index.
+    :param ops_list: The full ops list prepared by build_ops_list.
+    :param namespace: the entire namespace object.
+    :param gpg_agent: a python-gnupg GPG agent object.
+    :return:
+    """
+    ns = namespace
+    if ns.streaming_build:
+        count_failed = stream_blocks(sizes, ops_list, ns, gpg_agent)
+        if count_failed:  # A block missing files can't be let through.
+            abort_run(ns, "%s blocks could not be streamed." % count_failed)
+    else:
+        if sys.platform == "win32":
+            list_blocks = windows_pack_blocks(sizes, ops_list, ns)
+        else:
+            list_blocks = unix_pack_blocks(sizes, ops_list, ns)
+        list_blocks = compress_blocks(ns, list_blocks, ns.compress, ns.compressLevel)
+        if ns.do_validation:
+            prevalidate_blocks(ns, list_blocks, ops_list, ns.digest_algorithm)
+        encrypt_blocks(list_blocks, gpg_agent, ns.activeFP, ns)
+    for result in run_tasks(ns, [build_index_task(ops_list, ns, gpg_agent)], "Indexing", fatal=True):
+        if not result.value[0]:
+            ns.logs.log(result.value[1])
+            abort_run(ns, "The index block could not be built.")
+    print("")
 
 
 def demand_validate(ns, gpg):
@@ -1648,11 +3215,30 @@ def demand_validate(ns, gpg):
             paths.remove(path)
             print("Skipping %s, not a tapestry block file!" % path)
             ns.logs.log("Skipping %s, not a tapestry block file!" % path)
+    manifests = {}
     for path in paths:  # this list now consists of .tap files that actually exist!
         # Validate each block individually in case they don't belong to the same set.
         path_out = os.path.join(ns.workDir, os.path.basename(path))
         print("Attempting to validate %s" % os.path.basename(path))
         ns.logs.log("Attempting to validate %s" % os.path.basename(path))
+        # The run's manifest, if it has one, catches a damaged block before any decryption.
+        path_manifest = os.path.join(os.path.dirname(path), parse_block_name(path)[0]+"-0.manifest")
+        if path_manifest not in manifests:
+            manifests.update({path_manifest: load_run_manifest(path_manifest, gpg, ns.logs)})
+            if manifests[path_manifest] is not None:
+                print(summarise_run_manifest(manifests[path_manifest]))
+        manifest = manifests[path_manifest]
+        if manifest is not None:
+            expected_size = manifest["blocks"].get(os.path.basename(path))
+            if expected_size is None:
+                print("%s is not one of the blocks named in its run's manifest." % os.path.basename(path))
+                ns.logs.log("%s is not one of the blocks named in its run's manifest." % os.path.basename(path))
+                continue
+            if os.path.getsize(path) != expected_size:
+                print("%s is %s bytes long, but its run's manifest says it should be %s. It is damaged." %
+                      (os.path.basename(path), os.path.getsize(path), expected_size))
+                ns.logs.log("%s is the wrong size for its run's manifest, and is damaged." % os.path.basename(path))
+                continue
         with open(path, "rb") as f:
             print("Decrypting the Block.")
             gpg.decrypt_file(f, always_trust=True, output=path_out)
@@ -1668,7 +3254,7 @@ def demand_validate(ns, gpg):
                 ns.logs.log("The file may be damaged, or have been created by a Pre-2.0 version of Tapestry.")
                 do_validate = False
         if do_validate:  # We step out at this level to close the tarfile in advance.
-            prevalidate_blocks(ns, [path_out], rec_index)  # This allows multithreaded
+            prevalidate_blocks(ns, [path_out], rec_index.file_index, rec_index.digest_algorithm)
 
     clean_up(ns.workDir)
 
@@ -0,0 +1,114 @@
+"""
+A small benchmark comparing the hashing loop build_ops_list used to run, one
+file at a time with 8 KiB reads, against tapestry.FileHasher at a few thread
+counts. Run it from Development/Source, or with that directory on PYTHONPATH.
+"""
+
+
+import argparse
+import hashlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import tapestry
+
+__version__ = "1.0.0"
+
+
+def parse_args():
+    """Parse the arguments given to the script/module at runtime for later use.
+
+    :return: Tuple of arguments set to variables for use later in the script.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', help="directory to hash. If omitted, a corpus is generated in a temporary directory",
+                        action="store", default=None)
+    parser.add_argument('-n', help="number of small files to generate", action="store", default=2000)
+    parser.add_argument('-s', help="size of each small file, in KiB", action="store", default=64)
+    parser.add_argument('-b', help="number of 128 MiB files to generate", action="store", default=2)
+    parser.add_argument('-t', help="comma-delimited list of thread counts to try", action="store", default="1,2,4,8")
+
+    args = parser.parse_args()
+    thread_counts = [int(each) for each in args.t.split(",")]
+
+    return args.r, int(args.n), int(args.s), int(args.b), thread_counts
+
+
+def make_corpus(root, count_small, size_small, count_big):
+    """Fills root with random small files and a few large ones, which the
+    hasher memory maps.
+    """
+    for i in range(count_small):
+        with open(os.path.join(root, "small-%s" % i), "wb") as f:
+            f.write(os.urandom(size_small * 1024))
+    for i in range(count_big):
+        with open(os.path.join(root, "big-%s" % i), "wb") as f:
+            for chunk in range(128):
+                f.write(os.urandom(1048576))
+
+
+def list_files(root):
+    found = []
+    for dir_path, sub_dirs, files in os.walk(root):
+        for file in files:
+            found.append(os.path.join(dir_path, file))
+    return found
+
+
+def hash_serially(paths):
+    """The loop build_ops_list ran before FileHasher."""
+    digests = []
+    for path in paths:
+        hasher = hashlib.new('sha256')
+        with open(path, "rb") as contents:
+            chunk = contents.read(io.DEFAULT_BUFFER_SIZE)
+            while chunk != b"":
+                hasher.update(chunk)
+                chunk = contents.read(io.DEFAULT_BUFFER_SIZE)
+        digests.append(hasher.hexdigest())
+    return digests
+
+
+def hash_pooled(paths, threads):
+    hasher = tapestry.FileHasher(threads)
+    futures = [hasher.submit(path) for path in paths]
+    digests = [future.result() for future in futures]
+    hasher.close()
+    return digests
+
+
+def report(label, seconds, total_bytes):
+    print("%-24s %8.2f s %10.1f MiB/s" % (label, seconds, total_bytes / 1048576 / seconds))
+
+
+if __name__ == "__main__":
+    root, count_small, size_small, count_big, thread_counts = parse_args()
+    generated = root is None
+    if generated:
+        root = tempfile.mkdtemp(prefix="hashbench-")
+        make_corpus(root, count_small, size_small, count_big)
+    try:
+        paths = list_files(root)
+        total_bytes = sum(os.path.getsize(path) for path in paths)
+        storage = tapestry.storage_type(os.stat(root).st_dev)
+        print("%s files, %.1f MiB, on %s storage. Timings are with a warm page cache."
+              % (len(paths), total_bytes / 1048576, storage))
+        hash_serially(paths)  # Warms the cache, so each run below reads the same way.
+
+        started = time.perf_counter()
+        expected = hash_serially(paths)
+        report("serial, 8 KiB reads", time.perf_counter() - started, total_bytes)
+        for threads in thread_counts:
+            started = time.perf_counter()
+            digests = hash_pooled(paths, threads)
+            report("FileHasher, %s threads" % threads, time.perf_counter() - started, total_bytes)
+            if digests != expected:
+                print("The digests did not match the serial loop!")
+                sys.exit(1)
+    finally:
+        if generated:
+            shutil.rmtree(root)
@@ -0,0 +1,104 @@
+"""
+A small benchmark of the Read Order policies. It reads every file in a
+directory start to finish, one at a time, in a random order (as blocks were
+once packed), in the order os.walk finds them, and in the "inode" and
+"physical" orders of tapestry.read_order_key. Each file is dropped from the
+page cache before every pass, so the reads really go to the disk. Run it from
+Development/Source, or with that directory on PYTHONPATH, on the storage to
+be measured; only spinning disks are expected to show much difference.
+"""
+
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import tapestry
+
+__version__ = "1.0.0"
+
+
+def parse_args():
+    """Parse the arguments given to the script/module at runtime for later use.
+
+    :return: Tuple of arguments set to variables for use later in the script.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', help="directory to read. If omitted, a corpus is generated in a temporary directory "
+                                   "beside this script, so it is on the same disk as the repository",
+                        action="store", default=None)
+    parser.add_argument('-n', help="number of files to generate", action="store", default=4000)
+    parser.add_argument('-s', help="size of each file, in KiB", action="store", default=64)
+    parser.add_argument('-d', help="number of directories to spread them over", action="store", default=40)
+
+    args = parser.parse_args()
+
+    return args.r, int(args.n), int(args.s), int(args.d)
+
+
+def make_corpus(root, count, size, count_dirs):
+    """Writes the files in a random order across the directories, so that
+    where they land on disk has nothing to do with their names."""
+    for i in range(count_dirs):
+        os.mkdir(os.path.join(root, "dir-%s" % i))
+    names = [os.path.join(root, "dir-%s" % (i % count_dirs), "file-%s" % i) for i in range(count)]
+    random.shuffle(names)
+    for name in names:
+        with open(name, "wb") as f:
+            f.write(os.urandom(size * 1024))
+    os.sync()
+
+
+def list_files(root):
+    found = []
+    for dir_path, sub_dirs, files in os.walk(root):
+        for file in files:
+            found.append(os.path.join(dir_path, file))
+    return found
+
+
+def evict(paths):
+    """Drops every file from the page cache."""
+    for path in paths:
+        with open(path, "rb") as f:
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def read_all(paths):
+    buffer = bytearray(1048576)
+    for path in paths:
+        with open(path, "rb", buffering=0) as f:
+            while f.readinto(buffer):
+                pass
+
+
+if __name__ == "__main__":
+    root, count, size, count_dirs = parse_args()
+    generated = root is None
+    if generated:
+        root = tempfile.mkdtemp(prefix="readorderbench-", dir=os.path.dirname(os.path.abspath(__file__)))
+        make_corpus(root, count, size, count_dirs)
+    try:
+        crawl = list_files(root)
+        total_bytes = sum(os.path.getsize(path) for path in crawl)
+        shuffled = list(crawl)
+        random.shuffle(shuffled)
+        orders = [("shuffle", shuffled), ("crawl", crawl),
+                  ("inode", sorted(crawl, key=lambda path: tapestry.read_order_key(path, None, "inode"))),
+                  ("physical", sorted(crawl, key=lambda path: tapestry.read_order_key(path, None, "physical")))]
+        storage = tapestry.storage_type(os.stat(root).st_dev)
+        print("%s files, %.1f MiB, on %s storage. Every pass starts with a cold page cache."
+              % (len(crawl), total_bytes / 1048576, storage))
+        for label, paths in orders:
+            evict(crawl)
+            started = time.perf_counter()
+            read_all(paths)
+            elapsed = time.perf_counter() - started
+            print("%-10s %8.2f s %10.0f files/s %8.1f MiB/s" %
+                  (label, elapsed, len(paths) / elapsed, total_bytes / 1048576 / elapsed))
+    finally:
+        if generated:
+            shutil.rmtree(root)
@@ -17,15 +17,19 @@ https://github.com/ZAdamMac/Tapestry
 
 from . import framework
 import tapestry
+import builtins
+import bz2
 from datetime import date
 import gnupg
 import hashlib
+import io
 import json
 import multiprocessing as mp
 import os
+import pickle
 import platform
 import pysftp
-from random import choice
+from random import choice, shuffle
 import shutil
 from string import printable
 import tarfile
@@ -77,11 +81,20 @@ def runtime(dict_config, do_network):
     # The following two lists should be populated with the function variables
     # Populate this list with all tests to be run locally.
     list_local_tests = [test_block_valid_put, test_block_yield_full, test_block_meta,
-                        test_riff_find, test_riff_compliant, #test_pkl_find, // Source Object is Lost
-                        test_TaskCheckIntegrity_call, test_TaskCompress, test_TaskDecompress,
+                        test_block_packer,
+                        test_riff_find, test_riff_compliant, test_riff_scope, test_binary_index, test_binary_index_damaged, #test_pkl_find, // Source Object is Lost
+                        test_TaskCheckIntegrity_call, test_digest_algorithm, test_TaskCompress, test_TaskDecompress,
                         test_TaskEncrypt, test_TaskDecrypt, test_TaskSign,
-                        test_TaskTarBuild, test_TaskTarUnpack, test_build_ops_list,
-                        test_build_recovery_index, test_media_retrieve_files,
+                        test_TaskBlockBuild, test_TaskBlockBuild_fused, test_finalize_fused_index,
+                        test_block_missing_member, test_TaskBlockStream,
+                        test_TaskBlockRestore,
+                        test_TaskStage, test_TaskTarUnpack, test_TaskTarExtractBlock,
+                        test_block_layout, test_select_restore, test_TaskVerifyBlock,
+                        test_WorkerPool, test_run_tasks_failures, test_build_ops_list, test_build_ops_list_vanished,
+                        test_crawl_categories, test_read_order,
+                        test_build_incremental_list, test_sftp_deposit_retention, test_change_journal,
+                        test_build_recovery_index, test_FileEntry, test_FileTable, test_FileHasher, test_hash_cache, test_run_catalog, test_media_retrieve_files,
+                        test_media_select_run, test_run_manifest,
                         test_parse_config, test_verify_blocks
                         ]
     # Populate this list with all the network tests (gated by do_network)
@@ -153,7 +166,7 @@ def test_block_meta(dict_config):
     findex = {'fname': "test_file", 'sha256': "NaN", 'category': "test",
               'fpath': "/docs/test", 'fsize': 100
               }
-    block.put("test_file", findex)
+    block.put("testfile", findex)
 
     block.meta(1, 100, 1, str(date.today()), "This is just a test.", {"testfile": findex}, dict_config["path_temp"])
 
@@ -163,6 +176,35 @@ def test_block_meta(dict_config):
         return ["[ERROR]The RIFF file appears not to have been placed."]
 
 
+def test_block_packer(dict_config):
+    """Packs a known set of file sizes with tapestry.BlockPacker and compares
+    the placement with a hand-worked first-fit-decreasing result. Sizes are
+    chosen so that a later, smaller file must go back into the first block.
+
+    :param dict_config: the configuration dictionary object.
+    :return:
+    """
+    errors = []
+    sizes = {"a": 60, "b": 50, "c": 30, "d": 20, "e": 10}  # Already largest-first.
+    expected = [["a", "c", "e"], ["b", "d"]]
+    try:
+        packer = tapestry.BlockPacker("test_block", 100, 10)
+        for fid in sizes:
+            packer.place(fid, {"fsize": sizes[fid]})
+    except AttributeError:
+        errors.append("[ERROR] tapestry.BlockPacker is not defined.")
+        return errors
+
+    result = [list(block.file_index.keys()) for block in packer.blocks]
+    if result != expected:
+        errors.append("[ERROR] The packer placed files unexpectedly: %s" % result)
+    if packer.blocks and packer.blocks[0].efficiency() != 1.0:
+        errors.append("[ERROR] The first block should be exactly full, but reports %s"
+                      % packer.blocks[0].efficiency())
+
+    return errors
+
+
 def test_block_valid_put(dict_config):
     """Attempts to place a file that would definitively fit in the block.
     The test "file" has been calculated in such a way that the block should
@@ -215,6 +257,14 @@ def test_build_ops_list(config):
     namespace.category_paths = {"a": config["path_temp"],
                                 "b": config["path_config"]}
     namespace.block_size_raw = 30000000  # Don't care at all.
+    namespace.hash_cache_path = None
+    namespace.fused_hashing = False
+    namespace.spill_to_disk = False
+    namespace.crawl_threads = 2
+    namespace.hash_threads = 2
+    namespace.digest_algorithm = "sha256"
+    namespace.read_order = "none"
+    namespace.change_journal_path = None
     errors = []
     # This test is a special case where someone linked multiple tests into a
     # Single test object. Therefore rather than relying on test_case's traditional
@@ -315,6 +365,590 @@ def test_build_ops_list(config):
     return errors
 
 
+def test_build_ops_list_vanished(config):
+    """Crawls a directory of five random files with the "inode" Read Order,
+    so that hashing waits until the crawl is over, and deletes one of them
+    as soon as the crawl finishes. build_ops_list must carry on, leaving the
+    deleted file out of the ops list and hashing the other four.
+
+    :param config: dict_config
+    :return:
+    """
+    errors = []
+    root = os.path.join(config["path_temp"], "vanished")
+    if os.path.exists(root):
+        shutil.rmtree(root)
+    os.mkdir(root)
+    expected = {}
+    for i in range(5):
+        name = "file-%s" % i
+        data = os.urandom(4096)
+        with open(os.path.join(root, name), "wb") as f:
+            f.write(data)
+        expected.update({name: hashlib.sha256(data).hexdigest()})
+    victim = "file-2"
+
+    namespace = tapestry.Namespace()
+    namespace.categories_default = ["a"]
+    namespace.categories_inclusive = []
+    namespace.inc = False
+    namespace.category_paths = {"a": root}
+    namespace.block_size_raw = 30000000
+    namespace.hash_cache_path = None
+    namespace.fused_hashing = False
+    namespace.spill_to_disk = False
+    namespace.crawl_threads = 2
+    namespace.hash_threads = 2
+    namespace.digest_algorithm = "sha256"
+    namespace.read_order = "inode"
+    namespace.change_journal_path = None
+    namespace.compid = "test"
+    namespace.logs = config["logs"]
+
+    real_crawl = tapestry.functions.crawl_categories
+
+    def crawl_then_delete(ns, run_list):
+        yield from real_crawl(ns, run_list)
+        os.remove(os.path.join(root, victim))
+
+    tapestry.functions.crawl_categories = crawl_then_delete
+    try:
+        ops_list = tapestry.build_ops_list(namespace)
+    except OSError as e:
+        errors.append("[ERROR] build_ops_list failed on a file deleted before it was hashed: %s" % e)
+        return errors
+    finally:
+        tapestry.functions.crawl_categories = real_crawl
+
+    found = {entry["fpath"]: entry["sha256"] for entry in ops_list.values()}
+    if victim in found:
+        errors.append("[ERROR] The deleted file was kept in the ops list.")
+    for name in expected:
+        if name != victim and found.get(name) != expected[name]:
+            errors.append("[ERROR] %s was listed with the digest %s, not %s."
+                          % (name, found.get(name), expected[name]))
+
+    return errors
+
+
+def test_crawl_categories(config):
+    """Walks a small tree of two categories with tapestry.crawl_categories,
+    which should find the same files, in the same order, as the os.walk and
+    access_test crawl build_ops_list used to do. The tree includes a linked
+    directory, a broken link and a file we can't write to.
+
+    :param config: dict_config
+    :return:
+    """
+    errors = []
+    root = os.path.join(config["path_temp"], "crawl")
+    if os.path.exists(root):
+        shutil.rmtree(root)
+    categories = {"alpha": os.path.join(root, "alpha"), "beta": os.path.join(root, "beta")}
+    for category, path in categories.items():
+        for sub in ("", "one", os.path.join("one", "deeper"), "two", "three"):
+            os.makedirs(os.path.join(path, sub), exist_ok=True)
+            for i in range(3):
+                with open(os.path.join(path, sub, "%s-%s.txt" % (category, i)), "w") as f:
+                    f.write(category * (i + 1))
+    os.symlink(os.path.join(categories["alpha"], "one"), os.path.join(categories["beta"], "linked"))
+    os.symlink(os.path.join(root, "missing"), os.path.join(categories["alpha"], "broken"))
+    os.chmod(os.path.join(categories["beta"], "two", "beta-1.txt"), 0o444)
+
+    expected = []
+    for category, path in categories.items():
+        for dir_path, sub_dirs, files in os.walk(path):
+            for file in files:
+                absolute_path = os.path.join(dir_path, file)
+                expected.append((category, absolute_path, False not in tapestry.access_test(absolute_path)))
+
+    namespace = tapestry.Namespace()
+    namespace.category_paths = categories
+    for threads in (1, 4):
+        namespace.crawl_threads = threads
+        try:
+            found = list(tapestry.crawl_categories(namespace, list(categories)))
+        except AttributeError:
+            errors.append("[ERROR] tapestry.crawl_categories is not defined.")
+            break
+        if [(category, path, accessible) for category, path, stats, accessible in found] != expected:
+            errors.append("[ERROR] With %s threads, the crawl did not match os.walk." % threads)
+        for category, path, stats, accessible in found:
+            if accessible and stats.st_size != os.stat(path).st_size:
+                errors.append("[ERROR] The wrong size was recorded for %s." % path)
+    os.chmod(os.path.join(categories["beta"], "two", "beta-1.txt"), 0o644)
+
+    return errors
+
+
+def test_read_order(config):
+    """Fills a block with files written in a shuffled order, then lists its
+    members with each Read Order policy. "none" must keep the order the block
+    was filled in, "inode" must sort the members by inode number, and
+    "physical" by where each file's data starts on disk, wherever the
+    filesystem can say.
+
+    :param config: dict_config
+    :return:
+    """
+    errors = []
+    root = os.path.join(config["path_temp"], "read_order")
+    if os.path.exists(root):
+        shutil.rmtree(root)
+    os.mkdir(root)
+    names = ["file-%02d" % i for i in range(20)]
+    written = list(names)
+    shuffle(written)
+    for name in written:
+        with open(os.path.join(root, name), "wb") as f:
+            f.write(os.urandom(8192))
+
+    block = tapestry.Block("test-read-order", 1000000, 0, 0)
+    for name in names:
+        block.put(name, tapestry.FileEntry("a", name, 8192))
+    namespace = tapestry.Namespace()
+    namespace.category_paths = {"a": root}
+    namespace.read_order = "none"
+    if [fid for fid, path in tapestry.build_block_members(block, namespace)] != names:
+        errors.append("[ERROR] Without a Read Order, the members were not in the order the block was filled.")
+    namespace.read_order = "inode"
+    members = tapestry.build_block_members(block, namespace)
+    inodes = [os.stat(path).st_ino for fid, path in members]
+    if inodes != sorted(inodes) or sorted(fid for fid, path in members) != names:
+        errors.append("[ERROR] The members were not sorted by inode.")
+    namespace.read_order = "physical"
+    members = tapestry.build_block_members(block, namespace)
+    offsets = [tapestry.physical_offset(path) for fid, path in members]
+    if None not in offsets and offsets != sorted(offsets):
+        errors.append("[ERROR] The members were not sorted by physical offset.")
+    if sorted(fid for fid, path in members) != names:
+        errors.append("[ERROR] Sorting by physical offset lost or duplicated members.")
+
+    return errors
+
+
+def test_change_journal(config):
+    """Records changes in a tapestry.ChangeJournal and checks when begin will
+    and won't let it stand in for a crawl. Where inotify is available, a
+    tapestry.ChangeWatcher then watches a small tree while files and
+    directories are changed, and tapestry.crawl_changes must visit exactly
+    what changed.
+
+    :param config: dict_config
+    :return:
+    """
+    errors = []
+    root = os.path.join(config["path_temp"], "journal")
+    if os.path.exists(root):
+        shutil.rmtree(root)
+    categories = {"alpha": os.path.join(root, "alpha"), "beta": os.path.join(root, "beta")}
+    for path in categories.values():
+        os.makedirs(os.path.join(path, "one"))
+        for name in ("kept.txt", os.path.join("one", "kept.txt")):
+            with open(os.path.join(path, name), "w") as f:
+                f.write("unchanged")
+
+    journal = tapestry.ChangeJournal(os.path.join(root, "journal.db"))
+    journal.start(os.getpid())
+    snapshot, changes, reason = journal.begin(None, "signature")
+    if changes is not None:
+        errors.append("[ERROR] The journal was used before any crawl had cleared it.")
+    journal.clear(snapshot, "run-1", "signature")
+    journal.record([("alpha", os.path.join("one", "kept.txt"), False), ("alpha", "one", True),
+                    ("beta", "new.txt", False)])
+    snapshot, changes, reason = journal.begin("run-1", "signature")
+    if changes != {"alpha": {"one": True}, "beta": {"new.txt": False}}:
+        errors.append("[ERROR] The journal listed %s, not the changes recorded." % changes)
+    if not tapestry.listed_in_changes(os.path.join("one", "kept.txt"), changes["alpha"]) \
+            or tapestry.listed_in_changes("kept.txt", changes["alpha"]):
+        errors.append("[ERROR] listed_in_changes did not match files below a changed directory.")
+    if journal.begin("run-0", "signature")[1] is not None or journal.begin("run-1", "other")[1] is not None:
+        errors.append("[ERROR] The journal was used for a different run or different settings.")
+    journal.record([(journal.everything, "", True)])
+    if journal.begin("run-1", "signature")[1] is not None:
+        errors.append("[ERROR] The journal was used after its event queue overflowed.")
+    journal.clear(journal.begin("run-1", "signature")[0], "run-1", "signature")
+    if journal.begin("run-1", "signature")[1] != {}:
+        errors.append("[ERROR] Clearing the journal did not leave it empty and usable.")
+    journal.stop()
+    if journal.begin("run-1", "signature")[1] is not None:
+        errors.append("[ERROR] The journal was used after its watcher stopped.")
+    journal.close()
+
+    journal = tapestry.ChangeJournal(os.path.join(root, "watched.db"))
+    try:
+        watcher = tapestry.ChangeWatcher(journal, categories)
+    except OSError:  # No inotify here, so only the journal can be tested.
+        journal.close()
+        return errors
+    watcher.start()
+    journal.clear(journal.begin(None, "signature")[0], "run-1", "signature")
+    with open(os.path.join(categories["alpha"], "kept.txt"), "a") as f:
+        f.write("changed")
+    os.makedirs(os.path.join(categories["alpha"], "two", "three"))
+    with open(os.path.join(categories["alpha"], "two", "three", "new.txt"), "w") as f:
+        f.write("new")
+    os.rename(os.path.join(categories["beta"], "one"), os.path.join(categories["beta"], "moved"))
+    os.remove(os.path.join(categories["beta"], "kept.txt"))
+    for attempt in range(5):
+        watcher.process(0.2)
+    changes = journal.begin("run-1", "signature")[1]
+    expected = {"alpha": {"kept.txt": False, "two": True}, "beta": {"one": True, "moved": True, "kept.txt": False}}
+    if changes != expected:
+        errors.append("[ERROR] The watcher recorded %s, not %s." % (changes, expected))
+    else:
+        namespace = tapestry.Namespace()
+        namespace.category_paths = categories
+        namespace.crawl_threads = 2
+        found = sorted((category, os.path.relpath(path, categories[category]))
+                       for category, path, stats, accessible in tapestry.crawl_changes(namespace, changes))
+        if found != [("alpha", "kept.txt"), ("alpha", os.path.join("two", "three", "new.txt")),
+                     ("beta", os.path.join("moved", "kept.txt"))]:
+            errors.append("[ERROR] crawl_changes visited %s." % found)
+    watcher.close()
+    journal.stop()
+    journal.close()
+
+    return errors
+
+
+def test_build_incremental_list(config):
+    """Writes the RIFF of a fictional earlier run into a scratch drop directory,
+    then compares a new ops list against it with build_incremental_list. The
+    unchanged file must keep its old FID and point back to the earlier run,
+    while the changed and new files must be the only ones left to pack.
+
+    :param config: dict_config
+    :return:
+    """
+    errors = []
+    drop = os.path.join(config["path_temp"], "incremental_drop")
+    if os.path.exists(drop):
+        shutil.rmtree(drop)
+    os.mkdir(drop)
+    previous_index = {
+        "old-same": {"fname": "same", "sha256": "aa", "fsize": 1, "fpath": "same", "category": "a"},
+        "old-changed": {"fname": "changed", "sha256": "bb", "fsize": 1, "fpath": "changed", "category": "a"}
+    }
+    with open(os.path.join(drop, "test-2001-01-01-1.riff"), "w") as f:
+        json.dump({"metaBlock": {}, "metaRun": {"sumBlock": 1}, "index": previous_index}, f)
+    ops_list = {
+        "new-same": {"fname": "same", "sha256": "aa", "fsize": 1, "fpath": "same", "category": "a"},
+        "new-changed": {"fname": "changed", "sha256": "cc", "fsize": 1, "fpath": "changed", "category": "a"},
+        "new-added": {"fname": "added", "sha256": "dd", "fsize": 1, "fpath": "added", "category": "a"}
+    }
+    namespace = tapestry.Namespace()
+    namespace.drop = drop
+    namespace.compid = "test"
+    namespace.logs = config["logs"]
+    namespace.digest_algorithm = "sha256"
+
+    try:
+        full_index, to_pack = tapestry.build_incremental_list(namespace, ops_list)
+    except AttributeError:
+        errors.append("[ERROR] tapestry.build_incremental_list is not defined.")
+        return errors
+    if sorted(full_index.keys()) != ["new-added", "new-changed", "old-same"]:
+        errors.append("[ERROR] The index contained %s." % sorted(full_index.keys()))
+    elif full_index["old-same"].get("run") != "test-2001-01-01":
+        errors.append("[ERROR] The unchanged file does not reference the earlier run.")
+    if sorted(to_pack.keys()) != ["new-added", "new-changed"]:
+        errors.append("[ERROR] The files to pack were %s." % sorted(to_pack.keys()))
+    if namespace.referenced_runs != ["test-2001-01-01"]:
+        errors.append("[ERROR] The referenced runs were %s." % namespace.referenced_runs)
+
+    namespace.digest_algorithm = "blake2b"  # The earlier run's digests can't be compared with these.
+    full_index, to_pack = tapestry.build_incremental_list(namespace, ops_list)
+    if sorted(to_pack.keys()) != ["new-added", "new-changed", "new-same"]:
+        errors.append("[ERROR] With a different digest algorithm, the files to pack were %s." % sorted(to_pack.keys()))
+
+    return errors
+
+
+def test_sftp_deposit_retention(config):
+    """Deposits a run's outputs through tapestry.sftp_deposit_block, to a
+    stand-in for the SFTP connection, with Keep Local Copies off. Every file
+    must be sent and removed locally, except the RIFF of the index block,
+    which find_previous_index must still find for the next incremental run.
+
+    :param config: dict_config
+    :return:
+    """
+    errors = []
+    drop = os.path.join(config["path_temp"], "deposit_drop")
+    if os.path.exists(drop):
+        shutil.rmtree(drop)
+    os.mkdir(drop)
+    run = "test-2001-01-01"
+    with open(os.path.join(drop, run+"-0.riff"), "w") as f:
+        json.dump({"metaBlock": {}, "metaRun": {"sumBlock": 1},
+                   "index": {"fid": {"fname": "same", "sha256": "aa", "fsize": 1, "fpath": "same", "category": "a"}}},
+                  f)
+    names = [run+"-0.tap", run+"-0.tap.sig", run+"-1.tap", run+"-1.tap.sig", run+"-1.riff", run+"-0.riff"]
+    for name in names[:-1]:
+        with open(os.path.join(drop, name), "w") as f:
+            f.write(name)
+
+    class Connection(object):
+        pwd = "/remote"
+
+        def __init__(self):
+            self.sent = []
+
+        def put(self, path):
+            self.sent.append(os.path.basename(path))
+
+    connection = Connection()
+    namespace = tapestry.Namespace()
+    namespace.retainLocal = False
+    namespace.dirNet = "/remote"
+    namespace.logs = config["logs"]
+    tapestry.sftp_deposit_block(namespace, connection, [os.path.join(drop, name) for name in names])
+    if connection.sent != names:
+        errors.append("[ERROR] The files sent were %s." % connection.sent)
+    if os.listdir(drop) != [run+"-0.riff"]:
+        errors.append("[ERROR] %s were left locally, rather than only the index RIFF." % sorted(os.listdir(drop)))
+    base_run, previous_index = tapestry.find_previous_index(drop, "test", "test-2001-01-02")
+    if base_run != run or previous_index.find_path("a", "same") != "fid":
+        errors.append("[ERROR] The next incremental run could not find the run's index.")
+
+    return errors
+
+
+def test_FileEntry(config):
+    """Builds a tapestry.FileEntry alongside the dict it stands in for, and
+    checks that the two read, update, copy, pickle and serialize to JSON the
+    same way.
+
+    :param config: dict_config
+    :return:
+    """
+    errors = []
+    digest = hashlib.sha256(b"test_FileEntry").hexdigest()
+    fpath = os.path.join("letters", "2019", "a.txt")
+    expected = {"fname": "a.txt", "sha256": digest, "category": "docs", "fpath": fpath, "fsize": 100}
+
+    try:
+        entry = tapestry.FileEntry("docs", fpath, 100, digest)
+    except AttributeError:
+        errors.append("[ERROR] tapestry.FileEntry is not defined.")
+        return errors
+    if dict(entry) != expected:
+        errors.append("[ERROR] The entry did not read back as expected: %s" % dict(entry))
+    if entry.get("run") is not None or "block" in entry:
+        errors.append("[ERROR] The entry reported keys which were never set.")
+
+    entry.update({"block": 3, "offset": 512, "length": 1024, "changedDuringRead": True})
+    expected.update({"block": 3, "offset": 512, "length": 1024, "changedDuringRead": True})
+    clone = entry.copy()
+    clone["run"] = "test-2019-01-01"
+    if dict(entry) != expected:
+        errors.append("[ERROR] The entry did not update as expected: %s" % dict(entry))
+    if "run" in entry or clone["run"] != "test-2019-01-01" or clone["block"] != 3:
+        errors.append("[ERROR] The copy of the entry was not independent of the original.")
+    if dict(pickle.loads(pickle.dumps(entry))) != expected:
+        errors.append("[ERROR] The entry did not survive being pickled.")
+    if json.loads(json.dumps({"index": entry}, default=dict)) != {"index": expected}:
+        errors.append("[ERROR] The entry was not written to JSON as the dict it stands for.")
+    if hasattr(entry, "__dict__"):
+        errors.append("[ERROR] The entry has a __dict__, so its slots are not saving any memory.")
+
+    return errors
+
+
+def test_FileTable(config):
+    """Fills a tapestry.FileTable and a dict with the same ops list, then
+    sorts and packs both. The table must give the same order, total size and
+    block assignments as the dict, hold each block's files in the order they
+    were placed, and write the same RIFF.
+
+    :param config: dict_config
+    :return:
+    """
+    errors = []
+    path_table = os.path.join(config["path_temp"], "file_table.db")
+    drop = os.path.join(config["path_temp"], "file_table_drop")
+    if os.path.exists(drop):
+        shutil.rmtree(drop)
+    os.mkdir(drop)
+
+    try:
+        table = tapestry.FileTable(path_table, batch_size=7)  # Small batches, so that writes happen mid-test.
+    except AttributeError:
+        errors.append("[ERROR] tapestry.FileTable is not defined.")
+        return errors
+    ops_list = {}
+    for i in range(60):
+        fid = "fid-%02d" % ((i * 37) % 60)
+        digest = hashlib.sha256(fid.encode()).hexdigest()
+        ops_list.update({fid: tapestry.FileEntry("docs", os.path.join("dir", fid), (i * 13) % 17 * 100, digest)})
+        table.update({fid: ops_list[fid].copy()})
+    if len(table) != 60 or dict(table["fid-07"]) != dict(ops_list["fid-07"]):
+        errors.append("[ERROR] The table did not read back the entries written to it.")
+
+    expected_sizes, expected_sum = tapestry.build_recovery_index(ops_list)
+    sizes, sum_size = tapestry.build_recovery_index(table)
+    if list(sizes) != expected_sizes or sum_size != expected_sum:
+        errors.append("[ERROR] The table was not sorted the same way as the dict.")
+    if sizes[-1] != expected_sizes[-1]:
+        errors.append("[ERROR] The smallest file in the table was %s, not %s." % (sizes[-1], expected_sizes[-1]))
+
+    namespace = tapestry.Namespace()
+    namespace.compid = "test"
+    namespace.block_size_raw = 2000
+    namespace.logs = config["logs"]
+    expected_blocks = tapestry.build_blocks(expected_sizes, ops_list, namespace)
+    blocks = tapestry.build_blocks(sizes, table, namespace)
+    for expected_block, block in zip(expected_blocks, blocks):
+        if list(block.file_index) != list(expected_block.file_index):
+            errors.append("[ERROR] Block %s held %s." % (block.num_block, list(block.file_index)))
+    if len(blocks) != len(expected_blocks) or table["fid-07"]["block"] != ops_list["fid-07"]["block"]:
+        errors.append("[ERROR] The table was not packed the same way as the dict.")
+
+    expected_riff = expected_blocks[0].meta(1, 0, 60, "2001-01-01", None, ops_list, drop)
+    with open(expected_riff, "r") as f:
+        expected = json.load(f)
+    riff = blocks[0].meta(1, 0, 60, "2001-01-01", None, table, drop, scope="run")
+    with open(riff, "r") as f:
+        found = json.load(f)
+    if found["index"] != {fid: dict(entry) for fid, entry in ops_list.items()}:
+        errors.append("[ERROR] The RIFF written from the table did not index every file as the dict would.")
+    if found["metaBlock"] != expected["metaBlock"] or found["indexScope"] != "run":
+        errors.append("[ERROR] The RIFF written from the table did not carry the expected metadata.")
+    table.close()
+
+    return errors
+
+
+def test_FileHasher(config):
+    """Hashes files of several sizes with a tapestry.FileHasher, both on its
+    pool and in the calling thread, with a low mmap_threshold so that the
+    largest file is memory mapped. Every digest must match hashlib's.
+
+    :param config: dict_config
+    :return:
+    """
+    errors = []
+    expected = {}
+    for size in (0, 1, 4096, 1048575, 1048577, 5000000):
+        path = os.path.join(config["path_temp"], "hasher-%s" % size)
+        data = os.urandom(size)
+        with open(path, "wb") as f:
+            f.write(data)
+        expected.update({path: hashlib.sha256(data).hexdigest()})
+
+    try:
+        hasher = tapestry.FileHasher(3, mmap_threshold=4194304)
+    except AttributeError:
+        errors.append("[ERROR] tapestry.FileHasher is not defined.")
+        return errors
+    futures = {path: hasher.submit(path) for path in expected}
+    for path, digest in expected.items():
+        if futures[path].result() != digest:
+            errors.append("[ERROR] The pool gave the wrong digest for %s." % path)
+        if hasher.hash_file(path, os.stat(path)) != digest:
+            errors.append("[ERROR] hash_file gave the wrong digest for %s." % path)
+    kind = tapestry.storage_type(os.stat(config["path_temp"]).st_dev)
+    if kind not in hasher.read_sizes:
+        errors.append("[ERROR] %s is not a known storage type." % kind)
+    hasher.close()
+    for path in expected:
+        os.remove(path)
+
+    return errors
+
+
+def test_hash_cache(config):
+    """Stores a digest in a fresh tapestry.HashCache, then checks that it is
+    returned for the unchanged file, ignored once the file is modified, and
+    evicted by prune() once the file is deleted.
+
+    :param config: dict_config
+    :return:
+    """
+    errors = []
+    path_cache = os.path.join(config["path_temp"], "hash_cache.db")
+    path_file = os.path.join(config["path_temp"], "hash_cache_test")
+    if os.path.exists(path_cache):
+        os.remove(path_cache)
+    with open(path_file, "w") as f:
+        f.write("The first version of this file.")
+
+    try:
+        cache = tapestry.HashCache(path_cache)
+    except AttributeError:
+        errors.append("[ERROR] tapestry.HashCache is not defined.")
+        return errors
+    cache.put(path_file, os.stat(path_file), "aabb")
+    cache.flush()
+    if cache.get(path_file, os.stat(path_file)) != "aabb":
+        errors.append("[ERROR] The cache did not return the digest of an unchanged file.")
+
+    with open(path_file, "a") as f:
+        f.write(" This is the second.")
+    if cache.get(path_file, os.stat(path_file)) is not None:
+        errors.append("[ERROR] The cache returned a stale digest for a modified file.")
+
+    os.remove(path_file)
+    cache = tapestry.HashCache(path_cache)  # A new run, so nothing has been seen yet.
+    evicted = cache.prune()
+    cache.close()
+    if evicted != 1:
+        errors.append("[ERROR] prune() evicted %s entries where 1 was expected." % evicted)
+
+    return errors
+
+
+def test_run_catalog(config):
+    """Records two runs in a fresh tapestry.RunCatalog, the second incremental
+    against the first, then searches it by path, file name, hash, date and
+    category, and checks that each search finds the expected copies and
+    names the block that holds each one.
+
+    :param config: dict_config
+    :return:
+    """
+    errors = []
+    path_catalog = os.path.join(config["path_temp"], "run_catalog.db")
+    if os.path.exists(path_catalog):
+        os.remove(path_catalog)
+    meta = {"dateRec": "2019-01-01", "comment": "No Comment", "countFilesSum": 2, "sizeExtraLarge": 300,
+            "sumBlock": 1}
+    first = {"a": {"category": "docs", "fpath": "letters/a.txt", "fsize": 100, "sha256": "aaaa", "block": 1},
+             "b": {"category": "pics", "fpath": "b.png", "fsize": 200, "sha256": "bbbb", "block": 1}}
+    second = {"a": {"category": "docs", "fpath": "letters/a.txt", "fsize": 100, "sha256": "aaaa", "block": 1,
+                    "run": "test-2019-01-01"},
+              "b": {"category": "pics", "fpath": "b.png", "fsize": 250, "sha256": "cccc", "block": 1}}
+
+    try:
+        catalog = tapestry.RunCatalog(path_catalog)
+    except AttributeError:
+        errors.append("[ERROR] tapestry.RunCatalog is not defined.")
+        return errors
+    catalog.record_run({"run": "test-2019-01-01", "metaRun": meta, "blocks": {"test-2019-01-01-1.tap": 500}},
+                       first, config["path_temp"])
+    meta.update({"dateRec": "2019-02-01", "baseRun": "test-2019-01-01"})
+    catalog.record_run({"run": "test-2019-02-01", "metaRun": meta, "blocks": {"test-2019-02-01-1.tap": 400}},
+                       second, config["path_temp"])
+
+    searches = [({"paths": ["letters"]}, [("test-2019-02-01", "test-2019-01-01-1.tap"),
+                                          ("test-2019-01-01", "test-2019-01-01-1.tap")]),
+                ({"paths": ["b.png"], "date": "2019-02"}, [("test-2019-02-01", "test-2019-02-01-1.tap")]),
+                ({"paths": ["docs/letters/*"], "sha256": "AA"}, [("test-2019-02-01", "test-2019-01-01-1.tap"),
+                                                                 ("test-2019-01-01", "test-2019-01-01-1.tap")]),
+                ({"sha256": "bbbb"}, [("test-2019-01-01", "test-2019-01-01-1.tap")]),
+                ({"categories": ["pics"], "date": "2018"}, [])]
+    for filters, expected in searches:
+        found = [(row[0], row[6]) for row in catalog.search(**filters)]
+        if found != expected:
+            errors.append("[ERROR] Searching for %s found %s, not %s." % (filters, found, expected))
+    if [row[0] for row in catalog.runs()] != ["test-2019-02-01", "test-2019-01-01"]:
+        errors.append("[ERROR] The catalog did not list both runs, newest first.")
+    catalog.close()
+
+    return errors
+
+
 def test_pkl_find(config):
     """Creates a recovery index from PKL and verifies that it can find an expected file.
     This is run against a loaded canonical riff to avoid a dependancy on
@@ -463,6 +1097,163 @@ def test_build_recovery_index(config):
     return errors
 
 
+def test_riff_scope(config):
+    """Writes the RIFFs of two blocks and of their run's index block from one
+    three-file index, then checks that each block's RIFF holds only its own
+    files while the index block's holds them all, and that a RecoveryIndex
+    pieced together from the block RIFFs can find every file.
+
+    :param config: dict_config
+    :return:
+    """
+    errors = []
+    temp = config["path_temp"]
+    full_index = {}
+    for fid in ["scope_a", "scope_b", "scope_c"]:
+        full_index.update({fid: {"fname": fid, "sha256": "NaN", "category": "test",
+                                 "fpath": "/docs/"+fid, "fsize": 10}})
+    first = tapestry.Block("scope-1", 100, 1, 10)
+    first.put("scope_a", full_index["scope_a"])
+    first.put("scope_b", full_index["scope_b"])
+    second = tapestry.Block("scope-2", 100, 2, 10)
+    second.put("scope_c", full_index["scope_c"])
+    paths = []
+    try:
+        for block in [first, second]:
+            paths.append(block.meta(2, 30, 3, str(date.today()), None, full_index, temp))
+        paths.append(tapestry.Block("scope-0", 0, 0, 0).meta(2, 30, 3, str(date.today()), None, full_index,
+                                                              temp, scope="run"))
+    except TypeError:
+        errors.append("[ERROR] Block.meta does not accept a scope.")
+        return errors
+
+    expected = [["scope_a", "scope_b"], ["scope_c"], ["scope_a", "scope_b", "scope_c"]]
+    for path, fids in zip(paths, expected):
+        with open(path, "r") as f:
+            riff = json.load(f)
+        if sorted(riff["index"]) != fids:
+            errors.append("[ERROR] %s indexed %s where %s was expected." % (path, sorted(riff["index"]), fids))
+
+    with open(paths[0], "rb") as f:
+        rebuilt = tapestry.RecoveryIndex(f)
+    if not rebuilt.partial:
+        errors.append("[ERROR] A block's RIFF was not recognised as a partial index.")
+    with open(paths[1], "rb") as f:
+        rebuilt.merge(tapestry.RecoveryIndex(f))
+    for fid in full_index:
+        if rebuilt.find(fid) != ("test", "/docs/"+fid):
+            errors.append("[ERROR] The merged index could not find %s." % fid)
+
+    return errors
+
+
+def test_binary_index(config):
+    """Writes a small index as a tapestry.BinaryIndex, from a dict and from a
+    FileTable, and opens it with RecoveryIndex both from disk and from memory.
+    Every file must be found by FID and by path, with the same entry and
+    location as in the dict, and files which aren't there must not be.
+
+    :param config: dict_config
+    :return:
+    """
+    errors = []
+    path_index = os.path.join(config["path_temp"], "binary_index.ridx")
+    path_spilled = os.path.join(config["path_temp"], "binary_index_table.ridx")
+    index = {}
+    for i in range(50):
+        fid = "fid-%02d" % ((i * 31) % 50)
+        entry = tapestry.FileEntry(["docs", "pics"][i % 2], os.path.join("dir%s" % (i % 4), "file%02d" % i), i,
+                                   hashlib.sha256(fid.encode()).hexdigest())
+        entry.update({"block": i % 3 + 1, "offset": 512 * i, "length": 1024})
+        index.update({fid: entry})
+    index["fid-00"].update({"run": "test-2001-01-01"})
+    metadata = {"metaBlock": {"numBlock": 0}, "metaRun": {"sumBlock": 3, "referencedRuns": ["test-2001-01-01"]},
+                "indexScope": "run"}
+
+    try:
+        tapestry.BinaryIndex.write(path_index, index, metadata)
+    except AttributeError:
+        errors.append("[ERROR] tapestry.BinaryIndex is not defined.")
+        return errors
+    table = tapestry.FileTable(os.path.join(config["path_temp"], "binary_index_table.db"))
+    table.update({fid: entry.copy() for fid, entry in index.items()})
+    tapestry.BinaryIndex.write(path_spilled, table, metadata)
+    table.close()
+
+    with open(path_index, "rb") as index_file:
+        mapped = tapestry.RecoveryIndex(index_file)
+    with open(path_spilled, "rb") as index_file:
+        read = tapestry.RecoveryIndex(io.BytesIO(index_file.read()))
+    for label, rec_index in [("mapped", mapped), ("spilled", read)]:
+        if rec_index.mode != "bin" or rec_index.blocks != 3 or rec_index.partial:
+            errors.append("[ERROR] The %s index did not load as a binary index of 3 blocks." % label)
+        if rec_index.referenced_runs != ["test-2001-01-01"] or len(rec_index.file_index) != 50:
+            errors.append("[ERROR] The %s index did not carry its metadata and files." % label)
+        for fid, entry in index.items():
+            if rec_index.file_index.get(fid) != dict(entry):
+                errors.append("[ERROR] The %s index read back %s as %s." % (label, fid, rec_index.file_index.get(fid)))
+            if rec_index.find_path(entry["category"], entry["fpath"]) != fid:
+                errors.append("[ERROR] The %s index did not find %s by its path." % (label, fid))
+            if rec_index.find(fid) != (entry["category"], entry["fpath"]):
+                errors.append("[ERROR] The %s index did not find the path of %s." % (label, fid))
+            if rec_index.locate(fid) != (entry.get("run"), entry["block"], entry["offset"], entry["length"]):
+                errors.append("[ERROR] The %s index did not locate %s." % (label, fid))
+        if "fid-99" in rec_index.file_index or rec_index.find_path("docs", "missing") is not None:
+            errors.append("[ERROR] The %s index found a file it does not hold." % label)
+        if rec_index.find("fid-99") != (b"404", b"404"):
+            errors.append("[ERROR] The %s index did not report a missing FID as 404." % label)
+        if sorted(rec_index.file_index) != sorted(index):
+            errors.append("[ERROR] The %s index did not list every FID." % label)
+
+    return errors
+
+
+def test_binary_index_damaged(config):
+    """Leaves an empty, then a truncated, binary index beside a run's index
+    RIFF in a scratch drop directory. Opening either must raise a
+    RecoveryIndexError, and find_previous_index must fall back to the RIFF
+    rather than crash the next incremental run.
+
+    :param config: dict_config
+    :return:
+    """
+    errors = []
+    drop = os.path.join(config["path_temp"], "damaged_drop")
+    if os.path.exists(drop):
+        shutil.rmtree(drop)
+    os.mkdir(drop)
+    run = "test-2001-01-01"
+    index = {"fid": {"fname": "same", "sha256": "aa", "fsize": 1, "fpath": "same", "category": "a"}}
+    metadata = {"metaBlock": {"numBlock": 0}, "metaRun": {"sumBlock": 1}, "indexScope": "run"}
+    with open(os.path.join(drop, run+"-0.riff"), "w") as f:
+        json.dump(dict(metadata, index=index), f)
+    path_index = os.path.join(drop, run+"-0.ridx")
+    tapestry.BinaryIndex.write(path_index, index, metadata)
+    with open(path_index, "rb") as f:
+        whole = f.read()
+
+    for label, damaged in [("empty", b""), ("truncated", whole[:-8])]:
+        with open(path_index, "wb") as f:
+            f.write(damaged)
+        try:
+            with open(path_index, "rb") as f:
+                tapestry.BinaryIndex.open(f)
+            errors.append("[ERROR] The %s binary index was opened without complaint." % label)
+        except tapestry.RecoveryIndexError:
+            pass
+        except Exception as e:
+            errors.append("[ERROR] The %s binary index raised %r." % (label, e))
+        try:
+            base_run, previous_index = tapestry.find_previous_index(drop, "test", "test-2001-01-02")
+        except Exception as e:
+            errors.append("[ERROR] With the %s binary index, find_previous_index raised %r." % (label, e))
+            continue
+        if base_run != run or previous_index.mode != "json" or previous_index.find_path("a", "same") != "fid":
+            errors.append("[ERROR] With the %s binary index, the run's RIFF was not used." % label)
+
+    return errors
+
+
 def test_riff_find(config):
     """Takes a test riff object and verifies that it can find an expected file.
     This is run against a loaded canonical riff to avoid a dependancy on
@@ -529,6 +1320,60 @@ def test_TaskCheckIntegrity_call(config):
         pass
     else:
         errors.append("[ERROR] The test article failed to pass TaskCheckIntegrity's test.")
+    if not tapestry.TaskCheckIntegrity(test_tar, "hash_test", control_hash, chunk_size=100)()[0]:
+        errors.append("[ERROR] TaskCheckIntegrity gave a different hash when reading in small chunks.")
+
+    return errors
+
+
+def test_digest_algorithm(config):
+    """Builds a small block of random files and checks that TaskVerifyBlock,
+    TaskCheckIntegrity and FileHasher all give BLAKE2b digests when asked,
+    and that a RIFF which doesn't name its digest algorithm is read as
+    SHA-256, as every RIFF before the option existed was.
+
+    :param config: dict_config
+    :return:
+    """
+    errors = []
+    temp = config["path_temp"]
+    expected = {}
+    tgt = os.path.join(temp, "digest_test.tar")
+    with tarfile.open(tgt, "w:") as tf:
+        for name in ["digest_a", "digest_b"]:
+            path = os.path.join(temp, name)
+            with open(path, "wb") as f:
+                f.write(os.urandom(5000))
+            with open(path, "rb") as f:
+                expected.update({name: hashlib.blake2b(f.read(), digest_size=32).hexdigest()})
+            tf.add(path, arcname=name)
+
+    try:
+        block_ok, message, digests = tapestry.TaskVerifyBlock(tgt, algorithm="blake2b")()
+    except (AttributeError, TypeError):
+        errors.append("[ERROR] tapestry.TaskVerifyBlock does not accept a digest algorithm.")
+        return errors
+    if digests != expected:
+        errors.append("[ERROR] TaskVerifyBlock returned %s where %s was expected." % (digests, expected))
+    check_passed, message = tapestry.TaskCheckIntegrity(tgt, "digest_a", expected["digest_a"], "blake2b")()
+    if not check_passed:
+        errors.append("[ERROR] TaskCheckIntegrity rejected a good BLAKE2b digest.")
+    check_passed, message = tapestry.TaskCheckIntegrity(tgt, "digest_a", expected["digest_a"])()
+    if check_passed:
+        errors.append("[ERROR] TaskCheckIntegrity accepted a BLAKE2b digest as SHA-256.")
+    hasher = tapestry.FileHasher(1, algorithm="blake2b")
+    if hasher.hash_file(os.path.join(temp, "digest_b")) != expected["digest_b"]:
+        errors.append("[ERROR] FileHasher did not hash with BLAKE2b.")
+    hasher.close()
+
+    path_riff = os.path.join(temp, "digest_test.riff")
+    for meta_run, algorithm in [({"sumBlock": 1}, "sha256"), ({"sumBlock": 1, "digestAlgorithm": "blake2b"}, "blake2b")]:
+        with open(path_riff, "w") as f:
+            json.dump({"metaBlock": {}, "metaRun": meta_run, "index": {}}, f)
+        with open(path_riff, "rb") as f:
+            found = tapestry.RecoveryIndex(f).digest_algorithm
+        if found != algorithm:
+            errors.append("[ERROR] The RIFF with metaRun %s was read as %s, not %s." % (meta_run, found, algorithm))
 
     return errors
 
@@ -673,8 +1518,9 @@ def test_TaskSign(config):
     return errors
 
 
-def test_TaskTarBuild(config):
-    """Simplified test of the TaskTarBuild class's call.
+def test_TaskBlockBuild(config):
+    """Simplified test of the TaskBlockBuild class's call. Builds a block of
+    two members in a single worker and checks both landed in the tarball.
 
     :param config:
     :return:
@@ -688,14 +1534,12 @@ def test_TaskTarBuild(config):
 
     test_queue = mp.JoinableQueue()
     q_response = mp.JoinableQueue()
-    test_task = tapestry.TaskTarBuild(tgt+".tar", "hash_test", tgt, "foo")
+    members = [("hash_test", tgt), ("hash_test_copy", tgt+".bak")]
+    test_task = tapestry.TaskBlockBuild(tgt+".tar", members)
     test_queue.put(test_task)
-    dict_locks = {}
-    dict_locks.update({"foo": mp.Lock()})
 
     worker = tapestry.ChildProcess(test_queue, q_response,
-                                   config["path_temp"], dict_locks, True)
-    # we need to do this to provide the locks dictionary
+                                   config["path_temp"], {}, True)
 
     worker.start()  # So trigger the worker
     test_queue.join()  # And wait for it to complete
@@ -704,10 +1548,319 @@ def test_TaskTarBuild(config):
     test_queue.put(None)  # Poison pill to kill the child process.
 
     if os.path.exists(tgt+".tar"):
-        pass  # doing this here leaves len(errors)=0, which is the test_case pass condition.
+        with tarfile.open(tgt+".tar", "r:") as tf:
+            names = tf.getnames()
+        if names != ["hash_test", "hash_test_copy"]:
+            errors.append("[ERROR] The tarball did not contain the expected members: %s" % names)
     else:
-        errors.append("[ERROR] Test tarball was not created. See response from TaskTarBuild below.")
-        errors.append("Response: " % response)
+        errors.append("[ERROR] Test tarball was not created. See response from TaskBlockBuild below.")
+        errors.append("Response: %s" % response)
+
+    return errors
+
+
+def test_TaskBlockBuild_fused(config):
+    """Builds a one-member block with fused hashing enabled and checks that the
+    digest returned by the task matches the file. Then wraps a file in a
+    tapestry.HashingReader which expects more bytes than the file holds, to
+    check that the short read is padded and flagged.
+
+    :param config:
+    :return:
+    """
+    errors = []
+    temp = config["path_temp"]
+    tgt = os.path.join(temp, "fused_test")
+    with open(tgt, "w") as f:
+        for i in range(1000):
+            f.write(choice(printable))
+    with open(tgt, "rb") as f:
+        expected = hashlib.sha256(f.read()).hexdigest()
+
+    try:
+        test_task = tapestry.TaskBlockBuild(tgt+".tar", [("fused_test", tgt)], hash_files=True)
+    except TypeError:
+        errors.append("[ERROR] TaskBlockBuild does not accept the hash_files argument.")
+        return errors
+    message, digests, skipped = test_task()
+    result = digests.get("fused_test", {})
+    if result.get("sha256") != expected or result.get("fsize") != 1000:
+        errors.append("[ERROR] The task returned %s for a file with digest %s." % (result, expected))
+    if result.get("changed") is not False:
+        errors.append("[ERROR] An unchanged file was flagged as changed during reading.")
+
+    with open(tgt, "rb") as f:
+        try:
+            reader = tapestry.HashingReader(f, 1010)
+        except AttributeError:
+            errors.append("[ERROR] tapestry.HashingReader is not defined.")
+            return errors
+        data = reader.read(1010)
+    if len(data) != 1010 or not reader.short:
+        errors.append("[ERROR] HashingReader did not pad and flag a file shorter than expected.")
+
+    return errors
+
+
+def test_finalize_fused_index(config):
+    """Packs a block of three random files with fused hashing, so that the
+    tarfile has no RIFF, then completes it with finalize_fused_index. The
+    RIFF must be appended over the end-of-archive marker and read back from
+    the block with the digests measured while packing, and every member must
+    still be intact.
+
+    :param config: dict_config
+    :return:
+    """
+    errors = []
+    temp = config["path_temp"]
+    block = tapestry.Block("fusedriff-1", 10000000, 1, 0)
+    members = []
+    expected = {}
+    ops_list = {}
+    for name in ["fusedriff_a", "fusedriff_b", "fusedriff_c"]:
+        path = os.path.join(temp, name)
+        with open(path, "w") as f:
+            for i in range(3000):
+                f.write(choice(printable))
+        with open(path, "rb") as f:
+            expected.update({name: hashlib.sha256(f.read()).hexdigest()})
+        ops_list.update({name: {"fname": name, "sha256": None, "category": "test", "fpath": name, "fsize": 3000}})
+        block.put(name, ops_list[name])
+        members.append((name, path))
+    tgt = os.path.join(temp, "fusedriff-1.tar")
+    message, digests, skipped = tapestry.TaskBlockBuild(tgt, members, hash_files=True)()
+
+    namespace = tapestry.Namespace()
+    namespace.hash_cache_path = None
+    namespace.digest_algorithm = "sha256"
+    namespace.category_paths = {"test": temp}
+    namespace.logs = config["logs"]
+    namespace.sum_size = 9000
+    namespace.comment_string = None
+    namespace.drop = temp
+    namespace.base_run = None
+    namespace.referenced_runs = []
+    try:
+        tapestry.finalize_fused_index([block], [tgt], ops_list, digests, namespace)
+    except AttributeError:
+        errors.append("[ERROR] tapestry.finalize_fused_index is not defined.")
+        return errors
+
+    try:
+        with tarfile.open(tgt, "r:") as tf:
+            names = tf.getnames()
+            with open(os.path.join(temp, "fusedriff-riff"), "wb") as f:
+                f.write(tf.extractfile("recovery-riff").read())
+            for name in expected:
+                if hashlib.sha256(tf.extractfile(name).read()).hexdigest() != expected[name]:
+                    errors.append("[ERROR] %s was damaged when the RIFF was appended." % name)
+    except (tarfile.TarError, KeyError) as e:
+        errors.append("[ERROR] The RIFF could not be read back from the finalized block: %s" % e)
+        return errors
+    if sorted(names) != sorted(list(expected) + ["recovery-riff"]):
+        errors.append("[ERROR] The finalized block holds %s." % names)
+    with open(os.path.join(temp, "fusedriff-riff"), "rb") as f:
+        index = tapestry.RecoveryIndex(f)
+    for name in expected:
+        if index.file_index.get(name, {}).get("sha256") != expected[name]:
+            errors.append("[ERROR] The RIFF does not carry the digest measured for %s." % name)
+
+    return errors
+
+
+def test_block_missing_member(config):
+    """Packs a block of three random files, the second of which has been
+    deleted since it was crawled, once with TaskBlockBuild and once with
+    TaskBlockStream. Each must finish the block with the other two files and
+    its RIFF, report the missing file, and leave it out of the RIFF.
+
+    :param config: dict_config
+    :return:
+    """
+    errors = []
+    temp = config["path_temp"]
+    gpg = gnupg.GPG()
+    members = []
+    block = tapestry.Block("missing-1", 10000000, 1, 0)
+    for name in ["missing_a", "missing_b", "missing_c"]:
+        path = os.path.join(temp, name)
+        with open(path, "w") as f:
+            for i in range(3000):
+                f.write(choice(printable))
+        block.put(name, {"fname": name, "sha256": None, "category": "test", "fpath": name, "fsize": 3000,
+                         "block": 1})
+        members.append((name, path))
+    os.remove(members[1][1])
+
+    riff = block.meta(1, 9000, 3, str(date.today()), None, block.file_index, temp)
+    tgt = os.path.join(temp, "missing-1.tar")
+    try:
+        message, layout, skipped = tapestry.TaskBlockBuild(tgt, members, riff)()
+    except OSError as e:
+        errors.append("[ERROR] TaskBlockBuild failed the block over the missing file: %s" % e)
+        return errors
+    if list(skipped) != ["missing_b"] or sorted(layout) != ["missing_a", "missing_c"]:
+        errors.append("[ERROR] TaskBlockBuild packed %s and reported %s as missing." % (sorted(layout), skipped))
+    with tarfile.open(tgt, "r:") as tf:
+        names = tf.getnames()
+        stored_riff = json.load(tf.extractfile("recovery-riff"))
+    if names != ["missing_a", "missing_c", "recovery-riff"]:
+        errors.append("[ERROR] The packed block contained %s." % names)
+    if sorted(stored_riff["index"]) != ["missing_a", "missing_c"]:
+        errors.append("[ERROR] The packed block's RIFF indexed %s." % sorted(stored_riff["index"]))
+
+    riff = block.meta(1, 9000, 3, str(date.today()), None, block.file_index, temp)
+    tap = os.path.join(temp, "missing-1.tap")
+    block_ok, message, digests, skipped = tapestry.TaskBlockStream(tap, members, riff, config["test_fp"], gpg)()
+    if not block_ok:
+        errors.append("[ERROR] TaskBlockStream failed the block over the missing file: %s" % message)
+    elif list(skipped) != ["missing_b"] or sorted(digests) != ["missing_a", "missing_c"]:
+        errors.append("[ERROR] TaskBlockStream streamed %s and reported %s as missing." % (sorted(digests), skipped))
+
+    return errors
+
+
+def test_TaskBlockStream(config):
+    """Streams a block of two random files straight into an encrypted .tap
+    with TaskBlockStream, then decrypts the result and checks that it is a
+    compressed tarball holding both members, and that the digests returned
+    by the task are correct. Streaming to a key gpg doesn't hold must fail
+    the task rather than raise.
+
+    :param config: dict_config
+    :return:
+    """
+    errors = []
+    temp = config["path_temp"]
+    gpg = gnupg.GPG()
+    members = []
+    expected = {}
+    for name in ["stream_a", "stream_b"]:
+        path = os.path.join(temp, name)
+        with open(path, "w") as f:
+            for i in range(5000):
+                f.write(choice(printable))
+        with open(path, "rb") as f:
+            expected.update({name: hashlib.sha256(f.read()).hexdigest()})
+        members.append((name, path))
+    tap = os.path.join(temp, "stream_test.tap")
+
+    try:
+        test_task = tapestry.TaskBlockStream(tap, members, None, config["test_fp"], gpg, 1)
+    except AttributeError:
+        errors.append("[ERROR] tapestry.TaskBlockStream is not defined.")
+        return errors
+    path_large = os.path.join(temp, "stream_large")  # More than the pipe holds, so gpg breaks it by refusing.
+    with open(path_large, "wb") as f:
+        f.write(os.urandom(4194304))
+    try:  # gpg rejects a key it doesn't hold, which must fail the block rather than raise.
+        if tapestry.TaskBlockStream(tap+".rejected", [("stream_large", path_large)], None, "0" * 40, gpg)()[0]:
+            errors.append("[ERROR] A block was reported as streamed to a key gpg does not hold.")
+    except Exception as e:
+        errors.append("[ERROR] Streaming to a key gpg does not hold raised %r." % e)
+    block_ok, message, digests, skipped = test_task()
+    if not block_ok:
+        errors.append("[ERROR] The block was not streamed: %s" % message)
+        return errors
+    for name in expected:
+        if digests.get(name, {}).get("sha256") != expected[name]:
+            errors.append("[ERROR] The digest returned for %s was incorrect." % name)
+
+    with open(tap, "rb") as f:
+        gpg.decrypt_file(f, always_trust=True, output=tap+".decrypted")
+    try:
+        with tarfile.open(tap+".decrypted", "r:bz2") as tf:
+            names = tf.getnames()
+        if names != ["stream_a", "stream_b"]:
+            errors.append("[ERROR] The streamed block contained %s." % names)
+    except (tarfile.TarError, OSError):
+        errors.append("[ERROR] The decrypted block was not a bz2-compressed tarball.")
+
+    return errors
+
+
+def test_TaskBlockRestore(config):
+    """Streams three random files into an encrypted .tap with
+    TaskBlockStream, then restores two of them straight from the .tap with
+    TaskBlockRestore. The files must be restored intact, the third left
+    alone, and no decrypted copy of the block left behind.
+
+    :param config: dict_config
+    :return:
+    """
+    errors = []
+    temp = config["path_temp"]
+    out = os.path.join(temp, "restore_out")
+    gpg = gnupg.GPG()
+    members = []
+    expected = {}
+    for name in ["restore_a", "restore_b", "restore_c"]:
+        path = os.path.join(temp, name)
+        with open(path, "w") as f:
+            for i in range(5000):
+                f.write(choice(printable))
+        with open(path, "rb") as f:
+            expected.update({name: hashlib.sha256(f.read()).hexdigest()})
+        members.append((name, path))
+    tap = os.path.join(temp, "restore_test.tap")
+    tapestry.TaskBlockStream(tap, members, None, config["test_fp"], gpg, 1)()
+    restored = {"restore_c": "one/c.txt", "restore_a": "two/a.txt"}
+    entries = [(name, out, path_end) for name, path_end in restored.items()]
+
+    try:
+        test_task = tapestry.TaskBlockRestore(tap, entries, gpg)
+    except AttributeError:
+        errors.append("[ERROR] tapestry.TaskBlockRestore is not defined.")
+        return errors
+    block_ok, message, failures = test_task()
+    if not block_ok or failures:
+        errors.append("[ERROR] The block was not restored: %s %s" % (message, failures))
+    for name, path_end in restored.items():
+        path = os.path.join(out, path_end)
+        if not os.path.isfile(path):
+            errors.append("[ERROR] %s was not restored to %s." % (name, path))
+            continue
+        with open(path, "rb") as f:
+            if hashlib.sha256(f.read()).hexdigest() != expected[name]:
+                errors.append("[ERROR] %s was changed when it was restored." % name)
+    if os.path.exists(os.path.join(out, "restore_b")):
+        errors.append("[ERROR] A file which was not asked for was restored.")
+    if os.path.exists(tap+".decrypted"):
+        errors.append("[ERROR] A decrypted copy of the block was written.")
+
+    return errors
+
+
+def test_TaskStage(config):
+    """Wraps a TaskCompress in a TaskStage and checks that the result comes
+    back tagged with its stage and block, along with the time spent on the
+    work, and that the wrapped task actually ran.
+
+    :param config: dict_config
+    :return:
+    """
+    errors = []
+    temp = config["path_temp"]
+    tgt = os.path.join(temp, "stage_test")
+    with open(tgt, "w") as f:
+        for i in range(5000):
+            f.write(choice(printable))
+
+    try:
+        test_task = tapestry.TaskStage("compress", "stage-block", tapestry.TaskCompress(tgt, 1))
+    except AttributeError:
+        errors.append("[ERROR] tapestry.TaskStage is not defined.")
+        return errors
+    stage, block, result, elapsed = test_task()
+    if stage != "compress" or block != "stage-block":
+        errors.append("[ERROR] The result was tagged as %s/%s." % (stage, block))
+    if not result.startswith("Compressed"):
+        errors.append("[ERROR] The wrapped task returned: %s" % result)
+    if not os.path.isfile(tgt+".bz2"):
+        errors.append("[ERROR] The wrapped task did not produce its output.")
+    if not isinstance(elapsed, float) or elapsed < 0:
+        errors.append("[ERROR] The elapsed time returned was %s." % elapsed)
 
     return errors
 
@@ -746,6 +1899,289 @@ def test_TaskTarUnpack(config):
     return errors
 
 
+def test_TaskTarExtractBlock(config):
+    """Builds a compressed block of four random files and restores three of
+    them, plus one FID that isn't in the block, into two directories with a
+    single TaskTarExtractBlock. The files must be restored intact, and the
+    missing one reported without stopping the rest.
+
+    :param config: dict_config
+    :return:
+    """
+    errors = []
+    temp = config["path_temp"]
+    out = os.path.join(temp, "extract_out")
+    tgt = os.path.join(temp, "extract_test.tar.bz2")
+    expected = {}
+    with tarfile.open(tgt, "w:bz2") as tf:
+        for name in ["extract_a", "extract_b", "extract_c", "extract_d"]:
+            path = os.path.join(temp, name)
+            with open(path, "w") as f:
+                for i in range(5000):
+                    f.write(choice(printable))
+            with open(path, "rb") as f:
+                expected.update({name: hashlib.sha256(f.read()).hexdigest()})
+            tf.add(path, arcname=name)
+    restored = {"extract_d": "one/d.txt", "extract_a": "two/deeper/a.txt", "extract_b": "one/b.txt"}
+    entries = [(name, out, path_end) for name, path_end in restored.items()]
+    entries.append(("extract_missing", out, "m.txt"))
+
+    try:
+        test_task = tapestry.TaskTarExtractBlock(tgt, entries)
+    except AttributeError:
+        errors.append("[ERROR] tapestry.TaskTarExtractBlock is not defined.")
+        return errors
+    block_ok, message, failures = test_task()
+    if block_ok or list(failures) != ["extract_missing"]:
+        errors.append("[ERROR] The missing file was not reported correctly: %s" % failures)
+    for name, path_end in restored.items():
+        path = os.path.join(out, path_end)
+        if not os.path.isfile(path):
+            errors.append("[ERROR] %s was not restored to %s." % (name, path))
+            continue
+        with open(path, "rb") as f:
+            if hashlib.sha256(f.read()).hexdigest() != expected[name]:
+                errors.append("[ERROR] %s was changed when it was restored." % name)
+    if os.path.exists(os.path.join(out, "extract_c")):
+        errors.append("[ERROR] A file which was not asked for was restored.")
+
+    return errors
+
+
+def test_block_layout(config):
+    """Packs a block of three random files with TaskBlockBuild and checks that
+    the RIFF inside it records each file's block, and the offset and length
+    the task reported for it. The block is then compressed and the files are
+    restored from it by a TaskTarExtractBlock.
+
+    :param config: dict_config
+    :return:
+    """
+    errors = []
+    temp = config["path_temp"]
+    out = os.path.join(temp, "layout_out")
+    block = tapestry.Block("layout-1", 10000000, 1, 0)
+    members = []
+    expected = {}
+    for name in ["layout_a", "layout_b", "layout_c"]:
+        path = os.path.join(temp, name)
+        with open(path, "w") as f:
+            for i in range(3000):
+                f.write(choice(printable))
+        with open(path, "rb") as f:
+            expected.update({name: hashlib.sha256(f.read()).hexdigest()})
+        block.put(name, {"fname": name, "sha256": expected[name], "category": "test",
+                         "fpath": name+".txt", "fsize": 3000, "block": 1})
+        members.append((name, path))
+    riff = block.meta(1, 9000, 3, str(date.today()), None, block.file_index, temp)
+    tgt = os.path.join(temp, "layout-1.tar")
+    message, layout, skipped = tapestry.TaskBlockBuild(tgt, members, riff)()
+
+    with tarfile.open(tgt, "r:") as tf:
+        with open(os.path.join(temp, "layout-riff"), "wb") as f:
+            f.write(tf.extractfile("recovery-riff").read())
+    with open(os.path.join(temp, "layout-riff"), "rb") as f:
+        index = tapestry.RecoveryIndex(f)
+    for name in expected:
+        try:
+            located = index.locate(name)
+        except AttributeError:
+            errors.append("[ERROR] tapestry.RecoveryIndex.locate is not defined.")
+            return errors
+        if located != (None, 1, layout[name]["offset"], layout[name]["length"]):
+            errors.append("[ERROR] %s was located at %s, but packed at %s." % (name, located, layout.get(name)))
+
+    with open(tgt, "rb") as f:
+        with bz2.open(tgt+".bz2", "wb") as compressed:
+            compressed.write(f.read())
+    entries = [(name, out, name+".txt") for name in expected]
+    extract_ok, message, failures = tapestry.TaskTarExtractBlock(tgt+".bz2", entries)()
+    if not extract_ok:
+        errors.append("[ERROR] The block could not be restored: %s" % failures)
+    for name in expected:
+        path = os.path.join(out, name+".txt")
+        if not os.path.isfile(path):
+            errors.append("[ERROR] %s was not restored." % name)
+            continue
+        with open(path, "rb") as f:
+            if hashlib.sha256(f.read()).hexdigest() != expected[name]:
+                errors.append("[ERROR] %s was changed when it was restored." % name)
+
+    return errors
+
+
+def test_select_restore(config):
+    """Writes a small RIFF in which every file is mapped to a block, then
+    checks that path, directory, glob and category filters select the right
+    files, and that only the blocks holding them are asked for.
+
+    :param config: dict_config
+    :return:
+    """
+    errors = []
+    temp = config["path_temp"]
+    index = {
+        "fid_a": {"fname": "a.txt", "category": "docs", "fpath": "letters/a.txt", "fsize": 1, "block": 1},
+        "fid_b": {"fname": "b.ods", "category": "docs", "fpath": "sheets/b.ods", "fsize": 1, "block": 2},
+        "fid_c": {"fname": "c.jpg", "category": "photos", "fpath": "2019/c.jpg", "fsize": 1, "block": 2},
+        "fid_d": {"fname": "d.txt", "category": "docs", "fpath": "letters/old/d.txt", "fsize": 1,
+                  "block": 4, "run": "select-2019-01-01"}
+    }
+    riff = {"metaBlock": {}, "metaRun": {"sumBlock": 3, "referencedRuns": ["select-2019-01-01"]},
+            "indexScope": "run", "index": index}
+    with open(os.path.join(temp, "select-riff"), "w") as f:
+        json.dump(riff, f)
+    with open(os.path.join(temp, "select-riff"), "rb") as f:
+        rec_index = tapestry.RecoveryIndex(f)
+
+    cases = [
+        ([], [], None),
+        (["letters"], None, {"fid_a", "fid_d"}),
+        (["*.ods"], None, {"fid_b"}),
+        (["docs/letters/a.txt"], None, {"fid_a"}),
+        (None, ["photos"], {"fid_c"}),
+        (["*.txt"], ["photos"], set())
+    ]
+    for paths, categories, expected in cases:
+        try:
+            selected = tapestry.select_restore_files(rec_index, paths, categories)
+        except AttributeError:
+            errors.append("[ERROR] tapestry.select_restore_files is not defined.")
+            return errors
+        if selected != expected:
+            errors.append("[ERROR] Filtering on %s and %s selected %s." % (paths, categories, selected))
+
+    wanted = tapestry.select_restore_blocks(rec_index, "select-2020-01-01", ["letters"], None, config["logs"])
+    if wanted != {("select-2020-01-01", 1), ("select-2019-01-01", 4)}:
+        errors.append("[ERROR] The blocks selected for the letters directory were %s." % wanted)
+
+    return errors
+
+
+def test_TaskVerifyBlock(config):
+    """Builds a small bz2-compressed block of two random files and a stand-in
+    RIFF, then checks that TaskVerifyBlock returns the correct digest for
+    each file in one pass, and skips the RIFF.
+
+    :param config: dict_config
+    :return:
+    """
+    errors = []
+    temp = config["path_temp"]
+    expected = {}
+    tgt = os.path.join(temp, "verify_test.tar.bz2")
+    with tarfile.open(tgt, "w:bz2") as tf:
+        for name in ["verify_a", "verify_b", "recovery-riff"]:
+            path = os.path.join(temp, name)
+            with open(path, "w") as f:
+                for i in range(5000):
+                    f.write(choice(printable))
+            with open(path, "rb") as f:
+                expected.update({name: hashlib.sha256(f.read()).hexdigest()})
+            tf.add(path, arcname=name)
+    expected.pop("recovery-riff")
+
+    try:
+        test_task = tapestry.TaskVerifyBlock(tgt, chunk_size=1024)
+    except AttributeError:
+        errors.append("[ERROR] tapestry.TaskVerifyBlock is not defined.")
+        return errors
+    block_ok, message, digests = test_task()
+    if not block_ok:
+        errors.append("[ERROR] The block could not be read: %s" % message)
+    if digests != expected:
+        errors.append("[ERROR] The task returned %s where %s was expected." % (digests, expected))
+
+    return errors
+
+
+def test_WorkerPool(config):
+    """Runs one good and one bad TaskCompress on a two-worker WorkerPool and
+    checks that both come back as TaskResults, the bad one carrying its
+    error instead of killing its worker, then checks that the same workers
+    are still there for a second batch and are gone after shutdown.
+
+    :param config: dict_config
+    :return:
+    """
+    errors = []
+    temp = config["path_temp"]
+    tgt = os.path.join(temp, "pool_test")
+    with open(tgt, "w") as f:
+        for i in range(5000):
+            f.write(choice(printable))
+    tasks = [tapestry.TaskCompress(tgt, 1), tapestry.TaskCompress(os.path.join(temp, "pool_missing"), 1)]
+
+    try:
+        pool = tapestry.WorkerPool(temp, 2).start()
+    except AttributeError:
+        errors.append("[ERROR] tapestry.WorkerPool is not defined.")
+        return errors
+    try:
+        pids = [worker.pid for worker in pool.workers]
+        results = {result.task_id: result for result in pool.run(tasks)}
+        if sorted(results) != [0, 1]:
+            errors.append("[ERROR] The pool returned results for tasks %s." % sorted(results))
+        else:
+            if not results[0].ok or not results[0].value.startswith("Compressed"):
+                errors.append("[ERROR] The good task returned: %s" % results[0])
+            if results[1].ok or "FileNotFoundError" not in results[1].error:
+                errors.append("[ERROR] The bad task's exception was not captured: %s" % results[1])
+        second = list(pool.run([tapestry.TaskCompress(tgt, 1)]))
+        if len(second) != 1 or not second[0].ok:
+            errors.append("[ERROR] The pool could not run a second batch of tasks.")
+        if [worker.pid for worker in pool.workers] != pids:
+            errors.append("[ERROR] The workers were replaced between batches.")
+    finally:
+        workers = pool.workers
+        pool.shutdown()
+    if any([worker.is_alive() for worker in workers]):
+        errors.append("[ERROR] Some workers were still alive after shutdown.")
+
+    return errors
+
+
+def test_run_tasks_failures(config):
+    """Runs a good and a bad TaskCompress through tapestry.run_tasks. Without
+    fatal, the bad task must come back as a failed TaskResult for the caller.
+    With fatal, as the build stages run it, the run must be stopped with exit
+    code 7 and its working directory cleared.
+
+    :param config: dict_config
+    :return:
+    """
+    errors = []
+    temp = config["path_temp"]
+    tgt = os.path.join(temp, "run_tasks_test")
+    with open(tgt, "w") as f:
+        f.write(printable * 100)
+    namespace = tapestry.Namespace()
+    namespace.debug = False
+    namespace.workDir = os.path.join(temp, "run_tasks_work")
+    os.makedirs(namespace.workDir, exist_ok=True)
+    namespace.logs = tapestry.SimpleLogger(temp, "run_tasks.log", "test", "test", "none")
+    namespace.pool = tapestry.WorkerPool(temp, 2).start()
+    try:
+        results = tapestry.run_tasks(namespace, [tapestry.TaskCompress(tgt, 1),
+                                                 tapestry.TaskCompress(os.path.join(temp, "run_tasks_missing"), 1)],
+                                     "Compressing")
+        if sorted(result.ok for result in results) != [False, True]:
+            errors.append("[ERROR] Without fatal, the results were: %s" % [str(result) for result in results])
+        try:
+            tapestry.run_tasks(namespace, [tapestry.TaskCompress(os.path.join(temp, "run_tasks_missing"), 1)],
+                               "Compressing", fatal=True)
+            errors.append("[ERROR] A failed task did not stop the run when fatal was set.")
+        except SystemExit as e:
+            if e.code != 7:
+                errors.append("[ERROR] The run was stopped with exit code %s, not 7." % e.code)
+        if os.path.exists(namespace.workDir):
+            errors.append("[ERROR] The working directory was not cleared when the run was stopped.")
+    finally:
+        namespace.pool.shutdown()
+
+    return errors
+
+
 def test_media_retrieve_files(config):
     """This is a simple test that uses an expected pair of files to call the
     media_retrieve_files function from tapestry, then inspects the filesystem
@@ -794,6 +2230,99 @@ def test_media_retrieve_files(config):
     return errors
 
 
+def test_media_select_run(config):
+    """Offers media_select_run the blocks of one run, then of three, with the
+    user's responses replaced by a list of canned answers. A single run must
+    be chosen without asking, an empty response must pick the most recent
+    run, and a bad response must be asked again.
+
+    :param config: dict_config
+    :return:
+    """
+    errors = []
+    one_run = ["test-2019-01-01-0.tap", "test-2019-01-01-1.tap"]
+    three_runs = one_run + ["test-2019-03-01-0.tap", "test-2019-02-01-0.tap", "test-2019-02-01-1.tap"]
+    cases = [
+        (one_run, [], "test-2019-01-01"),
+        (three_runs, [""], "test-2019-03-01"),
+        (three_runs, ["2"], "test-2019-02-01"),
+        (three_runs, ["4", "yes", "3"], "test-2019-01-01")
+    ]
+    real_input = builtins.input
+    try:
+        for found_blocks, responses, expected in cases:
+            answers = list(responses)
+            builtins.input = lambda prompt="": answers.pop(0)
+            try:
+                selected = tapestry.media_select_run(found_blocks, config["logs"])
+            except IndexError:
+                errors.append("[ERROR] media_select_run asked more questions than expected for %s." % responses)
+                continue
+            if selected != expected:
+                errors.append("[ERROR] With the responses %s, media_select_run chose %s, not %s."
+                              % (responses, selected, expected))
+            if answers:
+                errors.append("[ERROR] media_select_run did not use every response in %s." % responses)
+    finally:
+        builtins.input = real_input
+
+    return errors
+
+
+def test_run_manifest(config):
+    """Writes a run manifest for a drop directory holding two dummy blocks of
+    the current run and one of an older run, with write_run_manifest, then
+    reads it back with load_run_manifest. Only the current run's blocks must
+    be named, with their sizes, and the manifest must be signed.
+
+    :param config: dict_config
+    :return:
+    """
+    errors = []
+    drop = os.path.join(config["path_temp"], "manifest_drop")
+    os.makedirs(drop, exist_ok=True)
+    run = "test-%s" % date.today()
+    sizes = {run+"-0.tap": 100, run+"-1.tap": 2500}
+    for name, size in sizes.items():
+        with open(os.path.join(drop, name), "wb") as f:
+            f.write(os.urandom(size))
+    with open(os.path.join(drop, "test-2001-01-01-1.tap"), "wb") as f:
+        f.write(os.urandom(50))
+    namespace = tapestry.Namespace()
+    namespace.drop = drop
+    namespace.compid = "test"
+    namespace.comment_string = "manifest test"
+    namespace.sum_blocks = 1
+    namespace.sum_size = 2000
+    namespace.base_run = None
+    namespace.referenced_runs = []
+    namespace.activeFP = config["test_fp"]
+    namespace.sigFP = config["test_fp"]
+    namespace.logs = config["logs"]
+    ops_list = {"a": {"fsize": 1000}, "b": {"fsize": 1000}, "c": {"fsize": 10, "run": "test-2001-01-01"}}
+
+    try:
+        paths = tapestry.write_run_manifest(ops_list, namespace, gnupg.GPG())
+    except AttributeError:
+        errors.append("[ERROR] tapestry.write_run_manifest is not defined.")
+        return errors
+    if paths != [os.path.join(drop, run+"-0.manifest"), os.path.join(drop, run+"-0.manifest.sig")]:
+        errors.append("[ERROR] The manifest was not written where expected: %s" % paths)
+        return errors
+    manifest = tapestry.load_run_manifest(paths[0], gnupg.GPG(), config["logs"])
+    if manifest is None:
+        errors.append("[ERROR] The manifest could not be verified and read back.")
+        return errors
+    if manifest["blocks"] != sizes:
+        errors.append("[ERROR] The manifest named the wrong blocks: %s" % manifest["blocks"])
+    if manifest["indexBlock"] != run+"-0.tap":
+        errors.append("[ERROR] The manifest did not name the index block.")
+    if manifest["metaRun"]["countFilesSum"] != 2 or manifest["metaRun"]["comment"] != "manifest test":
+        errors.append("[ERROR] The manifest's run metadata was incorrect: %s" % manifest["metaRun"])
+
+    return errors
+
+
 def test_parse_config(ns):
     """Loads an expected control config file, running it through (parse_config),
     then performs validation against the resulting NS object.